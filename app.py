@@ -1,119 +1,115 @@
 
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
 import os
-import requests
-
-import matplotlib.pyplot as plt
 import io
-from PIL import Image
-import base64
-
-from datetime import datetime
-from linebot.v3 import WebhookHandler
-from linebot.v3.messaging import (
-    Configuration, ApiClient, MessagingApi,
-    TextMessage, ReplyMessageRequest,  ImageMessage 
-)
+import hmac
+import time
+
+from datetime import datetime, timedelta
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
 from linebot.v3.exceptions import InvalidSignatureError
 from dotenv import load_dotenv
 load_dotenv()
 
-from inr_chart import generate_inr_chart
-from flask import send_file  # อย่าลืม import นี้ด้านบน
-from linebot.v3.messaging import FlexMessage
-from linebot.v3.messaging.models import FlexContainer
-from linebot.v3.messaging import QuickReply, QuickReplyItem, MessageAction
-
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
-import requests
-
-DOSE_DESC_MAP = {
-    "0": "งดยา",
-    "0.75": "เม็ดสีฟ้า เสี้ยว เม็ด",
-    "1.25": "เม็ดสีชมพู เสี้ยว เม็ด",
-    "1.5": "เม็ดสีฟ้า ครึ่ง เม็ด",
-    "2": "เม็ดสีฟ้า เสี้ยว เม็ด + เม็ดสีชมพู เสี้ยว เม็ด",
-    "2.25": "เม็ดสีฟ้า 3 ใน 4  เม็ด",
-    "2.5": "เม็ดสีชมพู ครึ่ง เม็ด",
-    "2.75": " เม็ดสีฟ้าครึ่งเม็ด + ชมพู เสี้ยวเม็ด",
-    "3": "เม็ดสีฟ้า 1 เม็ด",
-    "3.25": "เม็ดสีฟ้า เสี้ยว เม็ด + ชมพู ครึ่ง เม็ด",
-    "3.5": "เม็ดสีฟ้า 3 ใน 4 เม็ด + ชมพู เสี้ยว เม็ด",
-    "3.75": "เม็ดสีชมพู 3 ใน 4 เม็ด",
-    "4": "เม็ดสีฟ้า ครึ่ง เม็ด + ชมพู ครึ่ง เม็ด",
-    "4.25": "เม็ดสีฟ้า 1 เม็ด + ชมพู เสี้ยว เม็ด",
-    "4.5": "เม็ดสีฟ้า 1 เม็ด ครึ่ง",
-    "4.75": "เม็ดสีฟ้า 3 ใน 4 เม็ด + ชมพู ครึ่ง เม็ด",
-    "5": "เม็ดสีชมพู 1 เม็ด",
-    "5.25": " เม็ดสีฟ้า 1 เม็ด +  เม็ดสีฟ้า 3 ใน 4 เม็ด",
-    "5.5": " เม็ดสีฟ้า 1 เม็ด +  เม็ดสีชมพู ครึ่ง เม็ด",
-    "5.75": "เม็ดสีฟ้า เสี้ยว เม็ด + ชมพู 1 เม็ด",
-    "6": "เม็ดสีฟ้า 2 เม็ด",
-    "6.25": "เม็ดสีชมพู 1 เม็ด เสี้ยว",
-    "6.5": "เม็ดสีฟ้า ครึ่ง เม็ด +  เม็ดสีชมพู 1 เม็ด",
-    "6.75": "เม็ดสีฟ้า 1 เม็ด + เม็ดสีชมพู 3 ใน 4 เม็ด",
-    "7.25": "เม็ดสีฟ้า 3 ใน 4 เม็ด + เม็ดสีชมพู 1 เม็ด",
-    "7.5": "สีชมพู 1 เม็ด ครึ่ง",
-    "8": "เม็ดสีฟ้า 1 เม็ด + เม็ดสีชมพู 1 เม็ด",
-    "8.75": "เม็ดสีชมพู 1 เม็ด + เม็ดสีชมพู 3 ใน 4 เม็ด",
-    "9": "เม็ดสีฟ้า 3 เม็ด",
-    "10": "เม็ดสีชมพู 2 เม็ด"
-}
-
-DOSE_IMAGE_MAP = {
-  "0": "https://drive.google.com/uc?export=view&id=1C-xnILoUHREpjR7R7CRTXNM2GZcbBGGl",
-  "0.75": "https://drive.google.com/uc?export=view&id=1oLJSf3pl3Aegci4V3vWlCNtIe1C1SezL",
-  "1.25": "https://drive.google.com/uc?export=view&id=1ZTcC9N36PX1zHQSXgOgG5WIZifnskOsm",
-  "1.5": "https://drive.google.com/uc?export=view&id=1mtlw2S1D3aFulnXWqWbuOqK4p3xvM56s",
-  "2": "https://drive.google.com/uc?export=view&id=1Oqxk2xddHLeX-4V47vcKDJ4ZuzNzsuvQ",
-  "2.25": "https://drive.google.com/uc?export=view&id=12jQ5jGHTa2wGRxUaJ8S1B82DKYqxD02u",
-  "2.5": "https://drive.google.com/uc?export=view&id=1Y7YfElYjNYCkY4ljmE9MJNXesHYuFFXd",
-  "2.75": "https://drive.google.com/uc?export=view&id=1ZXf111FIpxrl37eMyVdxrhF3QF1QvgWw",
-  "3": "https://drive.google.com/uc?export=view&id=1E9q3rkXD4ThRFxFbiRxs4BkgSNPuRYJx",
-  "3.25": "https://drive.google.com/uc?export=view&id=1YKMs-h-gGLDYg0vI0byZ_4zTf0uXWXyh",
-  "3.5": "https://drive.google.com/uc?export=view&id=1EREz7P9-GI_8mERjTUtQ5k_fyqOfigSP",
-  "3.75": "https://drive.google.com/uc?export=view&id=1DLbTm8grBHk5OCp9q6ZsJhePfc-W1DGp",
-  "4": "https://drive.google.com/uc?export=view&id=1tgXDrVC3nWH10WsDauxVOdycZ3uUKnbX",
-  "4.25": "https://drive.google.com/uc?export=view&id=1elqoZlPgSZVoSpyv_HOzJqHCnaK-O4DQ",
-  "4.5": "https://drive.google.com/uc?export=view&id=1Zk8isy0hd0HRfeegSpNqPUZeDyRCK1TF",
-  "4.75": "https://drive.google.com/uc?export=view&id=1B4M4Eyw2S_yuZmcFsWloxbmWPwMGgHXM",
-  "5": "https://drive.google.com/uc?export=view&id=1VL70qndziWlYHPrCVqHjE99jg6TrIHuN",
-  "5.25": "https://drive.google.com/uc?export=view&id=1pgIwUZ0u8ow9NlXX4qn8TYXfGY5QI1o0",
-  "5.5": "https://drive.google.com/uc?export=view&id=1uC5CxdWBrWy0aRKKKNt2AiizNZkE4Ha-",
-  "5.75": "https://drive.google.com/uc?export=view&id=1GLgVX1rC5kwh33cyYwJApgCzVEjYZkSs",
-  "6": "https://drive.google.com/uc?export=view&id=1DSH9PPRLrCtoZIsspNg72VMVPx4GMiQr",
-  "6.25": "https://drive.google.com/uc?export=view&id=1arIeHmlcCDjlZRCxaXp9HinNF5RFTObM",
-  "6.5": "https://drive.google.com/uc?export=view&id=14_c6VwFtimrUz_08KYi2eHrtz03IxVs0",
-  "6.75": "https://drive.google.com/uc?export=view&id=1TLkBttSsd-jgR3gF0PXtYadgwDDKvpLy",
-  "7.25": "https://drive.google.com/uc?export=view&id=1YMenxS-yjiYI9FMcxsWgWF8vrv7Nxk-K",
-  "7.5": "https://drive.google.com/uc?export=view&id=1FE_nDZGagBATeLFqVKsk8ZuyahFxyhH2",
-  "8": "https://drive.google.com/uc?export=view&id=1WGQkiYlkRFdqyxx8frbeMnH23xjPWQf7",
-  "8.75": "https://drive.google.com/uc?export=view&id=113hhEtD9drIp5FxG96YD1_icFDo0q5iJ",
-  "9": "https://drive.google.com/uc?export=view&id=1vA_ZmQV5VE-it-IsYPjxwt0NR8buIdhy",
-  "10": "https://drive.google.com/uc?export=view&id=1B4WnZ_6FD9ORgw1_WGbFbRpJMr81Z16Z",
-# เพิ่มได้ตามขนาดยา
-}
+# matplotlib / PIL / gspread / linebot.v3.messaging ถูก import ตอนใช้งานครั้งแรก
+# (cold start ไม่ต้องรอโหลดของที่ webhook ส่วนใหญ่ไม่ได้ใช้)
+from inr_chart import get_chart_renderer
+from warmup import LazyMessagingApi, start_warmup, WARMUP_DELAY_SECONDS
+
+import http_transport
+from notify_fanout import send_batches, push_message, build_messages
+from sheet_client import SPREADSHEET_ID, INR_HISTORY_SHEET, read_rows, read_history_by_user
+from reminder_plan import THAI_WEEKDAYS, load_plan, refresh_plan, start_plan_refresher
+from inr_repository import InrRepository, SheetSync, schedule_from_doses, split_name
+from sheet_outbox import enqueue, add_flush_listener, start_flusher, outbox_stats
+from inr_ingest import ingest, iter_records
+from inr_export import FORMATS, KINDS, export_stream, validate_filters
+from ttr_analytics import load_report, make_job_runner
+import weekly_reports
+from inr_alerts import AlertPipeline
+from event_queue import ShardedEventQueue, QueuedWebhookHandler, QueueFullError
+from chart_cache import ChartCache, submit_background
+from image_store import store_image_urls, serve_stored_image
+from session_store import create_session_store
+from conversation_router import ConversationRouter, MessageContext
+from notify_jobs import (
+    register_job_kind, start_job, load_job, job_status,
+    save_rows_snapshot, load_rows_snapshot, resume_pending_jobs, start_daily_schedule
+)
+from metrics import (
+    CHART_SECONDS, CONTENT_TYPE, Gauge, add_collector, install_flask_metrics, observe_dispatch, render_metrics
+)
+from dose_catalog import NO_DOSE, find_by_description, parse_dose, resolve_dose
+from dose_images import (
+    dose_image_urls, serve_dose_image, start_dose_image_warmup, wait_for_dose_images, dose_image_stats
+)
 
 
 # ====== LINE API Setup ======
 channel_secret = os.getenv("LINE_CHANNEL_SECRET")
 access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 
-handler = WebhookHandler(channel_secret)
-configuration = Configuration(access_token=access_token)
-messaging_api = MessagingApi(ApiClient(configuration))
+# event จาก webhook ถูกเข้าคิวแล้วตอบ LINE ทันที จากนั้น worker ค่อยประมวลผล
+event_queue = ShardedEventQueue()
+handler = QueuedWebhookHandler(channel_secret, event_queue)
+messaging_api = LazyMessagingApi(access_token)
 
 # ====== Flask Setup ======
 app = Flask(__name__)
+install_flask_metrics(app)
 
 # ====== Google Apps Script Webhook URL ======
-GOOGLE_APPS_SCRIPT_URL = "https://script.google.com/macros/s/AKfycbwdi3et7_H6dHFA7dTNRjNESjljUq1KZl2JOitV0fDkeVORlvyJMBgEEEG9nqAdSP4D/exec"
+GOOGLE_APPS_SCRIPT_URL = os.getenv(
+    "GOOGLE_APPS_SCRIPT_URL",
+    "https://script.google.com/macros/s/AKfycbwdi3et7_H6dHFA7dTNRjNESjljUq1KZl2JOitV0fDkeVORlvyJMBgEEEG9nqAdSP4D/exec"
+)
+
+# ====== Daily reminder ======
+# ใส่ชื่อผู้ป่วยในข้อความแจ้งเตือน (ปิดไว้เพื่อให้รวมส่งแบบ multicast ได้)
+NOTIFY_PERSONALIZE = os.getenv("NOTIFY_PERSONALIZE", "false").lower() in ("1", "true", "yes")
+# บันทึก checkpoint ทุกๆ กี่แถว
+NOTIFY_CHECKPOINT_ROWS = int(os.getenv("NOTIFY_CHECKPOINT_ROWS", "1000"))
+# เวลาที่งานแจ้งเตือนรอให้รูปขนาดยาพร้อมก่อนเริ่มส่ง (ถ้าไม่ทันจะใช้ลิงก์ Drive ไปก่อน)
+DOSE_IMAGE_WAIT_SECONDS = float(os.getenv("DOSE_IMAGE_WAIT_SECONDS", "60"))
+
+# ====== ข้อมูลผู้ป่วยในเครื่อง (profile / ประวัติ INR / ตารางยา) sync กับ Google Sheet เบื้องหลัง ======
+repository = InrRepository()
+sheet_sync = SheetSync(
+    repository,
+    fetch_profile=lambda user_id: _fetch_user_profile(user_id),
+    fetch_history=lambda user_id, since=None: _fetch_inr_history(user_id, since),
+    fetch_latest=lambda user_id: _fetch_latest_dose(user_id),
+    fetch_all_history=read_history_by_user if SPREADSHEET_ID and INR_HISTORY_SHEET else None,
+)
 
-# ====== In-Memory Session ======
-user_sessions = {}
+# ====== ข้อมูลในเครื่องถูกดึงจากชีตทีละคนเมื่อมีคนใช้งาน → งานที่คิดทั้ง cohort ต้องดึงผู้ป่วยที่เหลือ
+# และคนที่ข้อมูลเก่ากว่า INR_SYNC_MAX_AGE จากชีตก่อน (ตั้ง INR_HISTORY_SHEET ให้อ่านประวัติทุกคนใน batch_get เดียว) ======
+# cohort_coverage = ผลการดึงครั้งล่าสุด (partial = ข้อมูลในเครื่องอาจไม่ครบหรือไม่สดทุกคน)
+cohort_coverage = {"partial": True, "reason": "cohort not hydrated from the sheet yet"}
+
+def hydrate_cohort():
+    if not SPREADSHEET_ID:
+        coverage = {"partial": True, "reason": "SPREADSHEET_ID not set: only patients seen by this server"}
+    else:
+        user_ids = sorted({row["userID"] for row in read_rows(["userID"]) if row.get("userID")})
+        coverage = sheet_sync.hydrate(user_ids)
+        print(f"👥 ดึงข้อมูล cohort จากชีต: {coverage['cohort']} คน (refresh {coverage['fetched']}, "
+              f"ไม่สำเร็จ {coverage['failed']})")
+    coverage["checked_at"] = datetime.now().isoformat(timespec="seconds")
+    cohort_coverage.clear()
+    cohort_coverage.update(coverage)
+    return dict(coverage)
+
+# ====== แจ้งเตือนกลุ่ม LINE ของแพทย์เมื่อค่า INR ผิดปกติ (ตั้ง CLINICIAN_GROUP_ID; ไม่ตั้งจะแค่ log) ======
+alerts = AlertPipeline(send=lambda group_id, text: push_message(group_id, build_messages(text)))
+
+# ====== Cache กราฟ INR ======
+chart_cache = ChartCache()
+# กราฟแสดงเฉพาะค่า INR ล่าสุด N ค่า (ผู้ป่วยระยะยาวมีข้อมูลหลายปี)
+CHART_HISTORY_POINTS = int(os.getenv("CHART_HISTORY_POINTS", "12"))
+
+# ====== Session ของ flow บันทึก INR (SESSION_BACKEND=sqlite/redis ให้ session อยู่รอดหลัง restart) ======
+sessions = create_session_store()
 
 # ====== ฟังก์ชันส่งข้อมูลไป Google Sheet ======
 def send_to_google_sheet(user_id, name, birthdate, inr, bleeding="", supplement="", warfarin_dose=""):
@@ -127,10 +123,33 @@ def send_to_google_sheet(user_id, name, birthdate, inr, bleeding="", supplement=
         "warfarin_dose": warfarin_dose
     }
     try:
-        response = requests.post(GOOGLE_APPS_SCRIPT_URL, json=payload, timeout=10)
-        return response.text
+        # บันทึกลงฐานข้อมูลในเครื่องก่อน (อ่านกลับได้ทันที) แล้วเข้า outbox ให้ thread เบื้องหลังส่งไป Apps Script
+        ref = save_entry_locally(user_id, name, birthdate, inr, bleeding, supplement, warfarin_dose)
+        record_id = enqueue("inr", GOOGLE_APPS_SCRIPT_URL, payload, user_id=user_id, ref=ref)
     except Exception as e:
         return f"❌ Error: {str(e)}"
+    # ค่าใหม่อยู่ในฐานข้อมูลในเครื่องแล้ว → วาดกราฟใหม่เบื้องหลังทันที ไม่ต้องรอ outbox ส่งถึงชีต
+    submit_background(prerender_inr_chart, user_id)
+    # แจ้งเตือนแพทย์แยกจากการบันทึก: ฐานข้อมูล alert มีปัญหาต้องไม่ทำให้ค่านี้ไม่ถึงชีต
+    try:
+        alerts.submit(user_id, inr=inr, bleeding=bleeding, name=name)
+    except Exception as e:
+        print("❌ Error queueing INR alert:", e)
+    return f"queued #{record_id}"
+
+def describe_dose(dose):
+    entry = resolve_dose(dose)
+    return entry.description if entry and entry.description else f"{dose} mg"
+
+# คืน id ของแถวที่บันทึก (ref ของ outbox record) ให้ทำเครื่องหมายว่าถึงชีตแล้วได้ตรงแถว
+def save_entry_locally(user_id, name, birthdate, inr, bleeding, supplement, warfarin_dose):
+    first_name, last_name = split_name(name)
+    repository.upsert_patient(user_id, first_name, last_name, birthdate or None)
+    ref = {"profile": True, "reading_id": repository.add_reading(user_id, inr, bleeding, supplement)}
+    if warfarin_dose:
+        doses = [d.strip() for d in str(warfarin_dose).split(",")]
+        ref["schedule_id"] = repository.add_schedule(user_id, schedule_from_doses(doses, describe_dose), warfarin_dose)
+    return ref
 
 # ====== หน้า Home ======
 @app.route("/", methods=["GET"])
@@ -139,77 +158,164 @@ def home():
 
 @app.route("/daily_notify", methods=["GET"])
 def daily_notify():
-    main()
-    return "📤 แจ้งเตือนเรียบร้อย"
+    # คิวงานไว้ทำเบื้องหลัง แล้วตอบ job id กลับทันที (เรียกซ้ำวันเดียวกันจะได้งานเดิม)
+    today = datetime.now().strftime("%Y-%m-%d")
+    force = request.args.get("force") in ("1", "true")
+    job = start_job("daily_notify", params={"date": today, "today_col": get_today_column()},
+                    dedupe_key=f"daily_notify:{today}", force=force)
+    return jsonify({
+        "status": "📤 รับงานแจ้งเตือนแล้ว",
+        "job_id": job["id"],
+        "job_status": job["status"],
+        "status_url": f"/jobs/{job['id']}"
+    }), 202
+
+
+@app.route("/weekly_report", methods=["GET"])
+def weekly_report():
+    # ส่งกราฟ INR ให้ผู้ป่วยทุกคน (เรียกซ้ำสัปดาห์เดียวกันจะได้งานเดิม)
+    week = weekly_reports.week_key()
+    force = request.args.get("force") in ("1", "true")
+    job = start_job("weekly_report", params={"week": week}, dedupe_key=f"weekly_report:{week}", force=force)
+    return jsonify({
+        "status": "📤 รับงานรายงานประจำสัปดาห์แล้ว",
+        "job_id": job["id"],
+        "job_status": job["status"],
+        "status_url": f"/jobs/{job['id']}"
+    }), 202
+
+
+@app.route("/plan_reminders", methods=["GET"])
+def plan_reminders_route():
+    # เตรียมแผนล่วงหน้า (ค่าเริ่มต้น = พรุ่งนี้) เช่นให้ cron เรียกตอนกลางคืน
+    day = request.args.get("date") or (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        abort(400)
+    plan = plan_reminders(day)
+    summary = {key: plan[key] for key in ("date", "today_col", "version", "recipients", "skipped")}
+    summary["batches"] = len(plan["batches"])
+    return jsonify(summary)
 
+@app.route("/outbox_status", methods=["GET"])
+def outbox_status():
+    return jsonify(outbox_stats())
 
-# ====== แจ้งเตือนการกินยา (สำหรับเรียกจาก scheduler) ======
-def connect_sheet():
-    scope = ['https://spreadsheets.google.com/feeds',
-             'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-    client = gspread.authorize(creds)
-    return client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
 
-# ========== แปลงวันเป็นคอลัมน์ภาษาไทย ==========
-def get_today_column():
-    thai_days = ['จันทร์', 'อังคาร', 'พุธ', 'พฤหัส', 'ศุกร์', 'เสาร์', 'อาทิตย์']
-    today_index = datetime.now().weekday()
-    return thai_days[today_index]
-
-# ========== ส่งข้อความเข้า LINE ==========
-def send_line_notify(user_id, message):
-    # หาค่าขนาดยา (เช่น 3 mg) จากข้อความ
-    dose = None
-    for token in message.split():
-        if token.endswith("mg"):
-            dose = token.replace("mg", "").strip()
-            break
-
-    # ดึง URL รูปจาก IMAGE_MAP
-    image_url = IMAGE_MAP.get(dose)
-
-    headers = {
-        'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
+# ====== Prometheus metrics ======
+QUEUE_DEPTH = Gauge("warfarin_queue_depth", "Items waiting in background queues", ("queue",))
 
-    # สร้างข้อความ text เป็น default
-    messages = [{'type': 'text', 'text': message}]
+def collect_queue_depths():
+    QUEUE_DEPTH.set(event_queue.depth(), queue="line_events")
+    QUEUE_DEPTH.set(outbox_stats()["queue_depth"], queue="sheet_outbox")
+    QUEUE_DEPTH.set(sheet_sync.pending(), queue="sheet_sync")
+    QUEUE_DEPTH.set(sessions.count(), queue="sessions")
 
-    # ถ้ามีรูปภาพขนาดยานี้ → เพิ่มข้อความแบบ image
-    if image_url:
-        messages.append({
-            'type': 'image',
-            'originalContentUrl': image_url,
-            'previewImageUrl': image_url
-        })
+add_collector(collect_queue_depths)
 
-    payload = {
-        'to': user_id,
-        'messages': messages
-    }
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return render_metrics(), 200, {"Content-Type": CONTENT_TYPE}
 
-    response = requests.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload)
-    print(f'Sent to {user_id}: {response.status_code}')
+@app.route("/sync_status", methods=["GET"])
+def sync_status():
+    return jsonify({**repository.stats(), "sync_queue": sheet_sync.pending(), "alert_queue": alerts.pending()})
 
-# ========== MAIN ==========
-def main():
-    sheet = connect_sheet()
-    data = sheet.get_all_records()
-    today_col = get_today_column()
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    job = load_job(job_id)
+    if not job:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job_status(job))
 
-    for row in data:
-        user_id = row.get('userID')
-        name = f"{row.get('firstName', '')} {row.get('lastName', '')}".strip()
-        message_text = row.get(today_col, '').strip()
 
-        if user_id and message_text and message_text != '-':
-            # ✅ เพิ่มบรรทัดนี้: เติม mg อัตโนมัติถ้าไม่มี
-            dose_with_unit = f"{message_text} mg" if "mg" not in message_text.lower() else message_text
+# ====== แจ้งเตือนการกินยา (สำหรับเรียกจาก scheduler) ======
+# คอลัมน์ที่งานแจ้งเตือนต้องใช้ (อ่านเฉพาะคอลัมน์เหล่านี้จากชีต)
+REMINDER_COLUMNS = ['userID', 'firstName', 'lastName']
 
-            message = f"\U0001F4C5 วันนี้วัน{today_col}\nคุณ {name}\nกรุณากินยา\n{dose_with_unit}"
-            send_line_notify(user_id, message)
+def reminder_columns(today_col):
+    return REMINDER_COLUMNS + [today_col]
+
+# ========== แปลงวันเป็นคอลัมน์ภาษาไทย ==========
+def get_today_column():
+    return THAI_WEEKDAYS[datetime.now().weekday()]
+
+# ========== แถวเดียว → (user_id, ข้อความ, รูป) หรือ None ถ้าวันนี้ไม่ต้องแจ้ง ==========
+def build_reminder_entry(row, today_col):
+    user_id = row.get('userID')
+    name = f"{row.get('firstName', '')} {row.get('lastName', '')}".strip()
+    message_text = str(row.get(today_col, '')).strip()
+
+    if not (user_id and message_text and message_text != '-'):
+        return None
+
+    # ✅ เติม mg อัตโนมัติถ้าไม่มี และบอกวิธีแบ่งเม็ดถ้ารู้ขนาดยา (รวมขนาดที่ไม่มีในตาราง เช่น 7 mg)
+    entry = resolve_dose(message_text)
+    dose_with_unit = f"{message_text} mg" if "mg" not in message_text.lower() else message_text
+    if entry is not None and entry.description:
+        dose_with_unit = f"{entry.label}\n💊 {entry.description}"
+
+    # ข้อความที่เหมือนกันจะถูกรวมส่งแบบ multicast ได้ จึงใส่ชื่อเฉพาะเมื่อเปิด NOTIFY_PERSONALIZE
+    if NOTIFY_PERSONALIZE and name:
+        message = f"\U0001F4C5 วันนี้วัน{today_col}\nคุณ {name}\nกรุณากินยา\n{dose_with_unit}"
+    else:
+        message = f"\U0001F4C5 วันนี้วัน{today_col}\nกรุณากินยา\n{dose_with_unit}"
+
+    # แผนเก็บแค่ key ของขนาดยา แล้วหา URL รูปใหม่ทุกครั้งที่สร้างแผน
+    return user_id, message, entry.key if entry is not None else None
+
+# ========== เตรียมแผนแจ้งเตือนของวันที่ day (อ่านชีตเฉพาะแถวที่เปลี่ยน) ==========
+def plan_reminders(day):
+    # รอ warm-up รูปขนาดยาสักครู่ จะได้ใส่ URL ของ bot เองแทน Google Drive
+    wait_for_dose_images(DOSE_IMAGE_WAIT_SECONDS)
+    return refresh_plan(day, reminder_columns(THAI_WEEKDAYS[datetime.strptime(day, "%Y-%m-%d").weekday()]),
+                        build_reminder_entry)
+
+# ========== งานแจ้งเตือนเบื้องหลัง (checkpoint ตามเลขแถวในชีต) ==========
+def run_daily_notify_job(job, checkpoint):
+    params = job["params"]
+    if params["date"] != datetime.now().strftime("%Y-%m-%d"):
+        # งานของวันก่อนที่ค้างไว้ ไม่ส่งต่อเพราะขนาดยาเป็นของอีกวัน
+        return {**(job.get("summary") or {}), "expired": True}
+
+    snapshot = load_rows_snapshot(job["id"])
+    if snapshot is None:
+        # ใช้แผนที่เตรียมไว้ล่วงหน้า (ไม่มีก็สร้างตอนนี้) แล้วแช่แข็งไว้กับงานนี้ เผื่อต้อง resume
+        plan = load_plan(params["date"]) or plan_reminders(params["date"])
+        snapshot = {"plan_version": plan["version"], "batches": plan["batches"], "skipped": plan["skipped"]}
+        save_rows_snapshot(job["id"], snapshot)
+
+    # checkpoint = จำนวนชุด (batch) ในแผนที่ส่งไปแล้ว
+    batches = snapshot["batches"]
+    position = job.get("checkpoint") or 0
+    summary = job.get("summary") or {"sent": 0, "failed": 0, "skipped": snapshot["skipped"], "elapsed_seconds": 0}
+    total = sum(len(user_ids) for user_ids, _ in batches)
+    done = sum(len(user_ids) for user_ids, _ in batches[:position])
+
+    while position < len(batches):
+        chunk = []
+        count = 0
+        while position < len(batches) and (not chunk or count + len(batches[position][0]) <= NOTIFY_CHECKPOINT_ROWS):
+            chunk.append(batches[position])
+            count += len(batches[position][0])
+            position += 1
+        result = send_batches(chunk)
+        for key in ("sent", "failed", "skipped", "elapsed_seconds"):
+            summary[key] = round(summary[key] + result[key], 3)
+        done += count
+        checkpoint(position, summary, rows_done=done, rows_total=total)
+
+    return summary
+
+register_job_kind("daily_notify", run_daily_notify_job)
+
+# ====== TTR ของผู้ป่วยทั้งหมด (คำนวณจากข้อมูลในเครื่อง) รันทุกคืนตาม TTR_RUN_AT หรือสั่งผ่าน /ttr/run ======
+TTR_RUN_AT = os.getenv("TTR_RUN_AT", "02:00")
+register_job_kind("ttr_analytics", make_job_runner(repository, hydrate=hydrate_cohort))
+
+# ====== กราฟ INR ประจำสัปดาห์ส่งให้ผู้ป่วยทุกคน (วาดใน process pool) ตั้งเวลาด้วย WEEKLY_REPORT_AT ======
+register_job_kind("weekly_report", weekly_reports.make_job_runner(repository, hydrate=hydrate_cohort))
 
 
 
@@ -231,6 +337,111 @@ def log_inr():
     result = send_to_google_sheet(userId, name, birthdate, inr, bleeding, supplement, warfarin_dose)
     return jsonify({"status": "sent", "google_response": result})
 
+# ====== token ของ endpoint สำหรับระบบอื่น (ส่ง "Authorization: Bearer <token>") ======
+# INGEST_TOKEN ไม่ตั้งก็ได้ (เหมือน /log_inr) แต่ export ข้อมูลผู้ป่วยทั้งหมดต้องตั้ง EXPORT_TOKEN ก่อนจึงจะใช้ได้
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN", "")
+
+def _bearer_ok(token):
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+
+# ====== นำเข้าหลายรายการ: JSON array หรือ NDJSON (Content-Type: application/x-ndjson) ======
+@app.route("/log_inr/batch", methods=["POST"])
+def log_inr_batch():
+    if INGEST_TOKEN and not _bearer_ok(INGEST_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    # อ่าน request.stream ตรงๆ ไม่ให้ Flask อ่านทั้ง body เข้า memory ก่อน
+    started = time.time()
+    result = ingest(iter_records(request.stream, request.content_type or ""),
+                    repository, GOOGLE_APPS_SCRIPT_URL, describe_dose)
+    data = result.as_dict()
+    data["elapsed_seconds"] = round(time.time() - started, 3)
+    print(f"📥 นำเข้า INR: รับ {data['accepted']} ซ้ำ {data['duplicate']} ไม่ผ่าน {data['rejected']} "
+          f"({data['elapsed_seconds']}s)")
+    return jsonify(data), 400 if result.error else 200
+
+# ====== ผล TTR ล่าสุด: สรุปทั้ง cohort เปิดดูได้ ส่วนรายคน (?user_id= หรือ ?patients=1) ต้องใช้ EXPORT_TOKEN ======
+@app.route("/ttr", methods=["GET"])
+def ttr_report():
+    report = load_report()
+    if report is None:
+        return jsonify({"error": "no TTR report yet", "run_url": "/ttr/run"}), 404
+    data = {key: value for key, value in report.items() if key != "patients"}
+    user_ids = request.args.getlist("user_id")
+    if user_ids or request.args.get("patients") in ("1", "true"):
+        if not EXPORT_TOKEN or not _bearer_ok(EXPORT_TOKEN):
+            return jsonify({"error": "Unauthorized"}), 401
+        wanted = set(user_ids)
+        data["patients"] = [row for row in report["patients"] if not wanted or row["user_id"] in wanted]
+    return jsonify(data)
+
+# ====== เกณฑ์แจ้งเตือน INR รายคน: POST {"user_id", "low", "high"} (ใช้ EXPORT_TOKEN) ======
+@app.route("/alert_thresholds", methods=["POST"])
+def alert_thresholds():
+    if not EXPORT_TOKEN or not _bearer_ok(EXPORT_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        low = None if data.get("low") is None else float(data["low"])
+        high = None if data.get("high") is None else float(data["high"])
+    except (TypeError, ValueError):
+        return jsonify({"error": "low/high must be numbers"}), 400
+    if not data.get("user_id"):
+        return jsonify({"error": "Missing required fields"}), 400
+    alerts.set_thresholds(data["user_id"], low, high)
+    return jsonify({"status": "queued", "user_id": data["user_id"], "low": low, "high": high})
+
+@app.route("/ttr/run", methods=["GET"])
+def ttr_run():
+    today = datetime.now().strftime("%Y-%m-%d")
+    force = request.args.get("force") in ("1", "true")
+    job = start_job("ttr_analytics", params={"date": today}, dedupe_key=f"ttr_analytics:{today}", force=force)
+    return jsonify({"job_id": job["id"], "job_status": job["status"], "status_url": f"/jobs/{job['id']}"}), 202
+
+# ====== export แบบ stream: /export?kind=readings|patients|schedules&format=csv|ndjson ======
+# ข้อมูลจากชีตที่แต่ละ kind ใช้ (ชนิดของ SheetSync)
+EXPORT_SYNC_KINDS = {"readings": ("history",), "patients": ("profile",), "schedules": ("latest",)}
+# จำนวนครั้งสูงสุดที่ /export?user_id=... เรียก Apps Script ระหว่างคำขอ
+EXPORT_HYDRATE_MAX = int(os.getenv("EXPORT_HYDRATE_MAX", "20"))
+# กรองด้วย user_id (ซ้ำได้หลายตัว), start, end; gzip ถ้า client ส่ง Accept-Encoding: gzip หรือใส่ gzip=1 (ได้ไฟล์ .gz)
+@app.route("/export", methods=["GET"])
+def export_data():
+    if not EXPORT_TOKEN:
+        return jsonify({"error": "export disabled (EXPORT_TOKEN not set)"}), 403
+    if not _bearer_ok(EXPORT_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    kind = request.args.get("kind", "readings")
+    fmt = request.args.get("format", "csv")
+    start, end = request.args.get("start"), request.args.get("end")
+    if kind not in KINDS or fmt not in FORMATS:
+        return jsonify({"error": f"kind must be one of {sorted(KINDS)}, format one of {sorted(FORMATS)}"}), 400
+    try:
+        validate_filters(start, end)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user_ids = request.args.getlist("user_id") or None
+    # ระบุผู้ป่วยมา → ดึงข้อมูลที่ kind นี้ใช้ของคนที่ยังไม่มีในเครื่องจากชีตก่อน (ไม่เกิน EXPORT_HYDRATE_MAX ครั้ง
+    # ที่เหลือ sync เบื้องหลัง); export ทั้งหมดบอกใน header ว่าข้อมูลครบทั้ง cohort หรือไม่
+    sync_kinds = EXPORT_SYNC_KINDS[kind]
+    if user_ids:
+        partial = sheet_sync.hydrate(user_ids, kinds=sync_kinds, limit=EXPORT_HYDRATE_MAX)["partial"]
+    else:
+        partial = cohort_coverage["partial"] or not set(sync_kinds) <= set(cohort_coverage.get("kinds", ()))
+
+    as_file = request.args.get("gzip") in ("1", "true")
+    transparent = not as_file and "gzip" in request.headers.get("Accept-Encoding", "")
+    stream = export_stream(repository, kind, fmt, user_ids=user_ids,
+                           start=start, end=end, gzip=as_file or transparent)
+    filename = f"warfarin_{kind}_{datetime.now():%Y%m%d}.{fmt}" + (".gz" if as_file else "")
+    response = Response(stream_with_context(stream),
+                        content_type="application/gzip" if as_file else FORMATS[fmt],
+                        headers={"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding",
+                                 "X-Cohort-Partial": "true" if partial else "false"})
+    if transparent:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
 # ====== Webhook Endpoint (LINE) ======
 @app.route("/callback", methods=["POST"])
 def callback():
@@ -241,43 +452,70 @@ def callback():
         handler.handle(body, signature)
     except InvalidSignatureError:
         abort(400)
+    except QueueFullError:
+        # คิวเต็ม → ให้ LINE ส่ง event มาใหม่ภายหลัง
+        abort(503)
     return "OK"
 
 
-def get_inr_history_from_sheet(user_id):
-    url = "https://script.google.com/macros/s/AKfycbwdi3et7_H6dHFA7dTNRjNESjljUq1KZl2JOitV0fDkeVORlvyJMBgEEEG9nqAdSP4D/exec"
+@app.route("/queue_status", methods=["GET"])
+def queue_status():
+    return jsonify(event_queue.stats())
+
+
+def _fetch_inr_history(user_id, since=None):
+    params = {"userId": user_id, "history": "true"}
+    if since:
+        # เฉพาะค่าตั้งแต่วันที่นี้ (YYYY-MM-DD) ถ้า Apps Script ไม่รองรับก็จะได้ทั้งหมดซึ่ง merge ได้เหมือนกัน
+        params["since"] = since
+    response = http_transport.get(GOOGLE_APPS_SCRIPT_URL, endpoint="apps_script_read", params=params)
+    return response.json() or []  # [{date, inr, ...}] ใหม่ → เก่า
+
+def get_inr_history_from_sheet(user_id, last=None, start=None, end=None, since=None):
     try:
-        response = requests.get(url, params={"userId": user_id, "history": "true"}, timeout=10)
-        data = response.json()
-        if not data:
-            return [], []
-        dates = [item["date"] for item in data]
-        inrs = [float(item["inr"]) for item in data]
-        return dates, inrs
+        # ครั้งแรกดึงจากชีตมาเก็บในเครื่อง ครั้งต่อไปอ่านจาก SQLite (ค่าใหม่จากชีตถูก merge เข้ามาเบื้องหลัง)
+        sheet_sync.ensure(user_id, "history")
     except Exception as e:
         print(f"Error fetching INR: {e}")
-        return [], []
+    # คืนเป็น list ใหม่ทุกครั้ง เพราะ generate_inr_chart จะ reverse ในที่
+    return repository.history(user_id, last=last, start=start, end=end, since=since)
+
+def _fetch_user_profile(user_id):
+    response = http_transport.get(GOOGLE_APPS_SCRIPT_URL, endpoint="apps_script_read",
+                                  params={"userId": user_id, "profile": "true"})
+    return response.json()  # {firstName, lastName, birthdate} หรือ {}
 
 def get_user_profile(user_id):
     try:
-        response = requests.get(GOOGLE_APPS_SCRIPT_URL, params={"userId": user_id, "profile": "true"}, timeout=10)
-        data = response.json()
-        return data  # {firstName, lastName, birthdate} หรือ {}
+        sheet_sync.ensure(user_id, "profile")
     except Exception as e:
         print("❌ Error loading profile:", e)
-        return {}
+    return repository.get_profile(user_id)
 
+def _fetch_latest_dose(user_id):
+    response = http_transport.get(
+        GOOGLE_APPS_SCRIPT_URL,
+        endpoint="apps_script_read",
+        params={"userId": user_id, "latest": "true"}
+    )
+    return response.json()
 
-def upload_image_and_reply(user_id, reply_token, image_buf):
-    # 1. บันทึกภาพลงเป็นไฟล์ชั่วคราว
-    filename = f"inr_chart_{user_id}.png"
-    tmp_path = f"/tmp/{filename}"
+def get_latest_dose(user_id):
+    # ดึงจากชีตไม่ได้และในเครื่องยังไม่มีข้อมูล → error ถูกส่งต่อให้ผู้เรียกจัดการ
+    try:
+        sheet_sync.ensure(user_id, "latest")
+    except Exception:
+        if repository.latest_schedule(user_id) is None:
+            raise
+    return repository.latest_schedule(user_id) or {}
 
-    with open(tmp_path, "wb") as f:
-        f.write(image_buf.read())
 
-    # 2. กำหนด URL สำหรับให้ LINE ดูภาพได้
-    image_url = f"https://warfarin.onrender.com/image/{filename}"  # ✅ เปลี่ยน domain
+def upload_image_and_reply(user_id, reply_token, image_buf):
+    from linebot.v3.messaging import ReplyMessageRequest, ImageMessage
+
+    # 1. บันทึกภาพโดยตั้งชื่อไฟล์ตาม hash ของรูป (รูปใหม่ไม่ทับไฟล์ที่ LINE กำลังโหลด)
+    # 2. ได้ URL ของรูปเต็มและรูป preview ขนาดเล็ก
+    image_url, preview_url = store_image_urls(image_buf.read())
 
     # 3. ส่งภาพกลับผ่าน LINE
     messaging_api.reply_message(
@@ -286,7 +524,7 @@ def upload_image_and_reply(user_id, reply_token, image_buf):
             messages=[
                 ImageMessage(
                     original_content_url=image_url,
-                    preview_image_url=image_url
+                    preview_image_url=preview_url
                 )
             ]
         )
@@ -298,48 +536,33 @@ def generate_inr_chart(dates, inr_values):
     dates.reverse()
     inr_values.reverse()
 
-    fig, ax = plt.subplots(figsize=(8, 4))
-
-    # ตัดค่าที่เกิน 5.5 แต่ให้วาดจุดไว้เหนือ 5.5
-    clipped_values = [min(v, 5.5) for v in inr_values]
-
-    # วาดกราฟเส้น
-    ax.plot(dates, clipped_values, marker="o", color="#007bff", label="INR")
-
-    # เติม label ที่จุด
-    for i, (x, y, raw_y) in enumerate(zip(dates, clipped_values, inr_values)):
-        ax.text(x, y + 0.15, f"{raw_y:.1f}", ha="center", fontsize=10, color="black")
-        # ถ้า INR >= 6 ให้ใช้จุดแดง
-        if raw_y >= 6:
-            ax.plot(x, y, marker="o", color="red", markersize=10)
-
-    # พื้นหลังสีเขียวระหว่าง INR 2.0–3.5
-    ax.axhspan(2.0, 3.5, facecolor='green', alpha=0.1)
-
-    # ตั้ง y scale เริ่มที่ 0.5 ถึง 5.5
-    ax.set_ylim(0.5, 6.2)
-    ax.set_yticks([i * 0.5 for i in range(1, 12)])
-    ax.set_ylabel("INR")
-    ax.set_xticks(range(len(dates)))
-    ax.set_xticklabels(dates, rotation=45)
-    ax.set_title("INR chart")
-
-    plt.tight_layout()
+    # CHART_RENDERER=matplotlib (figure เดียวใช้ซ้ำ) หรือ pil (วาดด้วย Pillow ตรงๆ)
+    renderer = get_chart_renderer()
+    started = time.perf_counter()
+    image = renderer.draw(dates, inr_values)
+    CHART_SECONDS.observe(time.perf_counter() - started, stage="render")
 
     # แปลงเป็น buffer image
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    plt.close(fig)
-    buf.seek(0)
-
-    return buf    
+    with CHART_SECONDS.time(stage="encode"):
+        png = renderer.encode(image)
+    return io.BytesIO(png)
 
 @app.route("/image/<filename>")
 def serve_image(filename):
-    filepath = f"/tmp/{filename}"
-    return send_file(filepath, mimetype="image/png")
+    return serve_stored_image(filename, request)
+
+@app.route("/dose_image/<filename>")
+def serve_dose_image_route(filename):
+    return serve_dose_image(filename, request)
+
+@app.route("/dose_image_status", methods=["GET"])
+def dose_image_status():
+    return jsonify(dose_image_stats())
 
 def send_symptom_assessment_flex(reply_token):
+    from linebot.v3.messaging import ReplyMessageRequest, FlexMessage
+    from linebot.v3.messaging.models import FlexContainer
+
     # Flex 1: เลือกอาการเลือดออก
     bubble_bleeding = {
         "type": "bubble",
@@ -361,7 +584,7 @@ def send_symptom_assessment_flex(reply_token):
                         "color": "#FFCDD2",
                         "action": {"type": "message", "label": label, "text": label}
                     }
-                    for label in ["จุดจ้ำเลือด","เลือดไหลไม่หยุด","ไอ/อาเจียนเป็นเลือด","อุจจาระสีดำ","ปัสสาวะมีสีสนิม","ประจำเดือนมามากผิดปกติ", "ไม่มีอาการ"]
+                    for label in BLEEDING_SYMPTOMS + [NO_SYMPTOM]
                 ]
             ]
         }
@@ -388,7 +611,7 @@ def send_symptom_assessment_flex(reply_token):
                         "color": "#BBDEFB",
                         "action": {"type": "message", "label": label, "text": label}
                     }
-                    for label in ["เจ็บหน้าอก หายใจลำบาก", "ปวด/เวียนศีรษะ", "แขนขาบวม", "อ่อนแรงครึ่งซีก แขนขาชา", "พูดไม่ชัด","ไม่มีอาการ"]
+                    for label in CLOT_SYMPTOMS + [NO_SYMPTOM]
                 ]
             ]
         }
@@ -406,301 +629,265 @@ def send_symptom_assessment_flex(reply_token):
 
 
 # ====== LINE Message Handler ======
+# อาการไม่พึงประสงค์ (ใช้ทั้งในปุ่ม Flex และตอน route ข้อความ)
+BLEEDING_SYMPTOMS = ["จุดจ้ำเลือด", "เลือดไหลไม่หยุด", "ไอ/อาเจียนเป็นเลือด", "อุจจาระสีดำ", "ปัสสาวะมีสีสนิม", "ประจำเดือนมามากผิดปกติ"]
+CLOT_SYMPTOMS = ["เจ็บหน้าอก หายใจลำบาก", "ปวด/เวียนศีรษะ", "แขนขาบวม", "อ่อนแรงครึ่งซีก แขนขาชา", "พูดไม่ชัด"]
+NO_SYMPTOM = "ไม่มีอาการ"
+
+router = ConversationRouter()
+router.add_listener(observe_dispatch)
+router.reply(BLEEDING_SYMPTOMS, "⚠️ ตรวจพบอาการเลือดออกผิดปกติ\n⛔ โปรดหยุดยา Warfarin และพบแพทย์ทันที")
+router.reply(CLOT_SYMPTOMS, "⚠️ ตรวจพบอาการที่อาจเกิดลิ่มเลือดอุดตัน\n⛔ ถ้าอาการไม่ดีขึ้น ให้รีบไปโรงพยาบาลที่ใกล้ที่สุด")
+router.reply([NO_SYMPTOM], "✅ ขอบคุณสำหรับการประเมิน ไม่มีอาการผิดปกติในขณะนี้")
+
+
+def reply_messages(reply_token, messages):
+    from linebot.v3.messaging import ReplyMessageRequest
+
+    messaging_api.reply_message(ReplyMessageRequest(reply_token=reply_token, messages=messages))
+
+def reply_text(reply_token, text, quick_reply=None):
+    from linebot.v3.messaging import TextMessage
+
+    reply_messages(reply_token, [TextMessage(text=text, quick_reply=quick_reply)])
+
+def reply_static(ctx, text):
+    reply_text(ctx.reply_token, text)
+
+# session ถูก event อื่นเลื่อนขั้นไปแล้ว หรือหมดอายุระหว่างประมวลผล → บอกผู้ใช้แทนการเงียบ
+SESSION_LOST_TEXT = "⌛ ขั้นตอนนี้หมดเวลาหรือถูกบันทึกไปแล้ว พิมพ์ 'บันทึกค่า INR' เพื่อเริ่มใหม่"
+
+def reply_session_lost(ctx):
+    reply_text(ctx.reply_token, SESSION_LOST_TEXT)
+
+
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
-    user_id = event.source.user_id
-    reply_token = event.reply_token
     text = event.message.text.strip()
-    session = user_sessions.get(user_id, {})
+    user_id = event.source.user_id
+    ctx = MessageContext(user_id, event.reply_token, text, sessions.get(user_id))
+    router.dispatch(ctx, reply_static)
 
-    bleeding_symptoms = ["จุดจ้ำเลือด","เลือดไหลไม่หยุด","ไอ/อาเจียนเป็นเลือด","อุจจาระสีดำ","ปัสสาวะมีสีสนิม","ประจำเดือนมามากผิดปกติ"]
-    clot_symptoms = ["เจ็บหน้าอก หายใจลำบาก", "ปวด/เวียนศีรษะ", "แขนขาบวม", "อ่อนแรงครึ่งซีก แขนขาชา", "พูดไม่ชัด"]
 
-    if text in bleeding_symptoms:
-            msg = "⚠️ ตรวจพบอาการเลือดออกผิดปกติ\n⛔ โปรดหยุดยา Warfarin และพบแพทย์ทันที"
-    elif text in clot_symptoms:
-            msg = "⚠️ ตรวจพบอาการที่อาจเกิดลิ่มเลือดอุดตัน\n⛔ ถ้าอาการไม่ดีขึ้น ให้รีบไปโรงพยาบาลที่ใกล้ที่สุด"
-    elif text == "ไม่มีอาการ":
-            msg = "✅ ขอบคุณสำหรับการประเมิน ไม่มีอาการผิดปกติในขณะนี้"
-    else:
-            msg = None
+@router.command("ดูกราฟ INR")
+def show_inr_chart(ctx):
+    dates, inrs = get_inr_history_from_sheet(ctx.user_id, last=CHART_HISTORY_POINTS)
 
-    if msg:
-            messaging_api.reply_message(
-                ReplyMessageRequest(reply_token=reply_token, messages=[TextMessage(text=msg)])
-            )
-            return
+    if not dates or not inrs:
+        reply_text(ctx.reply_token, "❌ ไม่พบข้อมูล INR ย้อนหลังของคุณ")
+        return
 
-    if text == "ดูกราฟ INR":
-        dates, inrs = get_inr_history_from_sheet(user_id)
+    # ถ้าข้อมูลไม่เปลี่ยนจากครั้งก่อน ได้รูปจาก cache ทันทีไม่ต้องวาดใหม่
+    png = chart_cache.get_or_render(dates, inrs, generate_inr_chart)
+    upload_image_and_reply(ctx.user_id, ctx.reply_token, io.BytesIO(png))
 
-        # debug logs
-        print("DEBUG: dates =", dates)
-        print("DEBUG: inrs =", inrs)
 
-        if not dates or not inrs:
-            messaging_api.reply_message(
-                ReplyMessageRequest(reply_token=reply_token, messages=[
-                    TextMessage(text="❌ ไม่พบข้อมูล INR ย้อนหลังของคุณ")
-                ])
-            )
-            return
+@router.command("วันนี้ฉันกินยาอย่างไร")
+def show_today_dose(ctx):
+    from linebot.v3.messaging import TextMessage, ImageMessage
 
-        buf = generate_inr_chart(dates, inrs)
-        upload_image_and_reply(user_id, reply_token, buf)
-        return
+    thai_days = ["วันจันทร์", "วันอังคาร", "วันพุธ", "วันพฤหัสบดี", "วันศุกร์", "วันเสาร์", "วันอาทิตย์"]
+    today_index = datetime.now().weekday()
+    today_th = thai_days[today_index] + " (คำอธิบาย)"
 
-    if text == "วันนี้ฉันกินยาอย่างไร":
-        thai_days = ["วันจันทร์", "วันอังคาร", "วันพุธ", "วันพฤหัสบดี", "วันศุกร์", "วันเสาร์", "วันอาทิตย์"]
-        today_index = datetime.now().weekday()
-        today_th = thai_days[today_index] + " (คำอธิบาย)"
-
-        try:
-            response = requests.get(
-                GOOGLE_APPS_SCRIPT_URL,
-                params={"userId": user_id, "latest": "true"},
-                timeout=10
-            )
-            data = response.json()
-
-            if today_th in data:
-                today_dose = data[today_th]
-                if not today_dose or today_dose.strip() in ["", "งดยา", "-"]:
-                    msg = f"📅 วันนี้{thai_days[today_index]} คุณไม่มียา Warfarin ครับ"
-
-                    image_url = DOSE_IMAGE_MAP.get("0")  # รูปงดยา
-                    messages = [TextMessage(text=msg)]
-                    if image_url:
-                        messages.append(ImageMessage(
-                            original_content_url=image_url,
-                            preview_image_url=image_url
-                        ))
-
-                    messaging_api.reply_message(
-                        ReplyMessageRequest(reply_token=reply_token, messages=messages)
-                    )
-                    return
+    try:
+        data = get_latest_dose(ctx.user_id)
 
+        if today_th in data:
+            today_dose = data[today_th]
+            if not today_dose or today_dose.strip() in ["", "งดยา", "-"]:
+                msg = f"📅 วันนี้{thai_days[today_index]} คุณไม่มียา Warfarin ครับ"
+                image_urls = dose_image_urls(resolve_dose(NO_DOSE))  # รูปงดยา
+            else:
                 msg = f"📅 วันนี้{thai_days[today_index]}\n💊 คุณต้องกินยา Warfarin ดังนี้:\n{today_dose}"
+                # เทียบคำอธิบายแบบไม่สนช่องว่าง/คำว่า "เม็ด" และคำนวณจากจำนวนเม็ดถ้าไม่ตรงตาราง
+                image_urls = dose_image_urls(find_by_description(today_dose))
+
+            messages = [TextMessage(text=msg)]
+            if image_urls:
+                messages.append(ImageMessage(
+                    original_content_url=image_urls[0],
+                    preview_image_url=image_urls[1]
+                ))
+            reply_messages(ctx.reply_token, messages)
+            return
 
-                # หาคีย์ของขนาดยาใน DOSE_DESC_MAP ที่ตรงกับคำอธิบาย
-                dose_key = next((k for k, v in DOSE_DESC_MAP.items() if v == today_dose.strip()), None)
-                image_url = DOSE_IMAGE_MAP.get(dose_key)
+        msg = "❌ ไม่พบข้อมูลยาวันนี้ในระบบ"
 
-                messages = [TextMessage(text=msg)]
-                if image_url:
-                    messages.append(ImageMessage(
-                        original_content_url=image_url,
-                        preview_image_url=image_url
-                    ))
+    except Exception as e:
+        print("❌ Error fetching today's dose:", e)
+        msg = "⚠️ เกิดข้อผิดพลาดในการดึงข้อมูลยา กรุณาลองใหม่ภายหลัง"
 
-                messaging_api.reply_message(
-                    ReplyMessageRequest(reply_token=reply_token, messages=messages)
-                )
-                return
+    reply_text(ctx.reply_token, msg)
 
-            else:
-                msg = "❌ ไม่พบข้อมูลยาวันนี้ในระบบ"
 
-        except Exception as e:
-            print("❌ Error fetching today's dose:", e)
-            msg = "⚠️ เกิดข้อผิดพลาดในการดึงข้อมูลยา กรุณาลองใหม่ภายหลัง"
+@router.command("ประเมินอาการไม่พึงประสงค์")
+def start_symptom_assessment(ctx):
+    send_symptom_assessment_flex(ctx.reply_token)
 
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[TextMessage(text=msg)])
-        )
-        return
 
-    
-# ✅ เพิ่มฟังก์ชันสำหรับอัปเดตโปรไฟล์ (ไว้ท้ายไฟล์หรือส่วน util)
-
-    # เริ่มต้น flow
-        # เริ่มต้น flow
-    # ✅ เพิ่มใน handler ด้านบน (ก่อน session flow)
-    if text == "แก้ชื่อ":
-        user_sessions[user_id] = {"step": "edit_name"}
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text="📛 กรุณาพิมพ์ชื่อ-นามสกุลใหม่ของคุณ")
-            ])
-        )
-        return
+# ====== แก้ไขโปรไฟล์ ======
+@router.command("แก้ชื่อ", starts=["edit_name"])
+def start_edit_name(ctx):
+    sessions.start(ctx.user_id, "edit_name")
+    reply_text(ctx.reply_token, "📛 กรุณาพิมพ์ชื่อ-นามสกุลใหม่ของคุณ")
 
-    if text == "แก้วันเกิด":
-        user_sessions[user_id] = {"step": "edit_birthdate"}
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text="🎂 กรุณาพิมพ์วันเกิดใหม่ (เช่น 01/01/2540)")
-            ])
-        )
-        return
 
-    if session.get("step") == "edit_name":
-        new_name = text.strip()
-        update_user_profile(user_id=user_id, new_name=new_name)
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text=f"✅ เปลี่ยนชื่อเป็น \"{new_name}\" เรียบร้อยแล้ว")
-            ])
-        )
-        user_sessions.pop(user_id, None)
+@router.command("แก้วันเกิด", starts=["edit_birthdate"])
+def start_edit_birthdate(ctx):
+    sessions.start(ctx.user_id, "edit_birthdate")
+    reply_text(ctx.reply_token, "🎂 กรุณาพิมพ์วันเกิดใหม่ (เช่น 01/01/2540)")
+
+
+@router.step("edit_name")
+def handle_edit_name(ctx):
+    if not sessions.finish(ctx.user_id, "edit_name"):
+        reply_session_lost(ctx)
         return
+    new_name = ctx.text.strip()
+    update_user_profile(user_id=ctx.user_id, new_name=new_name)
+    reply_text(ctx.reply_token, f"✅ เปลี่ยนชื่อเป็น \"{new_name}\" เรียบร้อยแล้ว")
 
-    if session.get("step") == "edit_birthdate":
-        new_birthdate = text.strip()
-        update_user_profile(user_id=user_id, new_birthdate=new_birthdate)
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text=f"✅ เปลี่ยนวันเกิดเป็น {new_birthdate} เรียบร้อยแล้ว")
+
+@router.step("edit_birthdate")
+def handle_edit_birthdate(ctx):
+    if not sessions.finish(ctx.user_id, "edit_birthdate"):
+        reply_session_lost(ctx)
+        return
+    new_birthdate = ctx.text.strip()
+    update_user_profile(user_id=ctx.user_id, new_birthdate=new_birthdate)
+    reply_text(ctx.reply_token, f"✅ เปลี่ยนวันเกิดเป็น {new_birthdate} เรียบร้อยแล้ว")
+
+
+# ====== flow บันทึกค่า INR ======
+@router.command("บันทึกค่า INR", starts=["ask_inr", "ask_name"])
+def start_inr_entry(ctx):
+    from linebot.v3.messaging import QuickReply, QuickReplyItem, MessageAction
+
+    profile = get_user_profile(ctx.user_id)
+    if profile and profile.get("firstName"):
+        full_name = f"{profile['firstName']} {profile.get('lastName', '')}".strip()
+        sessions.start(ctx.user_id, "ask_inr", name=full_name, birthdate=profile.get("birthdate", ""))
+        reply_text(
+            ctx.reply_token,
+            f"""🙋‍♂️ ยินดีต้อนรับกลับมาคุณ {full_name}
+                🧪 กรุณาพิมพ์ค่า INR เช่น 2.7""",
+            quick_reply=QuickReply(items=[
+                QuickReplyItem(action=MessageAction(label="✏️ แก้ชื่อ", text="แก้ชื่อ")),
+                QuickReplyItem(action=MessageAction(label="🎂 แก้วันเกิด", text="แก้วันเกิด"))
             ])
         )
-        user_sessions.pop(user_id, None)
         return
 
-# ✅ แก้ไขส่วนข้อความตอบกลับตอนโหลด profile เพื่อเพิ่ม Quick Reply
-    if text == "บันทึกค่า INR":
-        profile = get_user_profile(user_id)
-        if profile and profile.get("firstName"):
-            full_name = f"{profile['firstName']} {profile.get('lastName', '')}".strip()
-            user_sessions[user_id] = {
-                "name": full_name,
-                "birthdate": profile.get("birthdate", ""),
-                "step": "ask_inr"
-            }
-            messaging_api.reply_message(
-                ReplyMessageRequest(reply_token=reply_token, messages=[
-                    TextMessage(
-                        text=f"""🙋‍♂️ ยินดีต้อนรับกลับมาคุณ {full_name}
-                🧪 กรุณาพิมพ์ค่า INR เช่น 2.7""",
-                        quick_reply=QuickReply(items=[
-                            QuickReplyItem(action=MessageAction(label="✏️ แก้ชื่อ", text="แก้ชื่อ")),
-                            QuickReplyItem(action=MessageAction(label="🎂 แก้วันเกิด", text="แก้วันเกิด"))
-                        ])
-                    )
-                ]))
-            return
+    # ผู้ใช้ใหม่ที่ยังไม่มีโปรไฟล์ → ถามชื่อก่อน
+    sessions.start(ctx.user_id, "ask_name")
+    reply_text(ctx.reply_token, "👤 กรุณาพิมพ์ชื่อ-นามสกุลของคุณ")
 
 
-    if session.get("step") == "ask_name":
-        session["name"] = text
-        session["step"] = "ask_birthdate"
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text="🎂 กรุณาพิมพ์วันเกิดของคุณ (เช่น 01/01/2540)")
-            ])
-        )
+@router.step("ask_name", next_steps=["ask_birthdate"])
+def handle_ask_name(ctx):
+    if not sessions.transition(ctx.user_id, "ask_name", "ask_birthdate", name=ctx.text):
+        reply_session_lost(ctx)
         return
+    reply_text(ctx.reply_token, "🎂 กรุณาพิมพ์วันเกิดของคุณ (เช่น 01/01/2540)")
 
-    if session.get("step") == "ask_birthdate":
-        session["birthdate"] = text
-        session["step"] = "ask_inr"
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text="🧪 กรุณาพิมพ์ค่า INR เช่น 2.7")
-            ])
-        )
+
+@router.step("ask_birthdate", next_steps=["ask_inr"])
+def handle_ask_birthdate(ctx):
+    if not sessions.transition(ctx.user_id, "ask_birthdate", "ask_inr", birthdate=ctx.text):
+        reply_session_lost(ctx)
         return
+    reply_text(ctx.reply_token, "🧪 กรุณาพิมพ์ค่า INR เช่น 2.7")
+
 
-    if session.get("step") == "ask_inr":
-        try:
-            inr = float(text)
-            session["inr"] = inr
-            session["step"] = "ask_bleeding"
-            messaging_api.reply_message(
-                ReplyMessageRequest(reply_token=reply_token, messages=[
-                    TextMessage(text="🩸 มีภาวะเลือดออกหรือไม่? (yes/no)")
-                ])
-            )
-        except ValueError:
-            messaging_api.reply_message(
-                ReplyMessageRequest(reply_token=reply_token, messages=[
-                    TextMessage(text="❌ กรุณาพิมพ์ INR เป็นตัวเลข เช่น 2.7")
-                ])
-            )
+@router.step("ask_inr", next_steps=["ask_bleeding"])
+def handle_ask_inr(ctx):
+    try:
+        inr = float(ctx.text)
+    except ValueError:
+        reply_text(ctx.reply_token, "❌ กรุณาพิมพ์ INR เป็นตัวเลข เช่น 2.7")
+        return
+    if not sessions.transition(ctx.user_id, "ask_inr", "ask_bleeding", inr=inr):
+        reply_session_lost(ctx)
         return
+    reply_text(ctx.reply_token, "🩸 มีภาวะเลือดออกหรือไม่? (yes/no)")
 
-    if session.get("step") == "ask_bleeding":
-        if text.lower() not in ["yes", "no"]:
-            messaging_api.reply_message(
-                ReplyMessageRequest(reply_token=reply_token, messages=[
-                    TextMessage(text="❌ กรุณาพิมพ์ yes หรือ no เท่านั้น")
-                ])
-            )
-            return
-        session["bleeding"] = text.lower()
-        session["step"] = "ask_supplement"
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text="🌿 มีการใช้สมุนไพร/อาหารเสริมหรือไม่? (ถ้าไม่มี พิมพ์ 'ไม่มี')")
-            ])
-        )
+
+@router.step("ask_bleeding", next_steps=["ask_supplement"])
+def handle_ask_bleeding(ctx):
+    if ctx.key not in ("yes", "no"):
+        reply_text(ctx.reply_token, "❌ กรุณาพิมพ์ yes หรือ no เท่านั้น")
         return
+    if not sessions.transition(ctx.user_id, "ask_bleeding", "ask_supplement", bleeding=ctx.key):
+        reply_session_lost(ctx)
+        return
+    if ctx.key == "yes":
+        # แจ้งแพทย์ทันที ไม่รอให้กรอกครบ flow (ตอนบันทึกจะถูกกันซ้ำ)
+        alerts.submit(ctx.user_id, bleeding="yes", name=ctx.session.name if ctx.session else None)
+    reply_text(ctx.reply_token, "🌿 มีการใช้สมุนไพร/อาหารเสริมหรือไม่? (ถ้าไม่มี พิมพ์ 'ไม่มี')")
 
-    if session.get("step") == "ask_supplement":
-        session["supplement"] = text
-        session["step"] = "ask_warf_dose"
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text="💊 กรุณาระบุขนาดยา Warfarin รายวันใน 1 สัปดาห์ จันทร์,อังคาร,พุธ,...,อาทิตย์ (เช่น 3,3,3,3,3,1.5,0)")
-            ])
-        )
+
+@router.step("ask_supplement", next_steps=["ask_warf_dose"])
+def handle_ask_supplement(ctx):
+    if not sessions.transition(ctx.user_id, "ask_supplement", "ask_warf_dose", supplement=ctx.text):
+        reply_session_lost(ctx)
         return
+    reply_text(ctx.reply_token, "💊 กรุณาระบุขนาดยา Warfarin รายวันใน 1 สัปดาห์ จันทร์,อังคาร,พุธ,...,อาทิตย์ (เช่น 3,3,3,3,3,1.5,0)")
 
-    if session.get("step") == "ask_warf_dose":
-        session["warfarin_dose"] = text
-        user_sessions.pop(user_id)
-
-        dose_list = text.split(",")
-        if len(dose_list) != 7:
-            messaging_api.reply_message(
-                ReplyMessageRequest(reply_token=reply_token, messages=[
-                    TextMessage(text="❌ กรุณากรอกขนาดยา 7 วัน เช่น 3,3,3,3,3,1.5,0")
-                ])
-            )
-            return
 
-        days_th = ["จันทร์", "อังคาร", "พุธ", "พฤหัส", "ศุกร์", "เสาร์", "อาทิตย์"]
-        doses_by_day = [f"📅 วัน{day}: {dose.strip()} mg" for day, dose in zip(days_th, dose_list)]
-        dose_preview = "\n".join(doses_by_day)
-
-        result = send_to_google_sheet(
-            user_id=user_id,
-            name=session["name"],
-            birthdate=session["birthdate"],
-            inr=session["inr"],
-            bleeding=session["bleeding"],
-            supplement=session["supplement"],
-            warfarin_dose=session["warfarin_dose"]
-        )
-        reply = f"""✅ ข้อมูลถูกบันทึกเรียบร้อยแล้ว
-👤 {session['name']}
-🧪 INR: {session['inr']}
-🩸 Bleeding: {session['bleeding']}
-🌿 Supplement: {session['supplement']}
+@router.step("ask_warf_dose")
+def handle_ask_warf_dose(ctx):
+    dose_list = ctx.text.split(",")
+    if len(dose_list) != 7 or any(parse_dose(dose) is None for dose in dose_list):
+        # ยังไม่ปิด session ให้พิมพ์ขนาดยาใหม่ได้
+        reply_text(ctx.reply_token, "❌ กรุณากรอกขนาดยา 7 วัน เช่น 3,3,3,3,3,1.5,0")
+        return
+
+    session = sessions.finish(ctx.user_id, "ask_warf_dose")
+    if not session:
+        reply_session_lost(ctx)
+        return
+    session.warfarin_dose = ctx.text
+
+    days_th = ["จันทร์", "อังคาร", "พุธ", "พฤหัส", "ศุกร์", "เสาร์", "อาทิตย์"]
+    doses_by_day = [f"📅 วัน{day}: {dose.strip()} mg" for day, dose in zip(days_th, dose_list)]
+    dose_preview = "\n".join(doses_by_day)
+
+    result = send_to_google_sheet(
+        user_id=ctx.user_id,
+        name=session.name,
+        birthdate=session.birthdate,
+        inr=session.inr,
+        bleeding=session.bleeding,
+        supplement=session.supplement,
+        warfarin_dose=session.warfarin_dose
+    )
+    if result.startswith("❌"):
+        reply_text(ctx.reply_token, "❌ บันทึกข้อมูลไม่สำเร็จ กรุณาเริ่มบันทึกค่า INR ใหม่อีกครั้ง")
+        return
+    reply = f"""✅ ข้อมูลถูกบันทึกเรียบร้อยแล้ว
+👤 {session.name}
+🧪 INR: {session.inr}
+🩸 Bleeding: {session.bleeding}
+🌿 Supplement: {session.supplement}
 
 💊 Warfarin (1 week):
 {dose_preview}
 """
+    reply_text(ctx.reply_token, reply)
 
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text=reply)
-            ])
-        )
-        return
 
-    if text == "ประเมินอาการไม่พึงประสงค์":
-        send_symptom_assessment_flex(reply_token)
-        return
-    
+# หากไม่ได้อยู่ในขั้นตอนใดเลย
+@router.default
+def handle_unknown(ctx):
+    if ctx.session is None:
+        reply_text(ctx.reply_token, "❓ พิมพ์ 'บันทึกค่า INR' เพื่อเริ่มบันทึกข้อมูล INR")
+
+
+# ตรวจตาราง transition ครั้งเดียวตอนเริ่ม app
+router.validate()
+
 
-    # หากไม่ได้อยู่ในขั้นตอนใดเลย
-    if user_id not in user_sessions:
-        messaging_api.reply_message(
-            ReplyMessageRequest(reply_token=reply_token, messages=[
-                TextMessage(text="❓ พิมพ์ 'บันทึกค่า INR' เพื่อเริ่มบันทึกข้อมูล INR")
-            ])
-        )
 def update_user_profile(user_id, new_name=None, new_birthdate=None):
     payload = {
         "userId": user_id,
@@ -708,12 +895,67 @@ def update_user_profile(user_id, new_name=None, new_birthdate=None):
         "update_dob": new_birthdate
     }
     try:
-        response = requests.post(GOOGLE_APPS_SCRIPT_URL, json=payload, timeout=10)
-        print("🔄 อัปเดตโปรไฟล์:", response.text)
+        first_name, last_name = split_name(new_name) if new_name else (None, None)
+        repository.upsert_patient(user_id, first_name, last_name, new_birthdate)
+        record_id = enqueue("profile", GOOGLE_APPS_SCRIPT_URL, payload, user_id=user_id, ref={"profile": True})
+        print(f"🔄 อัปเดตโปรไฟล์: queued #{record_id}")
     except Exception as e:
         print("❌ ERROR while updating profile:", e)
 
+# ====== วาดกราฟล่วงหน้าเก็บไว้ใน cache (ครั้งหน้าที่กดดูกราฟจะได้รูปทันที) ======
+def prerender_inr_chart(user_id):
+    try:
+        dates, inrs = get_inr_history_from_sheet(user_id, last=CHART_HISTORY_POINTS)
+        if dates and inrs:
+            chart_cache.get_or_render(dates, inrs, generate_inr_chart)
+    except Exception as e:
+        print("❌ Error pre-rendering INR chart:", e)
+
+# ====== หลัง outbox ส่งข้อมูลถึง Apps Script แล้ว ข้อมูลจากชีตทับข้อมูลในเครื่องได้ ======
+def on_sheet_write_flushed(kind, user_id, payload, ref):
+    if user_id:
+        repository.mark_flushed(user_id, ref)
+
+add_flush_listener(on_sheet_write_flushed)
+
+
+
+# ====== เริ่ม thread เบื้องหลังทั้งหมดตอน import (ทั้ง python app.py และ gunicorn app:app)
+# ยกเว้น worker ของ weekly_reports ที่ spawn จาก python app.py: process นั้นรัน app.py เป็น __mp_main__
+# และต้องไม่เริ่มงานเหล่านี้ซ้ำ ======
+def start_background_workers():
+    # ทำงานแจ้งเตือนที่ค้างอยู่ต่อ (หลัง crash / restart)
+    resume_pending_jobs()
+
+    # เริ่ม thread ส่งข้อมูลใน outbox (รวมแถวที่ค้างจากรอบก่อน)
+    start_flusher()
+    sheet_sync.start()
+    alerts.start()
+
+    # refresh แผนแจ้งเตือนของวันนี้/พรุ่งนี้เบื้องหลัง (หลังรูปขนาดยาพร้อม)
+    if SPREADSHEET_ID:
+        start_plan_refresher(reminder_columns, build_reminder_entry,
+                             wait=lambda: wait_for_dose_images(DOSE_IMAGE_WAIT_SECONDS))
+
+    if TTR_RUN_AT:
+        start_daily_schedule("ttr_analytics", TTR_RUN_AT)
+
+    if weekly_reports.WEEKLY_REPORT_AT:
+        start_daily_schedule("weekly_report", weekly_reports.WEEKLY_REPORT_AT,
+                             params=lambda day: {"week": weekly_reports.week_key(datetime.strptime(day, "%Y-%m-%d"))},
+                             weekdays={weekly_reports.WEEKLY_REPORT_WEEKDAY}, dedupe_key=weekly_reports.week_key)
+
+    # เริ่ม worker ประมวลผล event จาก LINE
+    event_queue.start()
+
+    # หลัง server พร้อมแล้วค่อยโหลด LINE SDK / matplotlib / ฟอนต์ไทย เบื้องหลัง
+    start_warmup(messaging_api)
+
+    # โหลด/แปลงรูปขนาดยาเก็บไว้เสิร์ฟเอง (ไม่ต้องพึ่ง Google Drive ตอนส่งแจ้งเตือน)
+    start_dose_image_warmup(WARMUP_DELAY_SECONDS)
 
+if __name__ != "__mp_main__":
+    start_background_workers()
 
 # ====== Run App ======
 if __name__ == "__main__":
@@ -0,0 +1,20 @@
+import os
+
+# ====== ชี้ path ของ state ทุกตัวของ app ไปที่ workdir ชั่วคราว ======
+# benchmark จะไม่อ่าน/เขียนฐานข้อมูลและไฟล์ใน /tmp/warfarin_* ของเครื่อง (ค่าเริ่มต้นของ app)
+STATE_PATHS = {
+    "NOTIFY_JOB_DIR": "jobs",
+    "OUTBOX_DB": "outbox.db",
+    "INR_DB": "inr.db",
+    "SESSION_DB": "sessions.db",
+    "ALERT_DB": "alerts.db",
+    "IMAGE_DIR": "images",
+    "CHART_CACHE_DIR": "charts",
+    "DOSE_IMAGE_DIR": "dose_images",
+    "REMINDER_PLAN_DIR": "plans",
+    "TTR_REPORT_DIR": "ttr",
+}
+
+
+def state_env(workdir):
+    return {key: os.path.join(workdir, name) for key, name in STATE_PATHS.items()}
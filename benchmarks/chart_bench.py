@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# ====== เทียบ renderer กราฟ INR: matplotlib กับ Pillow (เวลาต่อรูป, ขนาด PNG, เวลารูปแรกตอน cold start) ======
+# ใช้: python benchmarks/chart_bench.py --charts 200
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from weekly_render_bench import synthetic_items  # noqa: E402
+
+RENDERERS = ["matplotlib", "pil"]
+
+# process ใหม่: import + สร้าง renderer + วาดรูปแรก (เหมือนคำขอกราฟแรกหลัง deploy)
+COLD_START_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+from inr_chart import create_renderer
+create_renderer({kind!r}).render(["01/01/2024", "08/01/2024", "15/01/2024"], [2.1, 3.0, 6.4])
+print(time.perf_counter() - started)
+"""
+
+
+def cold_start(kind):
+    output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT.format(root=ROOT, kind=kind)],
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def bench(kind, items):
+    from inr_chart import create_renderer
+
+    renderer = create_renderer(kind)
+    renderer.render(items[0][1], items[0][2])
+    draw_seconds = encode_seconds = 0.0
+    sizes = []
+    for _, dates, inrs in items:
+        started = time.perf_counter()
+        image = renderer.draw(dates, inrs)
+        drawn = time.perf_counter()
+        png = renderer.encode(image)
+        draw_seconds += drawn - started
+        encode_seconds += time.perf_counter() - drawn
+        sizes.append(len(png))
+    count = len(items)
+    return {
+        "ms_per_chart": round((draw_seconds + encode_seconds) / count * 1000, 2),
+        "draw_ms": round(draw_seconds / count * 1000, 2),
+        "encode_ms": round(encode_seconds / count * 1000, 2),
+        "png_bytes_avg": round(sum(sizes) / count),
+        "cold_start_seconds": round(cold_start(kind), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INR chart renderer benchmark (matplotlib vs Pillow)")
+    parser.add_argument("--charts", type=int, default=200)
+    parser.add_argument("--points", type=int, default=12, help="INR readings per chart")
+    parser.add_argument("--renderers", default=",".join(RENDERERS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-dir", default="", help="write the first chart of each renderer here")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    items = synthetic_items(args.charts, args.points, args.seed)
+    result = {"charts": args.charts, "points": args.points, "renderers": {}}
+    for kind in args.renderers.split(","):
+        result["renderers"][kind] = bench(kind, items)
+        if args.save_dir:
+            from inr_chart import create_renderer
+
+            os.makedirs(args.save_dir, exist_ok=True)
+            with open(os.path.join(args.save_dir, f"chart_{kind}.png"), "wb") as f:
+                f.write(create_renderer(kind).render(items[0][1], items[0][2]))
+
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"{args.charts} charts x {args.points} points")
+    for kind, row in result["renderers"].items():
+        print(f"  {kind:<10}: {row['ms_per_chart']:>7.2f} ms/chart (draw {row['draw_ms']} ms, "
+              f"encode {row['encode_ms']} ms), PNG {row['png_bytes_avg']} bytes, "
+              f"cold start {row['cold_start_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import hmac
+import time
+import base64
+import socket
+import hashlib
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+from bench_state import state_env
+
+# ====== วัดเวลา cold start: ตั้งแต่เริ่ม process จนได้ response แรกจาก /callback ======
+# ใช้: python benchmarks/cold_start.py --runs 5
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = "benchmark-secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def signed_body():
+    # webhook แบบไม่มี event (เหมือนตอนกด Verify ใน LINE console)
+    body = json.dumps({"destination": "Ubenchmark", "events": []}).encode()
+    signature = base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return body, signature
+
+
+def measure_once(timeout):
+    with tempfile.TemporaryDirectory(prefix="warfarin-bench-") as workdir:
+        return _measure(timeout, workdir)
+
+
+def _measure(timeout, workdir):
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        LINE_CHANNEL_SECRET=CHANNEL_SECRET,
+        LINE_CHANNEL_ACCESS_TOKEN="benchmark-token",
+        PYTHONDONTWRITEBYTECODE="1",
+        **state_env(workdir),
+    )
+    body, signature = signed_body()
+    url = f"http://127.0.0.1:{port}/callback"
+
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"app.py exited with code {proc.returncode}")
+            req = urllib.request.Request(url, data=body, method="POST", headers={
+                "Content-Type": "application/json",
+                "X-Line-Signature": signature,
+            })
+            try:
+                with urllib.request.urlopen(req, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.01)
+        raise TimeoutError("no /callback response within timeout")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure process start → first /callback response")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    results = [measure_once(args.timeout) for _ in range(args.runs)]
+    summary = {
+        "runs": args.runs,
+        "min_ms": round(min(results) * 1000, 1),
+        "median_ms": round(statistics.median(results) * 1000, 1),
+        "max_ms": round(max(results) * 1000, 1),
+    }
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(f"cold start → first /callback: median {summary['median_ms']} ms "
+              f"(min {summary['min_ms']}, max {summary['max_ms']}, runs {summary['runs']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ====== server จำลอง LINE Messaging API และ Apps Script สำหรับ load test (ไม่ต้องต่อ internet) ======
+# ใช้เดี่ยวๆ: python benchmarks/emulators.py --line-port 9101 --script-port 9102 --latency-ms 80
+THAI_DAYS = ["วันจันทร์", "วันอังคาร", "วันพุธ", "วันพฤหัสบดี", "วันศุกร์", "วันเสาร์", "วันอาทิตย์"]
+
+
+class Faults:
+    # latency = ค่าเฉลี่ย (ms), jitter = +/- สุ่ม, error_rate = สัดส่วนที่ตอบ 500
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def apply(self):
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        return random.random() < self.error_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    emulator = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.emulator.handle(self, "GET", b"")
+
+    def do_POST(self):
+        self.emulator.handle(self, "POST", self._body())
+
+
+class _Emulator:
+    def __init__(self, port=0, faults=None):
+        self.faults = faults or Faults()
+        self.counts = {"requests": 0, "errors": 0}
+        self._lock = threading.Lock()
+        handler = type("Handler", (_Handler,), {"emulator": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def handle(self, request, method, body):
+        self._count("requests")
+        if self.faults.apply():
+            self._count("errors")
+            request._send_json(500, {"message": "injected error"})
+            return
+        self.respond(request, method, body)
+
+    def respond(self, request, method, body):
+        raise NotImplementedError
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ====== LINE: reply / push / multicast (บันทึกเวลาที่ได้รับ reply ตาม replyToken) ======
+class LineEmulator(_Emulator):
+    def __init__(self, port=0, faults=None):
+        super().__init__(port, faults)
+        self.counts.update({"reply": 0, "push": 0, "multicast": 0})
+        self._replies = {}
+        self._reply_cond = threading.Condition()
+
+    def respond(self, request, method, body):
+        path = urlsplit(request.path).path
+        data = json.loads(body or b"{}")
+        if path.endswith("/message/reply"):
+            self._count("reply")
+            with self._reply_cond:
+                self._replies[data.get("replyToken")] = time.perf_counter()
+                self._reply_cond.notify_all()
+            request._send_json(200, {"sentMessages": []})
+        elif path.endswith("/message/push"):
+            self._count("push")
+            request._send_json(200, {"sentMessages": []})
+        elif path.endswith("/message/multicast"):
+            self._count("multicast")
+            request._send_json(200, {})
+        else:
+            request._send_json(404, {"message": "not emulated"})
+
+    def wait_reply(self, reply_token, timeout):
+        deadline = time.monotonic() + timeout
+        with self._reply_cond:
+            while reply_token not in self._replies:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._reply_cond.wait(remaining)
+            return self._replies.pop(reply_token)
+
+
+# ====== Apps Script: profile / latest / history (GET) และบันทึกข้อมูล (POST) ======
+class AppsScriptEmulator(_Emulator):
+    def __init__(self, port=0, faults=None, history_points=24):
+        super().__init__(port, faults)
+        self.counts.update({"profile": 0, "latest": 0, "history": 0, "write": 0})
+        self.history_points = history_points
+
+    def respond(self, request, method, body):
+        if method == "POST":
+            self._count("write")
+            request._send_json(200, {"status": "success"})
+            return
+        query = {k: v[0] for k, v in parse_qs(urlsplit(request.path).query).items()}
+        user_id = query.get("userId", "")
+        if query.get("profile") == "true":
+            self._count("profile")
+            request._send_json(200, {"firstName": "ทดสอบ", "lastName": user_id[-4:], "birthdate": "01/01/2530"})
+        elif query.get("latest") == "true":
+            self._count("latest")
+            request._send_json(200, {f"{day} (คำอธิบาย)": "เม็ดสีฟ้า 1 เม็ด" for day in THAI_DAYS})
+        elif query.get("history") == "true":
+            self._count("history")
+            rng = random.Random(user_id)
+            items = [{"date": f"{28 - i % 28:02d}/{12 - i // 28 % 12:02d}/2025", "inr": round(rng.uniform(1.5, 4.0), 1)}
+                     for i in range(self.history_points)]
+            request._send_json(200, items)
+        else:
+            request._send_json(200, {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run LINE / Apps Script emulators")
+    parser.add_argument("--line-port", type=int, default=9101)
+    parser.add_argument("--script-port", type=int, default=9102)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    faults = Faults(args.latency_ms, args.jitter_ms, args.error_rate)
+    line = LineEmulator(args.line_port, faults).start()
+    script = AppsScriptEmulator(args.script_port, faults).start()
+    print(f"LINE_API_BASE_URL={line.base_url}")
+    print(f"GOOGLE_APPS_SCRIPT_URL={script.base_url}/exec")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        line.stop()
+        script.stop()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+# ====== วัดต้นทุนการ route ข้อความ 1 ข้อความ (normalize + lookup) ======
+# ใช้: python benchmarks/route_bench.py --iterations 200000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from conversation_router import ConversationRouter, normalize_text  # noqa: E402
+from bench_state import state_env  # noqa: E402
+
+SAMPLE_MESSAGES = [
+    ("บันทึกค่า INR", None),
+    ("2.7", "ask_inr"),
+    ("Yes", "ask_bleeding"),
+    ("ไม่มี", "ask_supplement"),
+    ("3,3,3,3,3,1.5,0", "ask_warf_dose"),
+    ("ดูกราฟ INR", None),
+    ("วันนี้ฉันกินยาอย่างไร", None),
+    ("จุดจ้ำเลือด", None),
+    (" เจ็บหน้าอก  หายใจลำบาก ", None),
+    ("สวัสดีครับ", None),
+]
+
+
+def load_app_router(workdir):
+    os.environ.setdefault("LINE_CHANNEL_SECRET", "benchmark-secret")
+    os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "benchmark-token")
+    os.environ.setdefault("WARMUP_DELAY_SECONDS", "3600")
+    os.environ.update(state_env(workdir))
+    import app
+    return app.router
+
+
+def synthetic_router(commands):
+    router = ConversationRouter()
+    noop = lambda ctx: None  # noqa: E731
+    for i in range(commands):
+        router.commands[normalize_text(f"เมนู {i}")] = noop
+    for name in ("ask_inr", "ask_bleeding", "ask_supplement", "ask_warf_dose"):
+        router.steps[name] = noop
+    router.fallback = noop
+    return router
+
+
+def per_message_ns(router, iterations):
+    messages = SAMPLE_MESSAGES * (iterations // len(SAMPLE_MESSAGES) + 1)
+    messages = messages[:iterations]
+    route = router.route
+    started = time.perf_counter()
+    for text, step in messages:
+        route(normalize_text(text), step)
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Routing cost per message")
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--skip-app", action="store_true", help="only run the synthetic table sizes")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    if not args.skip_app:
+        with tempfile.TemporaryDirectory(prefix="warfarin-route-bench-") as workdir:
+            results["app"] = round(per_message_ns(load_app_router(workdir), args.iterations), 1)
+    for size in (10, 100, 1000, 10000):
+        results[f"synthetic_{size}_commands"] = round(per_message_ns(synthetic_router(size), args.iterations), 1)
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for name, ns in results.items():
+            print(f"{name:>28}: {ns:8.1f} ns/message")
+
+
+if __name__ == "__main__":
+    main()
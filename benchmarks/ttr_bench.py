@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# ====== วัดเวลาคำนวณ TTR ทั้ง cohort: NumPy รอบเดียว เทียบกับ loop รายคนแบบเดิม ======
+# ใช้: python benchmarks/ttr_bench.py --patients 20000 --readings 24
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed_database(path, patients, readings, seed):
+    from inr_repository import InrRepository
+
+    rng = random.Random(seed)
+    repository = InrRepository(path)
+    today = datetime.now()
+    rows = []
+    for p in range(patients):
+        day = today - timedelta(days=readings * 28)
+        inr = rng.uniform(1.5, 3.5)
+        for _ in range(readings):
+            day += timedelta(days=rng.randint(7, 42))
+            inr = min(6.0, max(1.0, inr + rng.gauss(0, 0.6)))
+            rows.append((f"U{p:08d}", day.strftime("%d/%m/%Y"), day.strftime("%Y-%m-%dT00:00:00"), round(inr, 1), 0.0))
+    repository._write(lambda conn: conn.executemany(
+        "INSERT INTO inr_readings (user_id, date, taken_at, inr, source, synced, created_at) "
+        "VALUES (?, ?, ?, ?, 'sheet', 1, ?)", rows))
+    return repository
+
+
+def ttr_loop(repository, low, high, max_gap):
+    # แบบที่เคยทำใน spreadsheet: ทีละคน ทีละช่วงระหว่างผลตรวจ
+    by_user = {}
+    for user_id, day, inr in repository._conn().execute(
+        "SELECT user_id, julianday(taken_at), inr FROM inr_readings ORDER BY user_id, taken_at, id"
+    ):
+        by_user.setdefault(user_id, []).append((day, inr))
+    result = {}
+    for user_id, series in by_user.items():
+        total = in_range = 0.0
+        for (d1, a), (d2, b) in zip(series, series[1:]):
+            gap = d2 - d1
+            if gap <= 0 or gap > max_gap:
+                continue
+            if a == b:
+                fraction = 1.0 if low <= a <= high else 0.0
+            else:
+                lo, hi = min(a, b), max(a, b)
+                fraction = max(0.0, min(hi, high) - max(lo, low)) / (hi - lo)
+            total += gap
+            in_range += gap * fraction
+        result[user_id] = in_range / total * 100 if total else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cohort TTR benchmark")
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--readings", type=int, default=24, help="INR readings per patient")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="warfarin-ttr-bench-")
+    os.environ["TTR_WINDOW_DAYS"] = "0"
+    repository = seed_database(os.path.join(workdir, "inr.db"), args.patients, args.readings, args.seed)
+
+    import ttr_analytics
+
+    # import numpy ครั้งเดียวต่อ process (งานรอบถัดไปไม่ต้องจ่าย) จึงแยกออกจากเวลาของงาน
+    started = time.perf_counter()
+    import numpy  # noqa: F401
+    numpy_import = time.perf_counter() - started
+
+    started = time.perf_counter()
+    report = ttr_analytics.build_report(repository)
+    vectorized = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected = ttr_loop(repository, ttr_analytics.TTR_LOW, ttr_analytics.TTR_HIGH, ttr_analytics.TTR_MAX_GAP_DAYS)
+    loop = time.perf_counter() - started
+
+    mismatches = sum(
+        1 for row in report["patients"]
+        if (expected[row["user_id"]] is None) != (row["ttr"] is None)
+        or (row["ttr"] is not None and abs(expected[row["user_id"]] - row["ttr"]) > 0.051)
+    )
+    result = {
+        "patients": args.patients,
+        "readings": args.patients * args.readings,
+        "numpy_seconds": round(vectorized, 3),
+        "numpy_load_seconds": report["timing"]["load_seconds"],
+        "numpy_compute_seconds": report["timing"]["compute_seconds"],
+        "numpy_import_seconds": round(numpy_import, 3),
+        "loop_seconds": round(loop, 3),
+        "mismatches": mismatches,
+        "ttr_mean": report["cohort"]["ttr_mean"],
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"{result['patients']} patients / {result['readings']} readings, cohort TTR mean {result['ttr_mean']}%")
+    print(f"  numpy : {result['numpy_seconds']:.3f}s (load {result['numpy_load_seconds']}s, "
+          f"compute {result['numpy_compute_seconds']}s; import numpy {result['numpy_import_seconds']}s ก่อนเริ่มจับเวลา)")
+    print(f"  loop  : {result['loop_seconds']:.3f}s")
+    print(f"  mismatches vs loop: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
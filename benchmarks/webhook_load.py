@@ -0,0 +1,260 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import base64
+import random
+import socket
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# ====== load test ของ /callback: ยิง webhook ที่เซ็นถูกต้อง แล้ววัดจนกว่า LINE (emulator) ได้ reply ======
+# ใช้: python benchmarks/webhook_load.py --users 50 --concurrency 20 --latency-ms 80
+#      เทียบ config: --env SESSION_BACKEND=sqlite หรือ --server-cmd "gunicorn -w 2 -b 127.0.0.1:{port} app:app"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from emulators import Faults, LineEmulator, AppsScriptEmulator  # noqa: E402
+from bench_state import state_env  # noqa: E402
+
+CHANNEL_SECRET = "load-test-secret"
+
+# (ชื่อ, ข้อความที่ผู้ใช้พิมพ์ตามลำดับ, น้ำหนัก)
+SCENARIOS = [
+    ("inr_entry", ["บันทึกค่า INR", "2.6", "no", "ไม่มี", "3,3,3,3,3,1.5,0"], 3),
+    ("chart", ["ดูกราฟ INR"], 2),
+    ("today_dose", ["วันนี้ฉันกินยาอย่างไร"], 3),
+    ("symptoms", ["ประเมินอาการไม่พึงประสงค์", "จุดจ้ำเลือด"], 2),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1) if values else None,
+        "p95_ms": round(percentile(values, 95) * 1000, 1) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 1) if values else None,
+        "max_ms": round(max(values) * 1000, 1) if values else None,
+    }
+
+
+def text_event(user_id, text, reply_token):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": reply_token,
+        "message": {"id": str(random.randint(10 ** 14, 10 ** 15)), "type": "text", "text": text,
+                    "quoteToken": uuid.uuid4().hex},
+    }
+
+
+def signed(payload):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    signature = base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return body, signature
+
+
+def post_webhook(url, payload, timeout=10):
+    body, signature = signed(payload)
+    req = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "X-Line-Signature": signature,
+    })
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+# รูปขนาดยาสร้างขึ้นในเครื่อง จะได้ไม่ต้องโหลดจาก Google Drive ระหว่างทดสอบ
+def make_dose_images(directory):
+    from PIL import Image
+    from dose_catalog import DOSE_IMAGE_MAP
+
+    os.makedirs(directory, exist_ok=True)
+    for key in DOSE_IMAGE_MAP:
+        Image.new("RGB", (640, 480), (90, 140, 220)).save(os.path.join(directory, f"{key}.png"))
+
+
+def start_server(args, line, script, workdir):
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        LINE_CHANNEL_SECRET=CHANNEL_SECRET,
+        LINE_CHANNEL_ACCESS_TOKEN="load-test-token",
+        LINE_API_BASE_URL=line.base_url,
+        GOOGLE_APPS_SCRIPT_URL=f"{script.base_url}/exec",
+        DOSE_IMAGE_SOURCE_DIR=os.path.join(workdir, "dose_sources"),
+        PYTHONDONTWRITEBYTECODE="1",
+        **state_env(workdir),
+    )
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    make_dose_images(env["DOSE_IMAGE_SOURCE_DIR"])
+
+    command = args.server_cmd.format(port=port, python=sys.executable)
+    proc = subprocess.Popen(command, shell=True, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL if not args.verbose else None,
+                            stderr=subprocess.DEVNULL if not args.verbose else None)
+    url = f"http://127.0.0.1:{port}/callback"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            if post_webhook(url, {"destination": "Uloadtest", "events": []}, timeout=1) == 200:
+                return proc, url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.05)
+    proc.terminate()
+    raise TimeoutError("server did not answer /callback in time")
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ack = []
+        self.reply = {}
+        self.errors = {"http": 0, "no_reply": 0}
+
+    def add(self, scenario, ack_seconds, reply_seconds):
+        with self._lock:
+            self.ack.append(ack_seconds)
+            if reply_seconds is None:
+                self.errors["no_reply"] += 1
+            else:
+                self.reply.setdefault(scenario, []).append(reply_seconds)
+
+    def error(self, kind):
+        with self._lock:
+            self.errors[kind] += 1
+
+
+def run_user(url, line, recorder, scenarios, reply_timeout):
+    user_id = "U" + uuid.uuid4().hex
+    for name, texts in scenarios:
+        for text in texts:
+            reply_token = uuid.uuid4().hex
+            payload = {"destination": "Uloadtest", "events": [text_event(user_id, text, reply_token)]}
+            started = time.perf_counter()
+            status = post_webhook(url, payload)
+            acked = time.perf_counter()
+            if status != 200:
+                recorder.error("http")
+                continue
+            # ข้อความถัดไปของผู้ใช้คนเดิมต้องรอ reply ก่อน (flow บันทึก INR ทำงานทีละ step)
+            replied = line.wait_reply(reply_token, reply_timeout)
+            recorder.add(name, acked - started, None if replied is None else replied - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook load test against local LINE / Apps Script emulators")
+    parser.add_argument("--users", type=int, default=50, help="number of simulated LINE users")
+    parser.add_argument("--concurrency", type=int, default=20, help="users active at the same time")
+    parser.add_argument("--scenarios-per-user", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=50, help="emulated upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered with 500")
+    parser.add_argument("--reply-timeout", type=float, default=20)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--server-cmd", default="{python} app.py",
+                        help="command that starts the app; {port} and {python} are substituted")
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show server output")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    weights = [weight for _, _, weight in SCENARIOS]
+    plans = [[(name, texts) for name, texts, _ in rng.choices(SCENARIOS, weights, k=args.scenarios_per_user)]
+             for _ in range(args.users)]
+
+    faults = Faults(args.latency_ms, args.jitter_ms, args.error_rate)
+    line = LineEmulator(faults=faults).start()
+    script = AppsScriptEmulator(faults=faults).start()
+    workdir = tempfile.TemporaryDirectory(prefix="warfarin-load-")
+    recorder = Recorder()
+    proc = None
+    try:
+        proc, url = start_server(args, line, script, workdir.name)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(run_user, url, line, recorder, plan, args.reply_timeout) for plan in plans]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        line.stop()
+        script.stop()
+        workdir.cleanup()
+
+    all_replies = [v for values in recorder.reply.values() for v in values]
+    report = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "webhooks": len(recorder.ack) + recorder.errors["http"],
+        "elapsed_seconds": round(elapsed, 2),
+        "webhooks_per_second": round((len(recorder.ack) + recorder.errors["http"]) / elapsed, 1),
+        "replies_per_second": round(len(all_replies) / elapsed, 1),
+        "errors": recorder.errors,
+        "ack": summarize(recorder.ack),
+        "reply": summarize(all_replies),
+        "reply_by_scenario": {name: summarize(values) for name, values in sorted(recorder.reply.items())},
+        "upstream_calls": {"line": dict(line.counts), "apps_script": dict(script.counts)},
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    print(f"{report['webhooks']} webhooks in {report['elapsed_seconds']}s → "
+          f"{report['webhooks_per_second']} req/s, {report['replies_per_second']} replies/s "
+          f"(errors: {report['errors']})")
+    header = f"{'':>24} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    rows = [("webhook ack", report["ack"]), ("reply (end-to-end)", report["reply"])]
+    rows += [(f"  {name}", stats) for name, stats in report["reply_by_scenario"].items()]
+    for label, stats in rows:
+        print(f"{label:>24} {stats['count']:>7} {stats['p50_ms']!s:>9} {stats['p95_ms']!s:>9} "
+              f"{stats['p99_ms']!s:>9} {stats['max_ms']!s:>9}")
+    print(f"upstream calls: {report['upstream_calls']}")
+
+
+if __name__ == "__main__":
+    main()
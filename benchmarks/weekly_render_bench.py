@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+# ====== วัดความเร็ววาดกราฟรายงานประจำสัปดาห์: process เดียว เทียบกับ process pool หลายขนาด ======
+# ใช้: python benchmarks/weekly_render_bench.py --charts 400 --workers 1,2,4
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_items(charts, points, seed):
+    rng = random.Random(seed)
+    items = []
+    for n in range(charts):
+        day = datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 60))
+        inr = rng.uniform(1.5, 3.5)
+        dates, inrs = [], []
+        for _ in range(points):
+            day += timedelta(days=rng.randint(7, 28))
+            inr = min(7.0, max(1.0, inr + rng.gauss(0, 0.7)))
+            dates.append(day.strftime("%d/%m/%Y"))
+            inrs.append(round(inr, 1))
+        items.append((f"U{n:08d}", dates, inrs))
+    return items
+
+
+def bench_inline(items):
+    # ไม่ใช้ pool: renderer เดียวกันวาด + ทำ preview ใน process นี้ทีละรูป
+    from inr_chart import create_renderer
+    from image_store import make_preview
+
+    renderer = create_renderer()
+    renderer.render(items[0][1], items[0][2])
+    started = time.perf_counter()
+    for _, dates, inrs in items:
+        make_preview(renderer.render(dates, inrs))
+    return time.perf_counter() - started
+
+
+def bench_pool(items, workers):
+    import weekly_reports
+
+    with weekly_reports.create_pool(workers) as pool:
+        # ให้ worker สร้าง figure ให้เสร็จก่อนเริ่มจับเวลา
+        list(weekly_reports.render_charts(pool, items[:workers], workers))
+        started = time.perf_counter()
+        count = sum(1 for _ in weekly_reports.render_charts(pool, items, workers))
+        elapsed = time.perf_counter() - started
+    assert count == len(items)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weekly report chart rendering benchmark")
+    parser.add_argument("--charts", type=int, default=400)
+    parser.add_argument("--points", type=int, default=12, help="INR readings per chart")
+    parser.add_argument("--workers", default="", help="comma-separated pool sizes (default 1..available CPUs)")
+    parser.add_argument("--skip-inline", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    from weekly_reports import available_cpus
+
+    cpus = available_cpus()
+    sizes = [int(w) for w in args.workers.split(",") if w] or sorted({1, 2, 4, cpus} & set(range(1, cpus + 1)))
+    items = synthetic_items(args.charts, args.points, args.seed)
+
+    result = {"charts": args.charts, "cpu_count": cpus, "pool": {}}
+    if not args.skip_inline:
+        seconds = bench_inline(items)
+        result["inline"] = {"seconds": round(seconds, 3), "charts_per_second": round(args.charts / seconds, 1)}
+    for workers in sizes:
+        seconds = bench_pool(items, workers)
+        result["pool"][workers] = {"seconds": round(seconds, 3), "charts_per_second": round(args.charts / seconds, 1)}
+
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"{args.charts} charts x {args.points} points, {cpus} CPU")
+    if "inline" in result:
+        print(f"  inline (no pool)   : {result['inline']['seconds']:.3f}s "
+              f"({result['inline']['charts_per_second']} charts/s)")
+    base = result["pool"].get(sizes[0], {}).get("seconds")
+    for workers, row in result["pool"].items():
+        print(f"  pool {workers:>2} worker(s)  : {row['seconds']:.3f}s ({row['charts_per_second']} charts/s, "
+              f"x{base / row['seconds']:.2f} vs {sizes[0]})")
+
+
+if __name__ == "__main__":
+    main()
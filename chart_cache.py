@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from inr_chart import CHART_RENDERER
+
+# ====== Cache กราฟ INR (key = hash ของชุดข้อมูล วันที่+ค่า INR) ======
+CHART_CACHE_ITEMS = int(os.getenv("CHART_CACHE_ITEMS", "256"))
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR", "/tmp/warfarin_charts")
+CHART_DISK_MAX_FILES = int(os.getenv("CHART_DISK_MAX_FILES", "5000"))
+# เกิน CHART_DISK_MAX_FILES แล้วลบไฟล์เก่าจนเหลือสัดส่วนนี้ (ไม่ต้อง list ทั้ง directory ทุกครั้งที่ spill)
+CHART_DISK_PRUNE_TO = float(os.getenv("CHART_DISK_PRUNE_TO", "0.9"))
+# เปลี่ยนค่านี้เมื่อหน้าตากราฟเปลี่ยน เพื่อไม่ให้ใช้รูปเก่าใน cache
+CHART_VERSION = "1"
+
+# renderer ใช้ figure / รูปพื้นหลังร่วมกัน → วาดกราฟได้ทีละรูปเท่านั้น
+render_lock = threading.Lock()
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart-prerender")
+
+
+def series_key(dates, inrs):
+    raw = json.dumps([CHART_VERSION, CHART_RENDERER, list(dates), [float(v) for v in inrs]], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ChartCache:
+    def __init__(self, maxsize=CHART_CACHE_ITEMS, spill_dir=CHART_CACHE_DIR, max_files=CHART_DISK_MAX_FILES):
+        self.maxsize = maxsize
+        self.spill_dir = spill_dir
+        self.max_files = max_files
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # จำนวนไฟล์ใน spill_dir นับต่อจากการ list ครั้งล่าสุด (None = ยังไม่เคย list)
+        self._disk_files = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.png")
+
+    def _spill(self, key, png):
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                return
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_files is not None:
+                    self._disk_files += 1
+                full = self._disk_files is None or self._disk_files > self.max_files
+            if full:
+                self._prune_disk()
+        except OSError as e:
+            print("❌ chart cache spill error:", e)
+
+    def _prune_disk(self):
+        # list จริงเฉพาะครั้งแรกและตอนเกินขีด (ตัวนับอาจคลาดถ้าหลาย process ใช้ directory เดียวกัน จะถูกแก้ตอนนี้)
+        files = [os.path.join(self.spill_dir, name) for name in os.listdir(self.spill_dir) if name.endswith(".png")]
+        if len(files) > self.max_files:
+            files.sort(key=os.path.getmtime)
+            keep = int(self.max_files * CHART_DISK_PRUNE_TO)
+            for path in files[:len(files) - keep]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            files = files[len(files) - keep:]
+        with self._lock:
+            self._disk_files = len(files)
+
+    def get(self, key):
+        with self._lock:
+            png = self._items.get(key)
+            if png is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return png
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                png = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self.put(key, png)
+        return png
+
+    def put(self, key, png):
+        evicted = []
+        with self._lock:
+            self._items[key] = png
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                evicted.append(self._items.popitem(last=False))
+        # รูปที่หลุดจาก memory ถูกเขียนลงดิสก์แทน
+        for old_key, old_png in evicted:
+            self._spill(old_key, old_png)
+
+    def get_or_render(self, dates, inrs, render):
+        key = series_key(dates, inrs)
+        png = self.get(key)
+        if png is None:
+            with render_lock:
+                # render อาจ reverse list ในที่ จึงส่งสำเนาไป
+                png = render(list(dates), list(inrs)).getvalue()
+            self.put(key, png)
+        return png
+
+    def stats(self):
+        return {"items": len(self._items), "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+
+def submit_background(func, *args):
+    return _background.submit(func, *args)
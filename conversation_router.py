@@ -0,0 +1,109 @@
+import time
+
+# ====== ตัว route ข้อความจาก LINE แบบตาราง (lookup O(1) ด้วยข้อความที่ normalize แล้ว) ======
+
+
+def normalize_text(text):
+    # ตัดช่องว่างซ้ำ/หัวท้าย และไม่สนตัวพิมพ์เล็กใหญ่ (เช่น "Yes" = "yes")
+    return " ".join((text or "").split()).casefold()
+
+
+class MessageContext:
+    __slots__ = ("user_id", "reply_token", "text", "session", "step", "key")
+
+    def __init__(self, user_id, reply_token, text, session):
+        self.user_id = user_id
+        self.reply_token = reply_token
+        self.text = text
+        self.session = session
+        self.step = session.step if session else None
+        self.key = normalize_text(text)
+
+
+class TransitionError(Exception):
+    pass
+
+
+class ConversationRouter:
+    def __init__(self):
+        self.replies = {}     # ข้อความ → คำตอบสำเร็จรูป (เช่น อาการไม่พึงประสงค์)
+        self.commands = {}    # ข้อความเมนู → handler
+        self.steps = {}       # step ใน session → handler
+        self.transitions = {}  # ชื่อ handler → step ที่ไปต่อได้
+        self.fallback = None
+        self.listeners = []
+
+    def reply(self, texts, message):
+        for text in texts:
+            self.replies[normalize_text(text)] = message
+
+    def command(self, *texts, starts=()):
+        def decorator(func):
+            for text in texts:
+                key = normalize_text(text)
+                if key in self.commands or key in self.replies:
+                    raise TransitionError(f"ข้อความ {text!r} ถูกลงทะเบียนซ้ำ")
+                self.commands[key] = func
+            self.transitions[func.__name__] = tuple(starts)
+            return func
+        return decorator
+
+    def step(self, name, next_steps=()):
+        def decorator(func):
+            if name in self.steps:
+                raise TransitionError(f"step {name!r} ถูกลงทะเบียนซ้ำ")
+            self.steps[name] = func
+            self.transitions[func.__name__] = tuple(next_steps)
+            return func
+        return decorator
+
+    def default(self, func):
+        self.fallback = func
+        return func
+
+    def add_listener(self, listener):
+        # listener(kind, name, seconds) ถูกเรียกหลัง dispatch ทุกครั้ง
+        self.listeners.append(listener)
+
+    # ตรวจ transition ที่ประกาศไว้ครั้งเดียวตอนเริ่ม app
+    def validate(self):
+        problems = []
+        for owner, targets in self.transitions.items():
+            for target in targets:
+                if target not in self.steps:
+                    problems.append(f"{owner} → {target!r} (ไม่มี handler ของ step นี้)")
+        reachable = {target for targets in self.transitions.values() for target in targets}
+        for name in self.steps:
+            if name not in reachable:
+                problems.append(f"step {name!r} ไม่มีทางเข้าถึง")
+        if problems:
+            raise TransitionError("conversation table ไม่ถูกต้อง:\n" + "\n".join(problems))
+        return True
+
+    # หาว่าข้อความนี้จะไปที่ไหน (ไม่เรียก handler) — ใช้ทั้งใน dispatch และ benchmark
+    def route(self, key, step):
+        message = self.replies.get(key)
+        if message is not None:
+            return "reply", message
+        func = self.commands.get(key)
+        if func is not None:
+            return "command", func
+        func = self.steps.get(step)
+        if func is not None:
+            return "step", func
+        return "default", self.fallback
+
+    def dispatch(self, ctx, send_reply):
+        started = time.perf_counter()
+        kind, target = self.route(ctx.key, ctx.step)
+        if kind == "reply":
+            name = ctx.key
+            send_reply(ctx, target)
+        else:
+            name = ctx.step if kind == "step" else getattr(target, "__name__", "default")
+            if target is not None:
+                target(ctx)
+        elapsed = time.perf_counter() - started
+        for listener in self.listeners:
+            listener(kind, name, elapsed)
+        return kind
@@ -0,0 +1,279 @@
+import re
+from decimal import Decimal, DecimalException
+
+# ====== ตารางขนาดยา Warfarin: คำอธิบายการแบ่งเม็ด + รูปประกอบ ======
+# เม็ดสีฟ้า 3 mg / เม็ดสีชมพู 5 mg แบ่งได้ละเอียดสุดที่ 1/4 เม็ด (เสี้ยว)
+
+DOSE_DESC_MAP = {
+    "0": "งดยา",
+    "0.75": "เม็ดสีฟ้า เสี้ยว เม็ด",
+    "1.25": "เม็ดสีชมพู เสี้ยว เม็ด",
+    "1.5": "เม็ดสีฟ้า ครึ่ง เม็ด",
+    "2": "เม็ดสีฟ้า เสี้ยว เม็ด + เม็ดสีชมพู เสี้ยว เม็ด",
+    "2.25": "เม็ดสีฟ้า 3 ใน 4  เม็ด",
+    "2.5": "เม็ดสีชมพู ครึ่ง เม็ด",
+    "2.75": " เม็ดสีฟ้าครึ่งเม็ด + ชมพู เสี้ยวเม็ด",
+    "3": "เม็ดสีฟ้า 1 เม็ด",
+    "3.25": "เม็ดสีฟ้า เสี้ยว เม็ด + ชมพู ครึ่ง เม็ด",
+    "3.5": "เม็ดสีฟ้า 3 ใน 4 เม็ด + ชมพู เสี้ยว เม็ด",
+    "3.75": "เม็ดสีชมพู 3 ใน 4 เม็ด",
+    "4": "เม็ดสีฟ้า ครึ่ง เม็ด + ชมพู ครึ่ง เม็ด",
+    "4.25": "เม็ดสีฟ้า 1 เม็ด + ชมพู เสี้ยว เม็ด",
+    "4.5": "เม็ดสีฟ้า 1 เม็ด ครึ่ง",
+    "4.75": "เม็ดสีฟ้า 3 ใน 4 เม็ด + ชมพู ครึ่ง เม็ด",
+    "5": "เม็ดสีชมพู 1 เม็ด",
+    "5.25": " เม็ดสีฟ้า 1 เม็ด +  เม็ดสีฟ้า 3 ใน 4 เม็ด",
+    "5.5": " เม็ดสีฟ้า 1 เม็ด +  เม็ดสีชมพู ครึ่ง เม็ด",
+    "5.75": "เม็ดสีฟ้า เสี้ยว เม็ด + ชมพู 1 เม็ด",
+    "6": "เม็ดสีฟ้า 2 เม็ด",
+    "6.25": "เม็ดสีชมพู 1 เม็ด เสี้ยว",
+    "6.5": "เม็ดสีฟ้า ครึ่ง เม็ด +  เม็ดสีชมพู 1 เม็ด",
+    "6.75": "เม็ดสีฟ้า 1 เม็ด + เม็ดสีชมพู 3 ใน 4 เม็ด",
+    "7.25": "เม็ดสีฟ้า 3 ใน 4 เม็ด + เม็ดสีชมพู 1 เม็ด",
+    "7.5": "สีชมพู 1 เม็ด ครึ่ง",
+    "8": "เม็ดสีฟ้า 1 เม็ด + เม็ดสีชมพู 1 เม็ด",
+    "8.75": "เม็ดสีชมพู 1 เม็ด + เม็ดสีชมพู 3 ใน 4 เม็ด",
+    "9": "เม็ดสีฟ้า 3 เม็ด",
+    "10": "เม็ดสีชมพู 2 เม็ด"
+}
+
+DOSE_IMAGE_MAP = {
+  "0": "https://drive.google.com/uc?export=view&id=1C-xnILoUHREpjR7R7CRTXNM2GZcbBGGl",
+  "0.75": "https://drive.google.com/uc?export=view&id=1oLJSf3pl3Aegci4V3vWlCNtIe1C1SezL",
+  "1.25": "https://drive.google.com/uc?export=view&id=1ZTcC9N36PX1zHQSXgOgG5WIZifnskOsm",
+  "1.5": "https://drive.google.com/uc?export=view&id=1mtlw2S1D3aFulnXWqWbuOqK4p3xvM56s",
+  "2": "https://drive.google.com/uc?export=view&id=1Oqxk2xddHLeX-4V47vcKDJ4ZuzNzsuvQ",
+  "2.25": "https://drive.google.com/uc?export=view&id=12jQ5jGHTa2wGRxUaJ8S1B82DKYqxD02u",
+  "2.5": "https://drive.google.com/uc?export=view&id=1Y7YfElYjNYCkY4ljmE9MJNXesHYuFFXd",
+  "2.75": "https://drive.google.com/uc?export=view&id=1ZXf111FIpxrl37eMyVdxrhF3QF1QvgWw",
+  "3": "https://drive.google.com/uc?export=view&id=1E9q3rkXD4ThRFxFbiRxs4BkgSNPuRYJx",
+  "3.25": "https://drive.google.com/uc?export=view&id=1YKMs-h-gGLDYg0vI0byZ_4zTf0uXWXyh",
+  "3.5": "https://drive.google.com/uc?export=view&id=1EREz7P9-GI_8mERjTUtQ5k_fyqOfigSP",
+  "3.75": "https://drive.google.com/uc?export=view&id=1DLbTm8grBHk5OCp9q6ZsJhePfc-W1DGp",
+  "4": "https://drive.google.com/uc?export=view&id=1tgXDrVC3nWH10WsDauxVOdycZ3uUKnbX",
+  "4.25": "https://drive.google.com/uc?export=view&id=1elqoZlPgSZVoSpyv_HOzJqHCnaK-O4DQ",
+  "4.5": "https://drive.google.com/uc?export=view&id=1Zk8isy0hd0HRfeegSpNqPUZeDyRCK1TF",
+  "4.75": "https://drive.google.com/uc?export=view&id=1B4M4Eyw2S_yuZmcFsWloxbmWPwMGgHXM",
+  "5": "https://drive.google.com/uc?export=view&id=1VL70qndziWlYHPrCVqHjE99jg6TrIHuN",
+  "5.25": "https://drive.google.com/uc?export=view&id=1pgIwUZ0u8ow9NlXX4qn8TYXfGY5QI1o0",
+  "5.5": "https://drive.google.com/uc?export=view&id=1uC5CxdWBrWy0aRKKKNt2AiizNZkE4Ha-",
+  "5.75": "https://drive.google.com/uc?export=view&id=1GLgVX1rC5kwh33cyYwJApgCzVEjYZkSs",
+  "6": "https://drive.google.com/uc?export=view&id=1DSH9PPRLrCtoZIsspNg72VMVPx4GMiQr",
+  "6.25": "https://drive.google.com/uc?export=view&id=1arIeHmlcCDjlZRCxaXp9HinNF5RFTObM",
+  "6.5": "https://drive.google.com/uc?export=view&id=14_c6VwFtimrUz_08KYi2eHrtz03IxVs0",
+  "6.75": "https://drive.google.com/uc?export=view&id=1TLkBttSsd-jgR3gF0PXtYadgwDDKvpLy",
+  "7.25": "https://drive.google.com/uc?export=view&id=1YMenxS-yjiYI9FMcxsWgWF8vrv7Nxk-K",
+  "7.5": "https://drive.google.com/uc?export=view&id=1FE_nDZGagBATeLFqVKsk8ZuyahFxyhH2",
+  "8": "https://drive.google.com/uc?export=view&id=1WGQkiYlkRFdqyxx8frbeMnH23xjPWQf7",
+  "8.75": "https://drive.google.com/uc?export=view&id=113hhEtD9drIp5FxG96YD1_icFDo0q5iJ",
+  "9": "https://drive.google.com/uc?export=view&id=1vA_ZmQV5VE-it-IsYPjxwt0NR8buIdhy",
+  "10": "https://drive.google.com/uc?export=view&id=1B4WnZ_6FD9ORgw1_WGbFbRpJMr81Z16Z",
+# เพิ่มได้ตามขนาดยา
+}
+
+TABLETS = (("ฟ้า", Decimal("3")), ("ชมพู", Decimal("5")))
+QUARTER = Decimal("0.25")
+MAX_TABLETS_PER_COLOUR = 4
+NO_DOSE = Decimal("0")
+# ขนาดยาต่อวันสูงสุดที่ยอมรับ (เม็ดฟ้า + ชมพูอย่างละ MAX_TABLETS_PER_COLOUR เม็ด = 32 mg)
+MAX_DOSE = Decimal("100")
+MAX_DOSE_PLACES = 4
+
+_THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+_FRACTION_WORDS = {"เสี้ยว": 1, "ครึ่ง": 2, "3ใน4": 3}
+_PART_RE = re.compile(r"^(ฟ้า|ชมพู)(\d+(?!ใน))?(3ใน4|ครึ่ง|เสี้ยว)?$")
+_NO_DOSE_WORDS = {"", "-", "0", "งดยา", "งด", "ไม่กินยา"}
+
+
+class DoseEntry:
+    __slots__ = ("dose", "description", "image_url", "blue_quarters", "pink_quarters")
+
+    def __init__(self, dose, description, image_url, blue_quarters, pink_quarters):
+        self.dose = dose
+        self.description = description
+        self.image_url = image_url
+        self.blue_quarters = blue_quarters
+        self.pink_quarters = pink_quarters
+
+    @property
+    def key(self):
+        return dose_key(self.dose)
+
+    @property
+    def label(self):
+        return f"{self.key} mg"
+
+    def __repr__(self):
+        return f"DoseEntry({self.key} mg, {self.description!r})"
+
+
+# ====== แปลงข้อความ → Decimal (ทน "3 mg", "๓", " 3.0 ", "3มก.") ======
+def parse_dose(value):
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        dose = value
+    else:
+        text = str(value).translate(_THAI_DIGITS).strip().lower()
+        text = re.sub(r"\s*(mg|มก\.?|มิลลิกรัม)$", "", text).replace(",", ".").strip()
+        if text in _NO_DOSE_WORDS:
+            return NO_DOSE
+        try:
+            dose = Decimal(text)
+        except DecimalException:
+            return None
+    # ค่าแปลกจากชีต/ผู้ใช้ (เช่น "1e1000000", "1e-1000000") ไม่ใช่ขนาดยา และ normalize() อาจ Overflow
+    if not dose.is_finite() or dose < 0 or dose > MAX_DOSE:
+        return None
+    if not dose:
+        return NO_DOSE
+    try:
+        dose = dose.normalize()
+    except DecimalException:
+        return None
+    return dose if dose.as_tuple().exponent >= -MAX_DOSE_PLACES else None
+
+
+def dose_key(dose):
+    return format(dose.normalize(), "f") if dose else "0"
+
+
+# ====== คำอธิบาย → ชุดเม็ดยา (จำนวนเสี้ยวของแต่ละสี) ======
+def _compact(description):
+    text = (description or "").translate(_THAI_DIGITS)
+    # "สี" ตัดเฉพาะหน้าชื่อสี เพราะคำว่า "เสี้ยว" ก็มี "สี" อยู่ข้างใน
+    return re.sub(r"\s+|เม็ด|สี(?=ฟ้า|ชมพู)", "", text)
+
+
+def parse_description(description):
+    text = _compact(description)
+    if text in ("งดยา", "งด", "-", ""):
+        return (0, 0) if text else None
+    quarters = {"ฟ้า": 0, "ชมพู": 0}
+    for part in text.split("+"):
+        match = _PART_RE.match(part)
+        if not match or not (match.group(2) or match.group(3)):
+            return None
+        colour, whole, fraction = match.groups()
+        quarters[colour] += int(whole or 0) * 4 + _FRACTION_WORDS.get(fraction, 0)
+    return quarters["ฟ้า"], quarters["ชมพู"]
+
+
+def _quarters_to_dose(blue_quarters, pink_quarters):
+    return (TABLETS[0][1] * blue_quarters + TABLETS[1][1] * pink_quarters) * QUARTER
+
+
+def _describe_colour(colour, quarters):
+    whole, fraction = divmod(quarters, 4)
+    word = {1: "เสี้ยว", 2: "ครึ่ง", 3: "3 ใน 4"}.get(fraction)
+    if not whole:
+        return f"เม็ดสี{colour} {word} เม็ด"
+    if not word:
+        return f"เม็ดสี{colour} {whole} เม็ด"
+    return f"เม็ดสี{colour} {whole} เม็ด {word}"
+
+
+def describe_quarters(blue_quarters, pink_quarters):
+    parts = [_describe_colour(colour, q)
+             for (colour, _), q in zip(TABLETS, (blue_quarters, pink_quarters)) if q]
+    return " + ".join(parts) or "งดยา"
+
+
+# ====== หาชุดเม็ดยาสำหรับขนาดที่ไม่มีในตาราง: 3·ฟ้า + 5·ชมพู = 4·dose (หน่วยเสี้ยวเม็ด) ======
+def _pieces_score(blue_quarters, pink_quarters):
+    # ชิ้นยาน้อยสุดก่อน, การตัดเสี้ยว (1/4, 3/4) ยากกว่าตัดครึ่ง, แล้วค่อยดูจำนวนเม็ดรวม
+    pieces = cuts = 0
+    for q in (blue_quarters, pink_quarters):
+        whole, fraction = divmod(q, 4)
+        pieces += whole + (1 if fraction else 0)
+        cuts += 1 if fraction % 2 else 0
+    return pieces + cuts * 0.5, blue_quarters + pink_quarters
+
+
+def solve_tablets(dose):
+    total = dose / QUARTER
+    if total != total.to_integral_value():
+        return None
+    total = int(total)
+    blue_mg, pink_mg = int(TABLETS[0][1]), int(TABLETS[1][1])
+    best = None
+    for pink in range(min(total // pink_mg, MAX_TABLETS_PER_COLOUR * 4) + 1):
+        rest = total - pink * pink_mg
+        if rest % blue_mg:
+            continue
+        blue = rest // blue_mg
+        if blue > MAX_TABLETS_PER_COLOUR * 4:
+            continue
+        if best is None or _pieces_score(blue, pink) < _pieces_score(*best):
+            best = (blue, pink)
+    return best
+
+
+# ====== index สร้างครั้งเดียวตอน import ======
+_by_dose = {}          # Decimal → DoseEntry
+_by_description = {}   # คำอธิบายแบบตัดช่องว่างและคำว่า "เม็ด"/"สี" → Decimal
+_by_image_url = {}     # URL รูป → Decimal
+
+
+def _build_index():
+    for key, description in DOSE_DESC_MAP.items():
+        dose = parse_dose(key)
+        composition = parse_description(description)
+        if composition is None or _quarters_to_dose(*composition) != dose:
+            print(f"⚠️ คำอธิบายขนาดยา {key} mg ไม่ตรงกับจำนวนเม็ด: {description!r}")
+            composition = solve_tablets(dose) or (None, None)
+        _by_dose[dose] = DoseEntry(dose, description.strip(), DOSE_IMAGE_MAP.get(key), *composition)
+        _by_description.setdefault(_compact(description), dose)
+    for key, url in DOSE_IMAGE_MAP.items():
+        dose = parse_dose(key)
+        _by_image_url[url] = dose
+        if dose not in _by_dose:
+            composition = solve_tablets(dose) or (None, None)
+            description = describe_quarters(*composition) if composition[0] is not None else None
+            _by_dose[dose] = DoseEntry(dose, description, url, *composition)
+
+
+_build_index()
+
+
+def get_dose(dose):
+    # ขนาดยาจากตาราง หรือคำนวณชุดเม็ดยาให้ถ้าไม่มีในตาราง (เช่น 7 mg); None ถ้าแบ่งเม็ดไม่ได้
+    dose = parse_dose(dose)
+    if dose is None:
+        return None
+    entry = _by_dose.get(dose)
+    if entry is not None:
+        return entry
+    composition = solve_tablets(dose)
+    if composition is None:
+        return None
+    return DoseEntry(dose, describe_quarters(*composition), None, *composition)
+
+
+def find_by_description(description):
+    compact = _compact(description)
+    dose = _by_description.get(compact)
+    if dose is None:
+        composition = parse_description(description)
+        if composition is None:
+            return None
+        dose = _quarters_to_dose(*composition)
+    return get_dose(dose)
+
+
+def find_by_image_url(url):
+    dose = _by_image_url.get(url)
+    return _by_dose.get(dose) if dose is not None else None
+
+
+# ====== ข้อความจากชีต (ตัวเลข หรือคำอธิบาย) → DoseEntry ======
+def resolve_dose(value):
+    entry = get_dose(value)
+    if entry is None and value is not None:
+        entry = find_by_description(str(value))
+    return entry
+
+
+def dose_image_url(value):
+    entry = resolve_dose(value)
+    return entry.image_url if entry else None
@@ -0,0 +1,201 @@
+import os
+import io
+import re
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort
+
+import http_transport
+from dose_catalog import DOSE_IMAGE_MAP
+from image_store import PREVIEW_SIZE, image_url, send_cached_file
+
+# ====== รูปขนาดยา: โหลดจาก Google Drive ครั้งเดียว แล้ว bot เสิร์ฟเองจาก route ของตัวเอง ======
+# แยกโฟลเดอร์จาก IMAGE_DIR เพราะ cleanup ของ image_store จะลบไฟล์ที่เก่ากว่า IMAGE_MAX_AGE_SECONDS
+DOSE_IMAGE_DIR = os.getenv("DOSE_IMAGE_DIR", "/tmp/warfarin_dose_images")
+# โฟลเดอร์รูปต้นฉบับ (ชื่อไฟล์ตามขนาดยา เช่น 3.png, 0.75.jpg) ถ้ามีจะไม่ต้องโหลดจาก Drive
+DOSE_IMAGE_SOURCE_DIR = os.getenv("DOSE_IMAGE_SOURCE_DIR", "")
+# LINE: originalContentUrl ≤ 10MB, previewImageUrl ≤ 1MB → ย่อด้านยาวเหลือ 1024px / 240px
+DOSE_IMAGE_ORIGINAL_SIZE = int(os.getenv("DOSE_IMAGE_ORIGINAL_SIZE", "1024"))
+DOSE_IMAGE_QUALITY = int(os.getenv("DOSE_IMAGE_QUALITY", "85"))
+DOSE_IMAGE_WORKERS = int(os.getenv("DOSE_IMAGE_WORKERS", "4"))
+DOSE_IMAGE_ROUTE = "dose_image"
+
+_NAME_PATTERN = re.compile(r"^[0-9.]+_[0-9a-f]{16}(_preview)?\.jpg$")
+_SOURCE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+_MANIFEST = "manifest.json"
+
+_lock = threading.Lock()
+_ready = {}   # dose key → (ไฟล์รูปเต็ม, ไฟล์ preview)
+_warmed = threading.Event()
+
+
+def _manifest_path():
+    return os.path.join(DOSE_IMAGE_DIR, _MANIFEST)
+
+
+def _load_manifest():
+    try:
+        with open(_manifest_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    tmp_path = f"{_manifest_path()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, _manifest_path())
+
+
+def _write(path, data):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _local_source(key):
+    if not DOSE_IMAGE_SOURCE_DIR:
+        return None
+    for ext in _SOURCE_EXTENSIONS:
+        path = os.path.join(DOSE_IMAGE_SOURCE_DIR, f"{key}{ext}")
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _read_source(key, source_url):
+    path = _local_source(key)
+    if path:
+        with open(path, "rb") as f:
+            return f.read(), "local"
+    response = http_transport.get(source_url, endpoint="image_download")
+    response.raise_for_status()
+    return response.content, "drive"
+
+
+def _encode(image, size):
+    image = image.copy()
+    image.thumbnail((size, size))
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=DOSE_IMAGE_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+# ====== แปลงรูปต้นฉบับเป็น JPEG 2 ขนาด (รูปเต็ม, preview) ======
+def convert_image(data):
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode in ("RGBA", "LA", "P"):
+        # JPEG ไม่มี alpha → วางบนพื้นขาว
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    else:
+        image = image.convert("RGB")
+    return _encode(image, DOSE_IMAGE_ORIGINAL_SIZE), _encode(image, PREVIEW_SIZE)
+
+
+def _files_exist(item):
+    return all(os.path.isfile(os.path.join(DOSE_IMAGE_DIR, item[name])) for name in ("original", "preview"))
+
+
+def _prepare(key, source_url, cached):
+    if cached and cached.get("source") == source_url and _files_exist(cached):
+        return cached, "cached"
+    data, origin = _read_source(key, source_url)
+    original, preview = convert_image(data)
+    digest = hashlib.sha256(original).hexdigest()[:16]
+    item = {
+        "source": source_url,
+        "original": f"{key}_{digest}.jpg",
+        "preview": f"{key}_{digest}_preview.jpg",
+    }
+    _write(os.path.join(DOSE_IMAGE_DIR, item["original"]), original)
+    _write(os.path.join(DOSE_IMAGE_DIR, item["preview"]), preview)
+    return item, origin
+
+
+# ====== warm-up: เตรียมรูปทุกขนาดยา (ใช้ไฟล์เดิมถ้า URL ต้นทางไม่เปลี่ยน) ======
+def warm_dose_images(images=None):
+    images = DOSE_IMAGE_MAP if images is None else images
+    os.makedirs(DOSE_IMAGE_DIR, exist_ok=True)
+    manifest = _load_manifest()
+    summary = {"ready": 0, "cached": 0, "local": 0, "drive": 0, "failed": 0}
+
+    def _task(key):
+        return key, _prepare(key, images[key], manifest.get(key))
+
+    with ThreadPoolExecutor(max_workers=max(1, DOSE_IMAGE_WORKERS)) as pool:
+        futures = [pool.submit(_task, key) for key in images]
+        for future in futures:
+            try:
+                key, (item, origin) = future.result()
+            except Exception as e:
+                summary["failed"] += 1
+                print("❌ เตรียมรูปขนาดยาไม่สำเร็จ:", e)
+                continue
+            manifest[key] = item
+            summary[origin] += 1
+            with _lock:
+                _ready[key] = (item["original"], item["preview"])
+
+    summary["ready"] = len(_ready)
+    try:
+        _save_manifest(manifest)
+    except OSError as e:
+        print("⚠️ บันทึก manifest รูปขนาดยาไม่ได้:", e)
+    _warmed.set()
+    print(f"💊 รูปขนาดยาพร้อม {summary['ready']} รูป (cached={summary['cached']} local={summary['local']} "
+          f"drive={summary['drive']} failed={summary['failed']})")
+    return summary
+
+
+def start_dose_image_warmup(delay=0):
+    def _run():
+        try:
+            warm_dose_images()
+        except Exception as e:
+            _warmed.set()
+            print("❌ dose image warm-up error:", e)
+
+    timer = threading.Timer(delay, _run)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def wait_for_dose_images(timeout):
+    return _warmed.wait(timeout)
+
+
+# ====== URL ที่ส่งให้ LINE: รูปของ bot เองถ้าพร้อมแล้ว ไม่งั้นใช้ลิงก์ Drive เดิม ======
+def dose_image_urls(entry):
+    if entry is None:
+        return None
+    with _lock:
+        files = _ready.get(entry.key)
+    if files:
+        return image_url(files[0], route=DOSE_IMAGE_ROUTE), image_url(files[1], route=DOSE_IMAGE_ROUTE)
+    if entry.image_url:
+        return entry.image_url, entry.image_url
+    return None
+
+
+def serve_dose_image(filename, request):
+    if not _NAME_PATTERN.match(filename):
+        abort(404)
+    return send_cached_file(os.path.join(DOSE_IMAGE_DIR, filename), filename[:-4], request,
+                            mimetype="image/jpeg")
+
+
+def dose_image_stats():
+    with _lock:
+        ready = len(_ready)
+    return {"ready": ready, "total": len(DOSE_IMAGE_MAP), "warmed": _warmed.is_set()}
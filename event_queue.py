@@ -0,0 +1,128 @@
+import os
+import time
+import zlib
+import queue
+import threading
+
+from linebot.v3 import WebhookHandler
+from linebot.v3.webhooks import MessageEvent
+
+# ====== คิว event จาก webhook + worker pool (ลำดับเดียวกันต่อผู้ใช้) ======
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "8"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "2000"))
+# ถ้าคิวเต็ม รอได้นานเท่าไหร่ก่อนตอบ 503 ให้ LINE ส่งซ้ำภายหลัง
+EVENT_QUEUE_PUT_TIMEOUT = float(os.getenv("EVENT_QUEUE_PUT_TIMEOUT", "2"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# แต่ละผู้ใช้ถูก hash ไปที่ worker ตัวเดิมเสมอ → event ของคนเดียวกันทำตามลำดับ
+# ส่วนผู้ใช้ต่างคนกันกระจายไปหลาย worker ทำงานขนานกันได้
+class ShardedEventQueue:
+    def __init__(self, workers=EVENT_WORKERS, maxsize=EVENT_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        per_shard = max(1, maxsize // self.workers)
+        self._queues = [queue.Queue(maxsize=per_shard) for _ in range(self.workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self.in_flight = 0
+        self.processed = 0
+        self.errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i, q in enumerate(self._queues):
+                thread = threading.Thread(target=self._work, args=(q,), name=f"event-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, key, func, *args):
+        self.submit_many([(key, func, args)])
+
+    # items = [(key, func, args)] เข้าคิวครบทุกตัวหรือไม่เข้าเลย: ถ้าเข้าไปแค่บางตัวแล้วตอบ 503
+    # LINE จะส่งทั้ง body ซ้ำ และ event ที่เข้าคิวไปแล้วจะถูกทำสองครั้ง
+    def submit_many(self, items):
+        by_shard = {}
+        for key, func, args in items:
+            shard = self._queues[zlib.crc32((key or "").encode()) % self.workers]
+            by_shard.setdefault(shard, []).append((func, args))
+        deadline = time.monotonic() + EVENT_QUEUE_PUT_TIMEOUT
+        while True:
+            # เพิ่มของเข้าคิวเฉพาะใต้ lock นี้ → ที่ว่างที่ตรวจแล้วไม่มีใครแย่ง (worker มีแต่หยิบออก)
+            with self._submit_lock:
+                if all(shard.maxsize - shard.qsize() >= len(entries) for shard, entries in by_shard.items()):
+                    for shard, entries in by_shard.items():
+                        for entry in entries:
+                            shard.put_nowait(entry)
+                    return
+            if time.monotonic() >= deadline:
+                raise QueueFullError("event queue is full")
+            time.sleep(0.01)
+
+    def _work(self, q):
+        while True:
+            func, args = q.get()
+            with self._lock:
+                self.in_flight += 1
+            try:
+                func(*args)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print("❌ Error handling event:", e)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                    self.processed += 1
+                q.task_done()
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "capacity": sum(q.maxsize for q in self._queues),
+            "shard_depths": [q.qsize() for q in self._queues],
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "errors": self.errors,
+            "workers": self.workers,
+        }
+
+
+def event_user_key(event):
+    source = getattr(event, "source", None)
+    for attr in ("user_id", "group_id", "room_id"):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return ""
+
+
+# ====== WebhookHandler ที่ตรวจ signature แล้วโยน event เข้าคิว แทนการทำทันที ======
+class QueuedWebhookHandler(WebhookHandler):
+    def __init__(self, channel_secret, event_queue):
+        super().__init__(channel_secret)
+        self.event_queue = event_queue
+
+    def handle(self, body, signature):
+        payload = self.parser.parse(body, signature, as_payload=True)
+        self.event_queue.submit_many([(event_user_key(event), self.dispatch, (event, payload.destination))
+                                      for event in payload.events])
+
+    def dispatch(self, event, destination=None):
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self._handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+        if func is None:
+            func = self._handlers.get(event.__class__.__name__)
+        if func is None:
+            func = self._default
+        if func is not None:
+            func(event)
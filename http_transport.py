@@ -0,0 +1,163 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_SECONDS
+
+# ====== HTTP transport กลาง (ใช้ร่วมกันทุกโมดูล: Apps Script / LINE / Drive) ======
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "10"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# timeout (connect, read) และจำนวนครั้งที่ retry ได้ แยกตาม endpoint
+ENDPOINTS = {
+    "apps_script_read": {"timeout": (3.05, 10), "retries": 2},
+    "apps_script_write": {"timeout": (3.05, 15), "retries": 2},
+    "line_push": {"timeout": (3.05, 10), "retries": 2},
+    "line_multicast": {"timeout": (3.05, 15), "retries": 2},
+    "image_download": {"timeout": (3.05, 20), "retries": 2},
+}
+DEFAULT_ENDPOINT = {"timeout": (3.05, 10), "retries": 1}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+# ====== circuit breaker ต่อ host ======
+class CircuitBreaker:
+    def __init__(self, host, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.host = host
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                # ปล่อยให้ลองได้ 1 request ก่อนจะปิดวงจรกลับ
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        # request ล้มด้วยเหตุที่ไม่เกี่ยวกับ host (เช่น bug ฝั่งเรา) → ให้ request ถัดไปเป็น probe แทน
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.max_failures or self.opened_at is not None:
+                if self.opened_at is None:
+                    print(f"⚡ circuit open: {self.host}")
+                self.opened_at = time.monotonic()
+
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def breaker_states():
+    with _breakers_lock:
+        return {host: breaker.state for host, breaker in _breakers.items()}
+
+
+def _backoff(attempt):
+    # full jitter: 0.2s, 0.4s, 0.8s, ... สุ่มในช่วงนั้น
+    return random.uniform(0, 0.2 * (2 ** attempt))
+
+
+def request(method, url, endpoint=None, idempotent=None, **kwargs):
+    config = ENDPOINTS.get(endpoint, DEFAULT_ENDPOINT)
+    kwargs.setdefault("timeout", config["timeout"])
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD", "OPTIONS")
+    attempts = 1 + (config["retries"] if idempotent else 0)
+    breaker = get_breaker(url)
+    upstream = endpoint or breaker.host
+
+    for attempt in range(attempts):
+        if not breaker.allow():
+            UPSTREAM_SECONDS.observe(0.0, upstream=upstream, operation=method, outcome="circuit_open")
+            raise CircuitOpenError(f"circuit open for {breaker.host}")
+        started = time.perf_counter()
+        try:
+            response = _session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream=upstream, operation=method,
+                                     outcome=type(e).__name__)
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                raise
+        except requests.exceptions.RequestException as e:
+            # TooManyRedirects / InvalidURL / ChunkedEncodingError ฯลฯ: ไม่ retry แต่ต้องบันทึกผล
+            # ไม่งั้น request ที่เป็น probe ตอน half-open จะค้าง _probing ไว้และวงจรเปิดตลอดไป
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream=upstream, operation=method,
+                                     outcome=type(e).__name__)
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+        else:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream=upstream, operation=method,
+                                     outcome=f"{response.status_code // 100}xx")
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                return response
+        time.sleep(_backoff(attempt))
+
+
+def get(url, endpoint=None, **kwargs):
+    return request("GET", url, endpoint=endpoint, **kwargs)
+
+
+def post(url, endpoint=None, **kwargs):
+    return request("POST", url, endpoint=endpoint, **kwargs)
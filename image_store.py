@@ -0,0 +1,145 @@
+import os
+import io
+import re
+import glob
+import time
+import hashlib
+import threading
+
+from flask import send_file, abort
+
+# ====== ที่เก็บรูป (ตั้งชื่อไฟล์ตาม hash ของเนื้อรูป) ======
+IMAGE_DIR = os.getenv("IMAGE_DIR", "/tmp/warfarin_images")
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "https://warfarin.onrender.com").rstrip("/")
+IMAGE_MAX_AGE_SECONDS = int(os.getenv("IMAGE_MAX_AGE_SECONDS", str(7 * 86400)))
+IMAGE_DIR_MAX_BYTES = int(os.getenv("IMAGE_DIR_MAX_BYTES", str(200 * 1024 * 1024)))
+IMAGE_CLEANUP_INTERVAL = int(os.getenv("IMAGE_CLEANUP_INTERVAL", "600"))
+# LINE แนะนำรูป preview ไม่เกิน 240px
+PREVIEW_SIZE = int(os.getenv("IMAGE_PREVIEW_SIZE", "240"))
+
+# ชื่อไฟล์เปลี่ยนตามเนื้อรูป → cache ได้ตลอดไป
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}(_preview)?\.png$")
+_cleanup_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+def _write_once(path, data):
+    if os.path.exists(path):
+        # แตะเวลาไฟล์ให้ใหม่ จะได้ไม่ถูกลบตอน cleanup
+        os.utime(path, None)
+        return
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def make_preview(png):
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(png))
+    image.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+# ====== บันทึกรูป คืนชื่อไฟล์ (รูปเต็ม, รูป preview) ======
+# preview ส่งมาได้ถ้าสร้างไว้แล้ว (เช่น worker process ของรายงานประจำสัปดาห์)
+def store_image(png, preview_png=None):
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    digest = hashlib.sha256(png).hexdigest()
+    original = f"{digest}.png"
+    preview = f"{digest}_preview.png"
+    _write_once(os.path.join(IMAGE_DIR, original), png)
+    preview_path = os.path.join(IMAGE_DIR, preview)
+    if os.path.exists(preview_path):
+        os.utime(preview_path, None)
+    else:
+        _write_once(preview_path, preview_png or make_preview(png))
+    maybe_cleanup()
+    return original, preview
+
+
+def image_url(filename, route="image"):
+    return f"{PUBLIC_BASE_URL}/{route}/{filename}"
+
+
+def store_image_urls(png, preview_png=None):
+    original, preview = store_image(png, preview_png)
+    return image_url(original), image_url(preview)
+
+
+# ====== ส่งรูปพร้อม ETag / Cache-Control และตอบ 304 ถ้า client มีรูปอยู่แล้ว ======
+def send_cached_file(path, etag, request, mimetype="image/png"):
+    if not os.path.isfile(path):
+        abort(404)
+    response = send_file(path, mimetype=mimetype, etag=False, conditional=False)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response.make_conditional(request)
+
+
+def serve_stored_image(filename, request):
+    if not _NAME_PATTERN.match(filename):
+        abort(404)
+    return send_cached_file(os.path.join(IMAGE_DIR, filename), filename[:-4], request)
+
+
+# ====== ลบรูปเก่าเพื่อไม่ให้ดิสก์เต็ม ======
+def cleanup(now=None):
+    now = now or time.time()
+    removed = 0
+    # ไฟล์กราฟแบบเก่า (ชื่อตาม user) ที่ค้างอยู่ใน /tmp
+    for path in glob.glob("/tmp/inr_chart_*.png"):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+
+    if not os.path.isdir(IMAGE_DIR):
+        return removed
+    files = []
+    for name in os.listdir(IMAGE_DIR):
+        path = os.path.join(IMAGE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if now - stat.st_mtime > IMAGE_MAX_AGE_SECONDS:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        else:
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= IMAGE_DIR_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+            total -= size
+        except OSError:
+            pass
+    return removed
+
+
+def maybe_cleanup():
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup < IMAGE_CLEANUP_INTERVAL or not _cleanup_lock.acquire(blocking=False):
+        return
+    try:
+        _last_cleanup = now
+        removed = cleanup(now)
+        if removed:
+            print(f"🧹 ลบรูปเก่า {removed} ไฟล์")
+    finally:
+        _cleanup_lock.release()
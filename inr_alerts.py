@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+
+from metrics import ALERT_EVENTS
+
+# ====== แจ้งเตือนทีมแพทย์เมื่อค่า INR ผิดปกติ / มีเลือดออก (ทำเบื้องหลัง ไม่หน่วงการตอบผู้ป่วย) ======
+# ทุกค่าที่บันทึกใหม่ถูกตรวจกับ state ล่าสุดของผู้ป่วยคนนั้นเท่านั้น (ไม่อ่านประวัติย้อนหลัง)
+CLINICIAN_GROUP_ID = os.getenv("CLINICIAN_GROUP_ID", "")
+ALERT_DB = os.getenv("ALERT_DB", "/tmp/warfarin_alerts.db")
+# เกณฑ์ตั้งต้น (ปรับรายคนได้ด้วย set_thresholds)
+ALERT_INR_HIGH = float(os.getenv("ALERT_INR_HIGH", "6.0"))
+ALERT_INR_LOW = float(os.getenv("ALERT_INR_LOW", "1.5"))
+# เปลี่ยนจากค่าก่อนหน้าเกินเท่านี้ภายใน ALERT_TREND_DAYS วัน ถือว่าผิดปกติ
+ALERT_INR_JUMP = float(os.getenv("ALERT_INR_JUMP", "1.5"))
+ALERT_TREND_DAYS = float(os.getenv("ALERT_TREND_DAYS", "14"))
+# ขึ้นติดกันกี่ครั้ง (และเกินช่วงเป้าหมาย) จึงแจ้งว่ามีแนวโน้มสูงขึ้น
+ALERT_RISING_STREAK = int(os.getenv("ALERT_RISING_STREAK", "3"))
+ALERT_TARGET_HIGH = float(os.getenv("ALERT_TARGET_HIGH", "3.5"))
+# แจ้งเรื่องเดิมของผู้ป่วยคนเดิมซ้ำไม่เกิน 1 ครั้งในช่วงนี้
+ALERT_DEDUPE_SECONDS = float(os.getenv("ALERT_DEDUPE_SECONDS", "21600"))
+# ส่งเข้ากลุ่มไม่สำเร็จ → เก็บไว้ใน alert_queue แล้วลองใหม่แบบ backoff จนกว่าจะส่งได้ (ไม่ทิ้ง alert)
+ALERT_MAX_BACKOFF = float(os.getenv("ALERT_MAX_BACKOFF", "300"))
+ALERT_POLL_SECONDS = float(os.getenv("ALERT_POLL_SECONDS", "5"))
+ALERT_BATCH_SIZE = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_state (
+    user_id TEXT PRIMARY KEY,
+    last_inr REAL,
+    last_at REAL,
+    rising_streak INTEGER NOT NULL DEFAULT 0,
+    readings INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS alert_thresholds (
+    user_id TEXT PRIMARY KEY,
+    low REAL,
+    high REAL
+);
+CREATE TABLE IF NOT EXISTS alert_sent (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    PRIMARY KEY (user_id, kind)
+);
+-- event ที่ยังไม่ได้ตรวจ (text เป็น NULL) และ alert ที่ตรวจแล้วแต่ยังส่งไม่สำเร็จ เรียงตาม id
+CREATE TABLE IF NOT EXISTS alert_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT NOT NULL,
+    kinds TEXT,
+    text TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+"""
+
+ALERT_TEXT = {
+    "inr_high": "🚨 INR สูงเกินเกณฑ์ ({inr} ≥ {high})",
+    "inr_low": "⚠️ INR ต่ำกว่าเกณฑ์ ({inr} ≤ {low})",
+    "inr_jump": "⚠️ INR เปลี่ยนเร็ว {previous} → {inr} ภายใน {days} วัน",
+    "inr_rising": "📈 INR สูงขึ้นติดกัน {streak} ครั้ง (ล่าสุด {inr})",
+    "bleeding": "🩸 ผู้ป่วยแจ้งว่ามีภาวะเลือดออก",
+}
+
+
+def evaluate(state, event, thresholds):
+    # state = (last_inr, last_at, rising_streak, readings) หรือ None; คืน (รายการ alert, state ใหม่)
+    alerts = []
+    if event.get("bleeding") == "yes":
+        alerts.append(("bleeding", {}))
+    inr = event.get("inr")
+    if inr is None:
+        return alerts, state
+
+    low, high = thresholds
+    last_inr, last_at, streak, readings = state or (None, None, 0, 0)
+    at = event["at"]
+    if inr >= high:
+        alerts.append(("inr_high", {"high": high}))
+    elif inr <= low:
+        alerts.append(("inr_low", {"low": low}))
+    if last_inr is not None:
+        days = (at - last_at) / 86400
+        if abs(inr - last_inr) >= ALERT_INR_JUMP and days <= ALERT_TREND_DAYS:
+            alerts.append(("inr_jump", {"previous": last_inr, "days": max(0, round(days))}))
+        streak = streak + 1 if inr > last_inr else 0
+        if streak >= ALERT_RISING_STREAK and inr > ALERT_TARGET_HIGH:
+            alerts.append(("inr_rising", {"streak": streak}))
+    return alerts, (inr, at, streak, readings + 1)
+
+
+def format_alert(alerts, event):
+    # หลายเรื่องของค่าเดียวกันรวมเป็นข้อความเดียว
+    lines = [ALERT_TEXT[kind].format(inr=event.get("inr"), **details) for kind, details in alerts]
+    lines.append(f"👤 {event.get('name') or '-'} ({event['user_id']})")
+    lines.append(f"🕒 {time.strftime('%d/%m/%Y %H:%M', time.localtime(event['at']))}")
+    return "\n".join(lines)
+
+
+def _backoff(attempts):
+    delay = min(ALERT_MAX_BACKOFF, 2 ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class AlertPipeline:
+    # send(group_id, text) ส่งข้อความเข้ากลุ่ม LINE ของแพทย์
+    def __init__(self, send, group_id=CLINICIAN_GROUP_ID, path=ALERT_DB, dedupe_seconds=ALERT_DEDUPE_SECONDS):
+        self.send = send
+        self.group_id = group_id
+        self.path = path
+        self.dedupe_seconds = dedupe_seconds
+        self._wake = threading.Event()
+        self._worker = None
+        self._conn = None
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        if not self._initialized:
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _db(self):
+        # ใช้จาก worker thread เดียว
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    # ====== ฝั่ง webhook: บันทึก event ลง alert_queue (commit ก่อนคืนค่า) แล้วปลุก worker ======
+    def _enqueue(self, event):
+        conn = self._connect()
+        try:
+            conn.execute("INSERT INTO alert_queue (event, next_attempt_at) VALUES (?, ?)",
+                         (json.dumps(event, ensure_ascii=False), time.time()))
+        finally:
+            conn.close()
+        self._wake.set()
+
+    def submit(self, user_id, inr=None, bleeding=None, name=None):
+        self._enqueue({"user_id": user_id, "inr": None if inr is None else float(inr),
+                       "bleeding": bleeding, "name": name, "at": time.time()})
+
+    # ====== ฝั่ง worker ======
+    def thresholds(self, user_id):
+        row = self._db().execute("SELECT low, high FROM alert_thresholds WHERE user_id = ?", (user_id,)).fetchone()
+        low, high = row or (None, None)
+        return (ALERT_INR_LOW if low is None else low), (ALERT_INR_HIGH if high is None else high)
+
+    def set_thresholds(self, user_id, low=None, high=None):
+        self._enqueue({"user_id": user_id, "thresholds": [low, high]})
+
+    def evaluate(self, queue_id, event):
+        # ตรวจ event กับ state ครั้งเดียว (transaction เดียวกับการอัปเดต state) คืน (kinds, ข้อความ) หรือ None
+        conn = self._db()
+        user_id = event["user_id"]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if "thresholds" in event:
+                conn.execute("INSERT OR REPLACE INTO alert_thresholds (user_id, low, high) VALUES (?, ?, ?)",
+                             (user_id, *event["thresholds"]))
+                fresh = []
+            else:
+                state = conn.execute(
+                    "SELECT last_inr, last_at, rising_streak, readings FROM alert_state WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                alerts, new_state = evaluate(state, event, self.thresholds(user_id))
+                if new_state is not state:
+                    conn.execute("INSERT OR REPLACE INTO alert_state (user_id, last_inr, last_at, rising_streak, "
+                                 "readings) VALUES (?, ?, ?, ?, ?)", (user_id, *new_state))
+                fresh = []
+                for kind, details in alerts:
+                    row = conn.execute("SELECT sent_at FROM alert_sent WHERE user_id = ? AND kind = ?",
+                                       (user_id, kind)).fetchone()
+                    if row and event["at"] - row[0] < self.dedupe_seconds:
+                        ALERT_EVENTS.inc(kind=kind, outcome="deduplicated")
+                    else:
+                        fresh.append((kind, details))
+            if not fresh:
+                conn.execute("DELETE FROM alert_queue WHERE id = ?", (queue_id,))
+                conn.execute("COMMIT")
+                return None
+            # นับเป็นแจ้งแล้วตั้งแต่ตอนนี้ (alert_queue รับประกันว่าจะส่งถึง) → ค่าถัดไประหว่างรอส่งไม่แจ้งซ้ำ
+            kinds = [kind for kind, _ in fresh]
+            text = format_alert(fresh, event)
+            conn.executemany("INSERT OR REPLACE INTO alert_sent (user_id, kind, sent_at) VALUES (?, ?, ?)",
+                             [(user_id, kind, event["at"]) for kind in kinds])
+            conn.execute("UPDATE alert_queue SET kinds = ?, text = ? WHERE id = ?", (",".join(kinds), text, queue_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return kinds, text
+
+    def deliver(self, queue_id, user_id, kinds, text, attempts):
+        conn = self._db()
+        if self.group_id:
+            try:
+                self.send(self.group_id, text)
+            except Exception as e:
+                attempts += 1
+                conn.execute("UPDATE alert_queue SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                             (attempts, time.time() + _backoff(attempts), str(e), queue_id))
+                for kind in kinds:
+                    ALERT_EVENTS.inc(kind=kind, outcome="failed")
+                print(f"❌ ส่ง alert {kinds} ของ {user_id} ไม่สำเร็จ (ครั้งที่ {attempts}) จะลองใหม่:", e)
+                return False
+        print(f"🚨 alert {', '.join(kinds)}: {user_id}")
+        conn.execute("DELETE FROM alert_queue WHERE id = ?", (queue_id,))
+        for kind in kinds:
+            ALERT_EVENTS.inc(kind=kind, outcome="sent" if self.group_id else "logged")
+        return True
+
+    def process_due(self, limit=ALERT_BATCH_SIZE):
+        # ทำ event/alert ที่ถึงเวลาตามลำดับ id; คืนจำนวนแถวที่หยิบมา
+        rows = self._db().execute(
+            "SELECT id, event, kinds, text, attempts FROM alert_queue WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (time.time(), limit)
+        ).fetchall()
+        for queue_id, raw, kinds, text, attempts in rows:
+            event = json.loads(raw)
+            if text is None:
+                evaluated = self.evaluate(queue_id, event)
+                if evaluated is None:
+                    continue
+                kinds, text = evaluated
+            else:
+                kinds = kinds.split(",")
+            self.deliver(queue_id, event["user_id"], kinds, text, attempts)
+        return len(rows)
+
+    def _loop(self):
+        while True:
+            # alert ที่ค้างจากรอบก่อน (หรือก่อน restart) ถูกหยิบขึ้นมาเมื่อถึงเวลาลองใหม่
+            self._wake.wait(ALERT_POLL_SECONDS)
+            self._wake.clear()
+            try:
+                while self.process_due() >= ALERT_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print("❌ alert pipeline error:", e)
+
+    def start(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._loop, name="inr-alerts", daemon=True)
+            self._worker.start()
+            self._wake.set()
+        return self._worker
+
+    def pending(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM alert_queue").fetchone()[0]
+        finally:
+            conn.close()
@@ -1,41 +1,250 @@
-import matplotlib.pyplot as plt
 import io
-from PIL import Image
-import base64
+import os
+import threading
 
-def generate_inr_chart(dates, inr_values):
-    fig, ax = plt.subplots(figsize=(8, 4))
+# ฟอนต์ภาษาไทยที่มาจาก fonts-thai-tlwg / fonts-sarabun (เรียงตามลำดับที่อยากใช้)
+THAI_FONT_CANDIDATES = ["TH Sarabun New", "Sarabun", "Garuda", "Loma", "Waree", "Kinnari", "Norasi", "Tlwg Typo"]
 
-    # ตัดค่าที่เกิน 5.5 แต่ให้วาดจุดไว้เหนือ 5.5
-    clipped_values = [min(v, 5.5) for v in inr_values]
+_pyplot = None
+_thai_font = None
+_pyplot_lock = threading.Lock()
 
-    # วาดกราฟเส้น
-    ax.plot(dates, clipped_values, marker="o", color="#007bff", label="INR")
+# import matplotlib ตอนวาดกราฟครั้งแรก (หรือตอน warm-up) แทนตอนเปิด app
+def get_pyplot():
+    global _pyplot, _thai_font
+    if _pyplot is None:
+        with _pyplot_lock:
+            if _pyplot is None:
+                import matplotlib
+                matplotlib.use("Agg")
+                import matplotlib.pyplot as plt
+                from matplotlib import font_manager
 
-    # เติม label ที่จุด
-    for i, (x, y, raw_y) in enumerate(zip(dates, clipped_values, inr_values)):
-        ax.text(x, y + 0.15, f"{raw_y:.1f}", ha="center", fontsize=10, color="black")
-        # ถ้า INR >= 6 ให้ใช้จุดแดง
-        if raw_y >= 6:
-            ax.plot(x, y, marker="o", color="red", markersize=10)
+                installed = {font.name for font in font_manager.fontManager.ttflist}
+                _thai_font = next((name for name in THAI_FONT_CANDIDATES if name in installed), None)
+                if _thai_font:
+                    plt.rcParams["font.family"] = [_thai_font, "DejaVu Sans"]
+                _pyplot = plt
+    return _pyplot
 
-    # พื้นหลังสีเขียวระหว่าง INR 2.0–3.5
-    ax.axhspan(2.0, 3.5, facecolor='green', alpha=0.1)
+def has_thai_font():
+    get_pyplot()
+    return _thai_font is not None
 
-    # ตั้ง y scale เริ่มที่ 0.5 ถึง 5.5
-    ax.set_ylim(0.5, 6.2)
-    ax.set_yticks([i * 0.5 for i in range(1, 12)])
-    ax.set_ylabel("ค่า INR")
-    ax.set_xticks(range(len(dates)))
-    ax.set_xticklabels(dates, rotation=45)
-    ax.set_title("กราฟ INR")
+# ====== วาดกราฟซ้ำหลายรูปด้วย figure เดียว (ไม่ใช้ pyplot จึงไม่แตะ global state) ======
+# ใช้ใน worker process ของรายงานประจำสัปดาห์: สร้าง figure ครั้งเดียวแล้ว clear/วาดใหม่ทุกคน
+# ใช้ผ่าน generate_inr_chart ใน app.py; dates/inr_values เรียงจากเก่า → ใหม่
+class ChartRenderer:
+    def __init__(self):
+        get_pyplot()  # ตั้งค่าฟอนต์ไทยใน rcParams
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-    plt.tight_layout()
+        self.figure = Figure(figsize=(8, 4))
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
 
-    # แปลงเป็น buffer image
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    plt.close(fig)
-    buf.seek(0)
+    def draw(self, dates, inr_values):
+        ax = self.ax
+        ax.clear()
+        clipped_values = [min(v, 5.5) for v in inr_values]
+        ax.plot(dates, clipped_values, marker="o", color="#007bff", label="INR")
+        for x, y, raw_y in zip(dates, clipped_values, inr_values):
+            ax.text(x, y + 0.15, f"{raw_y:.1f}", ha="center", fontsize=10, color="black")
+            if raw_y >= 6:
+                ax.plot(x, y, marker="o", color="red", markersize=10)
+        ax.axhspan(2.0, 3.5, facecolor='green', alpha=0.1)
+        ax.set_ylim(0.5, 6.2)
+        ax.set_yticks([i * 0.5 for i in range(1, 12)])
+        ax.set_ylabel("INR")
+        ax.set_xticks(range(len(dates)))
+        ax.set_xticklabels(dates, rotation=45)
+        ax.set_title("INR chart")
+        self.figure.tight_layout()
+        return self.figure
 
-    return buf
\ No newline at end of file
+    def encode(self, figure):
+        buf = io.BytesIO()
+        figure.savefig(buf, format="png")
+        return buf.getvalue()
+
+    def render(self, dates, inr_values):
+        return self.encode(self.draw(dates, inr_values))
+
+# ====== วาดกราฟเดียวกันด้วย Pillow โดยตรง (ไม่ต้อง import matplotlib, รูปละไม่กี่ ms) ======
+# เลือกด้วย CHART_RENDERER=pil; ได้ PNG แบบ palette ขนาดเล็กกว่ามาก
+CHART_RENDERER = os.getenv("CHART_RENDERER", "matplotlib").lower()
+# ระบุไฟล์ฟอนต์เองได้ ไม่งั้นหาไฟล์จาก fonts-thai-tlwg / fonts-sarabun ตามลำดับนี้
+CHART_FONT_PATH = os.getenv("CHART_FONT_PATH", "")
+THAI_FONT_FILES = ["THSarabunNew.ttf", "Sarabun-Regular.ttf", "Garuda.ttf", "Garuda.otf", "Loma.ttf", "Loma.otf",
+                   "Waree.ttf", "Waree.otf", "Kinnari.ttf", "Kinnari.otf", "Norasi.ttf", "Norasi.otf",
+                   "TlwgTypo.ttf", "TlwgTypo.otf", "DejaVuSans.ttf"]
+FONT_DIRS = ["/usr/share/fonts", "/usr/local/share/fonts", os.path.expanduser("~/.fonts")]
+
+_font_path = None
+
+
+def find_font_file():
+    global _font_path
+    if _font_path is None:
+        found = {}
+        for font_dir in FONT_DIRS:
+            for dirpath, _, filenames in os.walk(font_dir):
+                for filename in filenames:
+                    found.setdefault(filename, os.path.join(dirpath, filename))
+        _font_path = CHART_FONT_PATH or next((found[name] for name in THAI_FONT_FILES if name in found), "")
+    return _font_path or None
+
+
+class PilChartRenderer:
+    # ขนาด/ตำแหน่งเทียบเท่า figsize=(8, 4) dpi 100 ของ matplotlib; วาดที่ SCALE เท่าแล้วย่อ (ขอบเส้นเรียบ)
+    WIDTH, HEIGHT, SCALE = 800, 400, 2
+    LEFT, RIGHT, TOP, BOTTOM = 62, 785, 36, 307
+    Y_MIN, Y_MAX = 0.5, 6.2
+    WHITE, BLACK, BLUE, RED, BAND = (255, 255, 255), (0, 0, 0), (0, 123, 255), (255, 0, 0), (230, 242, 230)
+    TEXT_CACHE_ITEMS = 2048
+
+    def __init__(self, font_path=None):
+        from PIL import ImageFont
+
+        path = font_path or find_font_file()
+        s = self.SCALE
+        if path:
+            # 10pt / 12pt ที่ dpi 100; label ของแต่ละรูปวาดหลังย่อแล้ว จึงใช้ฟอนต์ขนาดจริง
+            self.font = ImageFont.truetype(path, 14 * s)
+            self.title_font = ImageFont.truetype(path, 17 * s)
+            self.label_font = ImageFont.truetype(path, 14)
+        else:
+            self.font = self.title_font = self.label_font = ImageFont.load_default()
+        self.font_path = path
+        self._text_masks = {}
+        self._palette = self._make_palette()
+        self._base = self._draw_base()
+
+    def _make_palette(self):
+        # สีที่เกิดได้ทั้งหมดหลังย่อรูป = ไล่ระดับระหว่างพื้นหลังกับสีเส้น/ตัวอักษร → palette คงที่ ไม่ต้องหาสีใหม่ทุกรูป
+        from PIL import Image
+
+        colors = []
+        for start, end, steps in [(self.WHITE, self.BLACK, 16), (self.WHITE, self.BLUE, 12), (self.BAND, self.BLUE, 8),
+                                  (self.BAND, self.BLACK, 8), (self.WHITE, self.RED, 8), (self.BLUE, self.RED, 6),
+                                  (self.BAND, self.RED, 6)]:
+            for i in range(steps):
+                color = tuple(round(a + (b - a) * i / (steps - 1)) for a, b in zip(start, end))
+                if color not in colors:
+                    colors.append(color)
+        palette = Image.new("P", (1, 1))
+        palette.putpalette([value for color in colors for value in color])
+        return palette
+
+    def _x(self, index, count):
+        # แกน x แบบ category ของ matplotlib: 0..n-1 เผื่อขอบ 5%
+        pad = 0.05 * (count - 1) if count > 1 else 0.5
+        low, high = -pad, count - 1 + pad
+        return (self.LEFT + (index - low) / (high - low) * (self.RIGHT - self.LEFT)) * self.SCALE
+
+    def _y(self, value):
+        return (self.BOTTOM - (value - self.Y_MIN) / (self.Y_MAX - self.Y_MIN) * (self.BOTTOM - self.TOP)) * self.SCALE
+
+    def _text_mask(self, text, angle=0, font=None):
+        # ข้อความเดิม (วันที่ / ค่า INR) ซ้ำกันมากระหว่างผู้ป่วย → เก็บ mask ที่วาด+หมุนแล้วไว้ใช้ซ้ำ
+        font = font or self.font
+        key = (text, angle, id(font))
+        mask = self._text_masks.get(key)
+        if mask is None:
+            from PIL import Image, ImageDraw
+
+            left, upper, right, lower = font.getbbox(text)
+            mask = Image.new("L", (right - left + 2, lower - upper + 2), 0)
+            ImageDraw.Draw(mask).text((1 - left, 1 - upper), text, fill=255, font=font)
+            if angle:
+                mask = mask.rotate(angle, expand=True, resample=Image.BILINEAR)
+            if len(self._text_masks) >= self.TEXT_CACHE_ITEMS:
+                self._text_masks.clear()
+            self._text_masks[key] = mask
+        return mask
+
+    def _paste_text(self, image, text, x, y, anchor, color, angle=0, font=None):
+        # anchor: ตำแหน่ง (x, y) เทียบกับกรอบข้อความ — "mt" กลาง-บน, "mb" กลาง-ล่าง, "mm" กลาง, "rm" ขวา-กลาง
+        mask = self._text_mask(text, angle, font)
+        left = x - mask.width if anchor[0] == "r" else x - mask.width / 2
+        top = {"t": y, "b": y - mask.height, "m": y - mask.height / 2}[anchor[1]]
+        image.paste(color, (int(left), int(top)), mask)
+
+    def _draw_base(self):
+        # ส่วนที่เหมือนกันทุกรูป: แถบเป้าหมาย กรอบ แกน y ชื่อกราฟ
+        from PIL import Image, ImageDraw
+
+        s = self.SCALE
+        image = Image.new("RGB", (self.WIDTH * s, self.HEIGHT * s), self.WHITE)
+        draw = ImageDraw.Draw(image)
+        left, right = self.LEFT * s, self.RIGHT * s
+        # พื้นหลังสีเขียวระหว่าง INR 2.0–3.5
+        draw.rectangle((left, self._y(3.5), right, self._y(2.0)), fill=self.BAND)
+        draw.rectangle((left, self.TOP * s, right, self.BOTTOM * s), outline=self.BLACK, width=s)
+        for tick in range(1, 12):
+            y = self._y(tick * 0.5)
+            draw.line((left - 4 * s, y, left, y), fill=self.BLACK, width=s)
+            self._paste_text(image, f"{tick * 0.5:.1f}", left - 6 * s, y, "rm", self.BLACK)
+        self._paste_text(image, "INR chart", (left + right) / 2, (self.TOP - 8) * s, "mb", self.BLACK,
+                         font=self.title_font)
+        self._paste_text(image, "INR", 14 * s, (self.TOP + self.BOTTOM) / 2 * s, "mm", self.BLACK, angle=90)
+        return image
+
+    def draw(self, dates, inr_values):
+        # dates/inr_values เรียงจากเก่า → ใหม่; คืนรูป RGB ขนาดจริง
+        from PIL import ImageDraw
+
+        s = self.SCALE
+        image = self._base.copy()
+        draw = ImageDraw.Draw(image)
+        count = len(dates)
+        xs = [self._x(i, count) for i in range(count)]
+        for x in xs:
+            draw.line((x, self.BOTTOM * s, x, (self.BOTTOM + 4) * s), fill=self.BLACK, width=s)
+
+        # ตัดค่าที่เกิน 5.5 แต่ให้วาดจุดไว้เหนือ 5.5
+        points = [(x, self._y(min(v, 5.5))) for x, v in zip(xs, inr_values)]
+        if len(points) > 1:
+            draw.line(points, fill=self.BLUE, width=2 * s, joint="curve")
+        for (x, y), raw_y in zip(points, inr_values):
+            # ถ้า INR >= 6 ให้ใช้จุดแดง
+            radius = 7 * s if raw_y >= 6 else 4 * s
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=self.RED if raw_y >= 6 else self.BLUE)
+        image = image.reduce(s)
+
+        # label อยู่บนเส้นกราฟ (เหมือน matplotlib)
+        label_offset = 0.15 / (self.Y_MAX - self.Y_MIN) * (self.BOTTOM - self.TOP)
+        for (x, y), raw_y, label in zip(points, inr_values, dates):
+            self._paste_text(image, f"{raw_y:.1f}", x / s, y / s - label_offset, "mb", self.BLACK, font=self.label_font)
+            self._paste_text(image, str(label), x / s, self.BOTTOM + 6, "mt", self.BLACK, angle=45,
+                             font=self.label_font)
+        return image
+
+    def encode(self, image):
+        from PIL import Image
+
+        buf = io.BytesIO()
+        image.quantize(palette=self._palette, dither=Image.Dither.NONE).save(buf, "PNG")
+        return buf.getvalue()
+
+    def render(self, dates, inr_values):
+        return self.encode(self.draw(dates, inr_values))
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+# renderer ตาม CHART_RENDERER (สร้างครั้งเดียว); ใช้ทีละ thread (เรียกภายใต้ chart_cache.render_lock)
+def get_chart_renderer():
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = create_renderer()
+    return _renderer
+
+
+def create_renderer(kind=None):
+    return PilChartRenderer() if (kind or CHART_RENDERER) == "pil" else ChartRenderer()
@@ -0,0 +1,97 @@
+import io
+import os
+import csv
+import json
+import zlib
+from datetime import datetime
+
+from inr_repository import SCHEDULE_DAYS, parse_reading_date
+
+# ====== export ข้อมูลผู้ป่วยแบบ stream (CSV / NDJSON, gzip ระหว่างส่งได้) ======
+# อ่านจาก SQLite ทีละแถวผ่าน generator → ใช้ memory คงที่ไม่ว่าจะมีผู้ป่วยกี่คน
+EXPORT_FLUSH_ROWS = int(os.getenv("EXPORT_FLUSH_ROWS", "500"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+_DAY_COLUMNS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def _readings(repository, user_ids, start, end):
+    for row in repository.iter_readings(user_ids, start, end):
+        yield row[:10] + (bool(row[10]),)
+
+
+def _patients(repository, user_ids, start, end):
+    for user_id, first_name, last_name, birthdate, updated_at in repository.iter_patients(user_ids):
+        yield user_id, first_name, last_name, birthdate, datetime.fromtimestamp(updated_at).isoformat(timespec="seconds")
+
+
+def _schedules(repository, user_ids, start, end):
+    for user_id, recorded_at, warfarin_dose, data, source, synced in repository.iter_schedules(user_ids, start, end):
+        data = json.loads(data)
+        yield (user_id, datetime.fromtimestamp(recorded_at).isoformat(timespec="seconds"), warfarin_dose,
+               *(data.get(day, "") for day in SCHEDULE_DAYS), source, bool(synced))
+
+
+# kind → (คอลัมน์, generator ของ tuple ตามคอลัมน์)
+KINDS = {
+    "readings": (["user_id", "first_name", "last_name", "birthdate", "date", "taken_at", "inr",
+                  "bleeding", "supplement", "source", "synced"], _readings),
+    "patients": (["user_id", "first_name", "last_name", "birthdate", "updated_at"], _patients),
+    "schedules": (["user_id", "recorded_at", "warfarin_dose", *_DAY_COLUMNS, "source", "synced"], _schedules),
+}
+
+
+def validate_filters(start, end):
+    for value in (start, end):
+        if value and not parse_reading_date(value):
+            raise ValueError(f"invalid date: {value}")
+
+
+# ====== แปลงเป็นข้อความทีละกลุ่มแถว (yield ทุก EXPORT_FLUSH_ROWS แถว ไม่ใช่ทีละแถว) ======
+def iter_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM ให้ Excel อ่านภาษาไทยถูก
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(columns, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        if len(lines) >= EXPORT_FLUSH_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def gzip_stream(chunks, level=EXPORT_GZIP_LEVEL):
+    # wbits=31 → header/trailer แบบ gzip; บีบอัดต่อเนื่องทีละ chunk ไม่ต้องรอข้อมูลครบ
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(repository, kind, fmt, user_ids=None, start=None, end=None, gzip=False):
+    columns, rows = KINDS[kind]
+    encode = iter_csv if fmt == "csv" else iter_ndjson
+    chunks = encode(columns, rows(repository, user_ids, start, end))
+    if gzip:
+        return gzip_stream(chunks)
+    return (chunk.encode("utf-8") for chunk in chunks)
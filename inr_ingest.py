@@ -0,0 +1,214 @@
+import os
+import json
+import codecs
+
+from dose_catalog import parse_dose
+from inr_repository import parse_reading_date, schedule_from_doses
+from sheet_outbox import enqueue_many, PRIORITY_BACKFILL
+
+# ====== นำเข้าค่า INR ทีละหลายรายการ (เช่น backfill ผลแล็บจาก LIS) ======
+# อ่าน body แบบ stream (JSON array หรือ NDJSON) ตรวจทีละรายการ แล้วบันทึกเป็นชุดๆ:
+# ลง SQLite หนึ่ง transaction ต่อชุด และเข้า outbox หนึ่ง commit ต่อชุด (flusher ค่อยส่งไปชีต)
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+# JSON รายการเดียวที่ใหญ่กว่านี้ถือว่า body เสีย (กันอ่านทั้ง body เข้า memory)
+INGEST_MAX_RECORD_BYTES = int(os.getenv("INGEST_MAX_RECORD_BYTES", "65536"))
+INGEST_READ_SIZE = 64 * 1024
+INR_MIN, INR_MAX = 0.5, 15.0
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",]"
+
+
+class MalformedBody(ValueError):
+    pass
+
+
+# ====== อ่าน body ======
+# ทุก reader คืน (record, error) ทีละรายการ; error = ข้อความถ้ารายการนั้นอ่านไม่ได้
+def iter_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, f"invalid JSON: {e}"
+
+
+def iter_json_array(stream):
+    reader = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(INGEST_READ_SIZE)
+        eof = not chunk
+        buffer = buffer[pos:] + reader.decode(chunk or b"", final=eof)
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != "[":
+        raise MalformedBody("body must be a JSON array or NDJSON")
+    pos += 1
+    skip_whitespace()
+    if pos < len(buffer) and buffer[pos] == "]":
+        return
+    while True:
+        skip_whitespace()
+        while True:
+            try:
+                record, end = _decoder.raw_decode(buffer, pos)
+                # ตัวเลขอาจถูกตัดกลางคันที่ขอบ chunk ("1." + "5") → ต้องเห็นตัวคั่นถัดไปก่อน
+                if eof or (end < len(buffer) and buffer[end] in _DELIMITERS):
+                    break
+            except ValueError:
+                if eof:
+                    raise MalformedBody(f"invalid JSON near character {pos}")
+            if len(buffer) - pos > INGEST_MAX_RECORD_BYTES:
+                raise MalformedBody(f"invalid JSON near character {pos}")
+            fill()
+        pos = end
+        yield record, None
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise MalformedBody("unexpected end of JSON array")
+        if buffer[pos] == "]":
+            return
+        if buffer[pos] != ",":
+            raise MalformedBody(f"expected ',' or ']' near character {pos}")
+        pos += 1
+
+
+def iter_records(stream, content_type):
+    if "ndjson" in content_type or "jsonl" in content_type or "json-seq" in content_type:
+        return iter_ndjson(stream)
+    return iter_json_array(stream)
+
+
+# ====== ตรวจรายการเดียว (กติกาเดียวกับ flow บันทึก INR ใน LINE) ======
+def normalize_record(record, describe):
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+    user_id = str(record.get("user_id") or "").strip()
+    name = str(record.get("name") or "").strip()
+    if not user_id or not name or record.get("inr") in (None, ""):
+        raise ValueError("Missing required fields")
+    try:
+        inr = float(record["inr"])
+    except (TypeError, ValueError):
+        raise ValueError("inr must be a number")
+    if not INR_MIN <= inr <= INR_MAX:
+        raise ValueError(f"inr out of range ({INR_MIN}-{INR_MAX})")
+
+    date = str(record.get("date") or "").strip()
+    if date and not parse_reading_date(date):
+        raise ValueError("date must be DD/MM/YYYY or YYYY-MM-DD")
+
+    warfarin_dose = str(record.get("warfarin_dose") or "").strip()
+    schedule = None
+    if warfarin_dose:
+        doses = [d.strip() for d in warfarin_dose.split(",")]
+        try:
+            # ขนาดยาแปลกๆ (เช่น "1e1000000") ต้องตีตกเฉพาะรายการนี้ ไม่ใช่ทำให้ทั้ง body ล้ม
+            if len(doses) == 7 and all(parse_dose(d) is not None for d in doses):
+                schedule = schedule_from_doses(doses, describe)
+        except (ArithmeticError, ValueError):
+            schedule = None
+        if schedule is None:
+            raise ValueError("warfarin_dose must be 7 comma-separated doses (Mon-Sun)")
+
+    return {
+        "user_id": user_id,
+        "name": name,
+        "birthdate": str(record.get("birthdate") or "").strip(),
+        "inr": inr,
+        "bleeding": str(record.get("bleeding") or ""),
+        "supplement": str(record.get("supplement") or ""),
+        "date": date,
+        "warfarin_dose": warfarin_dose,
+        "schedule": schedule,
+    }
+
+
+def sheet_payload(entry):
+    # รูปแบบเดียวกับ send_to_google_sheet; date ใส่เฉพาะค่าย้อนหลังที่ระบุวันมา
+    payload = {
+        "userId": entry["user_id"],
+        "name": entry["name"],
+        "birthdate": entry["birthdate"],
+        "inr": entry["inr"],
+        "bleeding": entry["bleeding"],
+        "supplement": entry["supplement"],
+        "warfarin_dose": entry["warfarin_dose"],
+    }
+    if entry["date"]:
+        payload["date"] = entry["date"]
+    return payload
+
+
+# ====== บันทึกเป็นชุด ======
+class IngestResult:
+    def __init__(self):
+        self.results = []
+        self.error = None
+        self.counts = {"accepted": 0, "duplicate": 0, "rejected": 0}
+
+    def add(self, index, status, **extra):
+        self.counts[status] += 1
+        self.results.append(dict(index=index, status=status, **extra))
+
+    def as_dict(self):
+        data = dict(self.counts, total=len(self.results), results=self.results)
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+def _write_chunk(chunk, repository, sheet_url, result):
+    refs = repository.add_entries([entry for _, entry in chunk])
+    new = [(index, entry, ref) for (index, entry), ref in zip(chunk, refs) if ref]
+    # kind แยกจาก "inr" ของ LINE: ไม่วาดกราฟล่วงหน้าทีละแถวหลังส่งถึงชีต และส่งหลังข้อมูลจาก LINE เสมอ
+    record_ids = enqueue_many("inr_backfill", sheet_url,
+                              [(sheet_payload(entry), entry["user_id"], ref) for _, entry, ref in new],
+                              priority=PRIORITY_BACKFILL)
+    queued = {index: (ref["reading_id"], record_id) for (index, _, ref), record_id in zip(new, record_ids)}
+    for index, _ in chunk:
+        if index in queued:
+            result.add(index, "accepted", id=queued[index][0], outbox_id=queued[index][1])
+        else:
+            result.add(index, "duplicate")
+
+
+def ingest(records, repository, sheet_url, describe, chunk_size=INGEST_CHUNK_SIZE):
+    # records = iterable ของ (record, error); รายการที่ผ่านแล้วถูกบันทึกถึงแม้ body ส่วนหลังจะเสีย
+    result = IngestResult()
+    chunk = []
+    try:
+        for index, (record, error) in enumerate(records):
+            if error is None:
+                try:
+                    chunk.append((index, normalize_record(record, describe)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                result.add(index, "rejected", error=error)
+            if len(chunk) >= chunk_size:
+                _write_chunk(chunk, repository, sheet_url, result)
+                chunk = []
+    except MalformedBody as e:
+        result.error = str(e)
+    if chunk:
+        _write_chunk(chunk, repository, sheet_url, result)
+    result.results.sort(key=lambda item: item["index"])
+    return result
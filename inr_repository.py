@@ -0,0 +1,586 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# ====== ที่เก็บข้อมูลผู้ป่วยในเครื่อง (SQLite) เป็นแหล่งข้อมูลหลักของ bot ======
+# Google Sheet ยังเป็นหน้าจอของแพทย์: เขียนออกผ่าน outbox และดึงกลับมาด้วย SheetSync
+INR_DB = os.getenv("INR_DB", "/tmp/warfarin_inr.db")
+# ข้อมูลที่ดึงจากชีตเก่ากว่านี้จะถูก refresh เบื้องหลัง (ระหว่างนั้นยังตอบจากข้อมูลในเครื่อง)
+INR_SYNC_MAX_AGE = float(os.getenv("INR_SYNC_MAX_AGE", "900"))
+INR_SYNC_INTERVAL = float(os.getenv("INR_SYNC_INTERVAL", "5"))
+# ปกติดึงเฉพาะค่า INR ใหม่ตั้งแต่ cursor แต่ดึงทั้งหมดใหม่เป็นระยะ เผื่อแพทย์แก้/ลบแถวเก่าในชีต
+INR_FULL_SYNC_AGE = float(os.getenv("INR_FULL_SYNC_AGE", "86400"))
+# จำนวนคำขอ Apps Script พร้อมกันตอนดึงข้อมูลทั้ง cohort ทีละคน (เมื่ออ่านชีตประวัติตรงๆ ไม่ได้)
+INR_HYDRATE_WORKERS = int(os.getenv("INR_HYDRATE_WORKERS", "8"))
+
+# ชื่อวันเดียวกับที่ Apps Script ใช้ในข้อมูลยาล่าสุด เช่น "วันจันทร์ (คำอธิบาย)"
+SCHEDULE_DAYS = ["วันจันทร์", "วันอังคาร", "วันพุธ", "วันพฤหัสบดี", "วันศุกร์", "วันเสาร์", "วันอาทิตย์"]
+SERIES_DATE_WIDTH = len("2024-01-31T00:00:00")
+_DATE_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    user_id TEXT PRIMARY KEY,
+    first_name TEXT NOT NULL DEFAULT '',
+    last_name TEXT NOT NULL DEFAULT '',
+    birthdate TEXT NOT NULL DEFAULT '',
+    pending INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inr_readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    taken_at TEXT NOT NULL,
+    inr REAL NOT NULL,
+    bleeding TEXT NOT NULL DEFAULT '',
+    supplement TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL DEFAULT 'local',
+    synced INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_inr_user_date ON inr_readings (user_id, taken_at);
+CREATE TABLE IF NOT EXISTS dose_schedules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    warfarin_dose TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT 'local',
+    synced INTEGER NOT NULL DEFAULT 0,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dose_user_date ON dose_schedules (user_id, recorded_at);
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (user_id, kind)
+);
+"""
+
+
+@lru_cache(maxsize=4096)
+def parse_reading_date(text):
+    # คืน key สำหรับเรียงลำดับแบบ ISO; ปี พ.ศ. แปลงเป็น ค.ศ.
+    text = str(text or "").strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if parsed.year > 2400:
+            parsed = parsed.replace(year=parsed.year - 543)
+        return parsed.strftime("%Y-%m-%dT%H:%M:%S")
+    return ""
+
+
+def split_name(name):
+    parts = (name or "").split(None, 1)
+    return (parts[0] if parts else ""), (parts[1] if len(parts) > 1 else "")
+
+
+def _upsert_patient(conn, user_id, first_name, last_name, birthdate, source):
+    current = conn.execute(
+        "SELECT first_name, last_name, birthdate, pending FROM patients WHERE user_id = ?", (user_id,)
+    ).fetchone() or ("", "", "", 0)
+    # pending = จำนวนการแก้โปรไฟล์จาก bot ที่ outbox ยังส่งไม่ถึงชีต
+    if source == "sheet" and current[3]:
+        return False
+    values = (
+        current[0] if first_name is None else first_name,
+        current[1] if last_name is None else last_name,
+        current[2] if birthdate is None else birthdate,
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO patients (user_id, first_name, last_name, birthdate, pending, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)", (user_id, *values, current[3] + int(source == "local"), time.time())
+    )
+    return True
+
+
+def _insert_reading(conn, user_id, inr, bleeding, supplement, date):
+    now = datetime.now()
+    date = date or now.strftime("%d/%m/%Y")
+    taken_at = parse_reading_date(date) or now.strftime("%Y-%m-%dT%H:%M:%S")
+    return conn.execute(
+        "INSERT INTO inr_readings (user_id, date, taken_at, inr, bleeding, supplement, source, synced, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, 'local', 0, ?)",
+        (user_id, date, taken_at, float(inr), bleeding or "", supplement or "", time.time())
+    ).lastrowid
+
+
+def _insert_schedule(conn, user_id, data, warfarin_dose, source, raw=None):
+    raw = raw or json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return conn.execute(
+        "INSERT INTO dose_schedules (user_id, warfarin_dose, data, source, synced, recorded_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, warfarin_dose or "", raw, source, int(source == "sheet"), time.time())
+    ).lastrowid
+
+
+class InrRepository:
+    def __init__(self, path=INR_DB):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._conn().executescript(_SCHEMA)
+
+    # connection ต่อ thread ใช้ซ้ำได้ตลอด (อ่านได้ในระดับ µs ไม่ต้องเปิดไฟล์ใหม่ทุกครั้ง)
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, func):
+        conn = self._conn()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # ====== ผู้ป่วย ======
+    def get_profile(self, user_id):
+        row = self._conn().execute(
+            "SELECT first_name, last_name, birthdate FROM patients WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return {}
+        return {"firstName": row[0], "lastName": row[1], "birthdate": row[2]}
+
+    # source="local" = แก้จาก bot (ยังไม่ถึงชีต), source="sheet" = ข้อมูลจากชีต
+    # ข้อมูลจากชีตจะไม่ทับการแก้ในเครื่องที่ outbox ยังส่งไม่ถึง
+    def upsert_patient(self, user_id, first_name=None, last_name=None, birthdate=None, source="local"):
+        return self._write(lambda conn: _upsert_patient(conn, user_id, first_name, last_name, birthdate, source))
+
+    # ====== ค่า INR ======
+    def add_reading(self, user_id, inr, bleeding="", supplement="", date=None):
+        return self._write(lambda conn: _insert_reading(conn, user_id, inr, bleeding, supplement, date))
+
+    # บันทึกหลายรายการใน transaction เดียว (นำเข้าจาก LIS / /log_inr/batch)
+    # entry: {user_id, name, birthdate, inr, bleeding, supplement, date, warfarin_dose, schedule}
+    # คืน ref ตามลำดับ ({reading_id, schedule_id, profile} สำหรับ enqueue) หรือ None ถ้ามีค่าเดียวกัน
+    # (ผู้ใช้/วันที่/INR) อยู่แล้ว; profile อยู่ใน ref ของค่าสุดท้ายของผู้ป่วยแต่ละคนเท่านั้น (upsert ครั้งเดียว)
+    def add_entries(self, entries):
+        def _add(conn):
+            refs = []
+            patients = {}
+            for entry in entries:
+                user_id = entry["user_id"]
+                if entry.get("date"):
+                    taken_at = parse_reading_date(entry["date"])
+                    if conn.execute(
+                        "SELECT 1 FROM inr_readings WHERE user_id = ? AND taken_at = ? AND inr = ? LIMIT 1",
+                        (user_id, taken_at, float(entry["inr"]))
+                    ).fetchone():
+                        refs.append(None)
+                        continue
+                ref = {"reading_id": _insert_reading(conn, user_id, entry["inr"], entry.get("bleeding"),
+                                                     entry.get("supplement"), entry.get("date"))}
+                if entry.get("schedule"):
+                    ref["schedule_id"] = _insert_schedule(conn, user_id, entry["schedule"],
+                                                          entry.get("warfarin_dose"), "local")
+                # ผู้ป่วยคนเดียวมีหลายค่าในชุดเดียวกันได้ → upsert ครั้งเดียวด้วยข้อมูลล่าสุด
+                patients[user_id] = (entry, ref)
+                refs.append(ref)
+            for user_id, (entry, ref) in patients.items():
+                first_name, last_name = split_name(entry.get("name"))
+                _upsert_patient(conn, user_id, first_name, last_name, entry.get("birthdate") or None, "local")
+                ref["profile"] = True
+            return refs
+        return self._write(_add)
+
+    # ใหม่ → เก่า เหมือนที่ Apps Script คืนมา
+    # last = N ค่าล่าสุด, start/end = ช่วงวันที่ (รวมทั้งสองวัน), since = เฉพาะค่าที่ใหม่กว่า cursor
+    def history(self, user_id, last=None, start=None, end=None, since=None):
+        sql = "SELECT date, inr FROM inr_readings WHERE user_id = ?"
+        args = [user_id]
+        if start:
+            sql += " AND taken_at >= ?"
+            args.append(parse_reading_date(start) or start)
+        if end:
+            end_key = parse_reading_date(end) or end
+            sql += " AND taken_at <= ?"
+            args.append(end_key[:10] + "T23:59:59" if end_key.endswith("T00:00:00") else end_key)
+        if since:
+            sql += " AND taken_at > ?"
+            args.append(parse_reading_date(since) or since)
+        sql += " ORDER BY taken_at DESC, id DESC"
+        if last:
+            sql += " LIMIT ?"
+            args.append(int(last))
+        rows = self._conn().execute(sql, args).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    def patient_ids(self, active_since=None):
+        # ผู้ป่วยที่มีค่า INR (ตั้งแต่วันที่ active_since ถ้าระบุ) เรียงตาม user_id
+        sql = "SELECT DISTINCT user_id FROM inr_readings WHERE taken_at != ''"
+        args = []
+        if active_since:
+            sql += " AND taken_at >= ?"
+            args.append(parse_reading_date(active_since) or active_since)
+        return [row[0] for row in self._conn().execute(sql + " ORDER BY user_id", args)]
+
+    def history_cursor(self, user_id):
+        # วันที่ของค่าล่าสุดที่อยู่ในชีตแล้ว → ครั้งหน้าขอ Apps Script เฉพาะค่าตั้งแต่วันนี้
+        row = self._conn().execute(
+            "SELECT MAX(taken_at) FROM inr_readings WHERE user_id = ? AND synced = 1 AND taken_at != ''", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    # outbox ส่ง record ถึงชีตแล้ว → ทำเครื่องหมายเฉพาะแถวที่ record นั้นเขียน (ref จาก enqueue)
+    # record เก่าที่ไม่มี ref ถือว่ามีแค่โปรไฟล์ (ค่า INR จะถูกจับคู่ตอน merge ประวัติจากชีต)
+    def mark_flushed(self, user_id, ref):
+        ref = ref or {"profile": True}
+
+        def _mark(conn):
+            if ref.get("profile"):
+                conn.execute("UPDATE patients SET pending = MAX(pending - 1, 0) WHERE user_id = ?", (user_id,))
+            if ref.get("reading_id"):
+                conn.execute("UPDATE inr_readings SET synced = 1 WHERE id = ? AND user_id = ?",
+                             (ref["reading_id"], user_id))
+            if ref.get("schedule_id"):
+                conn.execute("UPDATE dose_schedules SET synced = 1 WHERE id = ? AND user_id = ?",
+                             (ref["schedule_id"], user_id))
+        self._write(_mark)
+
+    def _sheet_rows(self, user_id, items):
+        now = time.time()
+        return [(user_id, str(item["date"]), parse_reading_date(item["date"]), float(item["inr"]),
+                 str(item.get("bleeding", "") or ""), str(item.get("supplement", "") or ""), now)
+                for item in reversed(list(items))]
+
+    def replace_sheet_history(self, user_id, items):
+        # แทนที่แถวที่ sync แล้วด้วยข้อมูลจากชีต แต่เก็บแถวที่ยังรอส่งใน outbox ไว้
+        rows = self._sheet_rows(user_id, items)
+
+        def _replace(conn):
+            conn.execute("DELETE FROM inr_readings WHERE user_id = ? AND synced = 1", (user_id,))
+            conn.executemany(
+                "INSERT INTO inr_readings (user_id, date, taken_at, inr, bleeding, supplement, source, synced, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'sheet', 1, ?)", rows
+            )
+        self._write(_replace)
+
+    def merge_sheet_history(self, user_id, items):
+        # เติมเฉพาะค่าที่ยังไม่มี (Apps Script คืนค่าตั้งแต่วันของ cursor จึงมีแถวซ้ำได้)
+        # ค่าที่บันทึกจาก bot เก็บแค่วันที่ แต่ชีตอาจคืนมาพร้อมเวลา → แถว local จับคู่ด้วย (วัน, INR)
+        rows = self._sheet_rows(user_id, items)
+        if not rows:
+            return 0
+
+        def _merge(conn):
+            lower = min(row[2] for row in rows)[:10]
+            existing = {}
+            local = {}
+            for row_id, taken_at, inr, source in conn.execute(
+                "SELECT id, taken_at, inr, source FROM inr_readings WHERE user_id = ? AND taken_at >= ? ORDER BY id",
+                (user_id, lower)
+            ):
+                existing.setdefault((taken_at, inr), []).append(row_id)
+                if source == "local":
+                    local.setdefault((taken_at[:10], inr), []).append(row_id)
+            used = set()
+            added = 0
+            for row in rows:
+                exact = [row_id for row_id in existing.get((row[2], row[3]), []) if row_id not in used]
+                same_day = [row_id for row_id in local.get((row[2][:10], row[3]), []) if row_id not in used]
+                if exact and exact[0] not in same_day:
+                    used.add(exact[0])
+                    continue
+                if not exact and not same_day:
+                    conn.execute(
+                        "INSERT INTO inr_readings (user_id, date, taken_at, inr, bleeding, supplement, source, synced, "
+                        "created_at) VALUES (?, ?, ?, ?, ?, ?, 'sheet', 1, ?)", row
+                    )
+                    added += 1
+                    continue
+                # ค่าที่บันทึกจาก bot ถึงชีตแล้ว → ใช้วันเวลาตามชีต (cursor ครั้งหน้าจะตรงกัน)
+                row_id = exact[0] if exact else same_day[0]
+                used.add(row_id)
+                conn.execute("UPDATE inr_readings SET date = ?, taken_at = ?, synced = 1 WHERE id = ?",
+                             (row[1], row[2], row_id))
+            return added
+        return self._write(_merge)
+
+    # ====== ตารางยารายสัปดาห์ ======
+    def add_schedule(self, user_id, data, warfarin_dose="", source="local"):
+        raw = json.dumps(data, ensure_ascii=False, sort_keys=True)
+
+        def _add(conn):
+            if source == "sheet":
+                latest = conn.execute(
+                    "SELECT data, synced FROM dose_schedules WHERE user_id = ? ORDER BY recorded_at DESC, id DESC LIMIT 1",
+                    (user_id,)
+                ).fetchone()
+                if latest and (latest[0] == raw or not latest[1]):
+                    return None
+            return _insert_schedule(conn, user_id, data, warfarin_dose, source, raw)
+        return self._write(_add)
+
+    def latest_schedule(self, user_id):
+        row = self._conn().execute(
+            "SELECT data FROM dose_schedules WHERE user_id = ? ORDER BY recorded_at DESC, id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ====== ข้อมูลสำหรับ analytics (อ่านใน transaction เดียวกัน) ======
+    # คืน ([user_id], [จำนวนค่าของแต่ละคน], taken_at ทุกแถวต่อกันเป็นข้อความเดียว, inr ทุกแถวคั่นด้วย ",")
+    # เรียงตามผู้ป่วยและวันที่; ต่อข้อความใน SQLite แล้วให้ NumPy แปลงทั้งก้อน ไม่ต้องสร้าง tuple ใน Python ทีละแถว
+    # taken_at ที่ไม่ว่างยาว SERIES_DATE_WIDTH ตัวเสมอ (parse_reading_date) จึงตัดแบ่งด้วยความกว้างคงที่ได้
+    def inr_series(self, start=None):
+        where = "WHERE taken_at != ''"
+        args = []
+        if start:
+            where += " AND taken_at >= ?"
+            args.append(parse_reading_date(start) or start)
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN")
+            groups = conn.execute(
+                f"SELECT user_id, COUNT(*) FROM inr_readings {where} GROUP BY user_id ORDER BY user_id", args
+            ).fetchall()
+            taken_at, inrs = conn.execute(
+                f"SELECT group_concat(taken_at, ''), group_concat(inr, ',') FROM "
+                f"(SELECT taken_at, inr FROM inr_readings {where} ORDER BY user_id, taken_at, id)", args
+            ).fetchone()
+        finally:
+            conn.close()
+        return [row[0] for row in groups], [row[1] for row in groups], taken_at or "", inrs or ""
+
+    # ====== export (connection แยก อ่านเป็น snapshot เดียว และดึงทีละแถวจาก cursor ไม่โหลดทั้งหมดเข้า memory) ======
+    def _iter_query(self, sql, args):
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN")
+            cursor = conn.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(500)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def iter_readings(self, user_ids=None, start=None, end=None):
+        sql = ("SELECT r.user_id, p.first_name, p.last_name, p.birthdate, r.date, r.taken_at, r.inr, "
+               "r.bleeding, r.supplement, r.source, r.synced "
+               "FROM inr_readings r LEFT JOIN patients p ON p.user_id = r.user_id WHERE 1 = 1")
+        args = []
+        if user_ids:
+            sql += f" AND r.user_id IN ({','.join('?' * len(user_ids))})"
+            args.extend(user_ids)
+        if start:
+            sql += " AND r.taken_at >= ?"
+            args.append(parse_reading_date(start) or start)
+        if end:
+            sql += " AND r.taken_at <= ?"
+            args.append((parse_reading_date(end) or end)[:10] + "T23:59:59")
+        return self._iter_query(sql + " ORDER BY r.user_id, r.taken_at, r.id", args)
+
+    def iter_patients(self, user_ids=None):
+        sql = "SELECT user_id, first_name, last_name, birthdate, updated_at FROM patients"
+        args = []
+        if user_ids:
+            sql += f" WHERE user_id IN ({','.join('?' * len(user_ids))})"
+            args.extend(user_ids)
+        return self._iter_query(sql + " ORDER BY user_id", args)
+
+    def iter_schedules(self, user_ids=None, start=None, end=None):
+        sql = "SELECT user_id, recorded_at, warfarin_dose, data, source, synced FROM dose_schedules WHERE 1 = 1"
+        args = []
+        if user_ids:
+            sql += f" AND user_id IN ({','.join('?' * len(user_ids))})"
+            args.extend(user_ids)
+        if start:
+            sql += " AND recorded_at >= ?"
+            args.append(datetime.fromisoformat(parse_reading_date(start)).timestamp())
+        if end:
+            sql += " AND recorded_at < ?"
+            args.append(datetime.fromisoformat(parse_reading_date(end)[:10]).timestamp() + 86400)
+        return self._iter_query(sql + " ORDER BY user_id, recorded_at, id", args)
+
+    # ====== สถานะการ sync กับชีต ======
+    def synced_at(self, user_id, kind):
+        row = self._conn().execute(
+            "SELECT synced_at FROM sync_state WHERE user_id = ? AND kind = ?", (user_id, kind)
+        ).fetchone()
+        return row[0] if row else None
+
+    def mark_synced(self, user_id, kind):
+        self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO sync_state (user_id, kind, synced_at) VALUES (?, ?, ?)",
+            (user_id, kind, time.time())
+        ))
+
+    def stats(self):
+        conn = self._conn()
+        return {
+            "patients": conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0],
+            "readings": conn.execute("SELECT COUNT(*) FROM inr_readings").fetchone()[0],
+            "unsynced_readings": conn.execute("SELECT COUNT(*) FROM inr_readings WHERE synced = 0").fetchone()[0],
+            "schedules": conn.execute("SELECT COUNT(*) FROM dose_schedules").fetchone()[0],
+        }
+
+
+def schedule_from_doses(doses, describe):
+    # "3,3,3,3,3,1.5,0" → ข้อมูลรูปแบบเดียวกับยาล่าสุดจาก Apps Script
+    data = {}
+    for day, dose in zip(SCHEDULE_DAYS, doses):
+        data[day] = dose
+        data[f"{day} (คำอธิบาย)"] = describe(dose)
+    return data
+
+
+# ====== sync สองทาง: ดึงข้อมูลจากชีตมาเก็บในเครื่อง (ส่วนเขียนออกใช้ outbox) ======
+class SheetSync:
+    KINDS = ("profile", "history", "latest")
+
+    # fetch_history(user_id, since=None) คืน [{date, inr, ...}] ใหม่ → เก่า (since = "YYYY-MM-DD")
+    # fetch_all_history() (ถ้ามี) คืน {user_id: [{date, inr, ...}]} ของทุกคนในครั้งเดียว ใช้ตอน hydrate ทั้ง cohort
+    def __init__(self, repository, fetch_profile, fetch_history, fetch_latest, max_age=INR_SYNC_MAX_AGE,
+                 full_sync_age=INR_FULL_SYNC_AGE, fetch_all_history=None, workers=INR_HYDRATE_WORKERS):
+        self.repository = repository
+        self.fetchers = {"profile": fetch_profile, "history": fetch_history, "latest": fetch_latest}
+        self.fetch_all_history = fetch_all_history
+        self.workers = workers
+        self.max_age = max_age
+        self.full_sync_age = full_sync_age
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self._thread = None
+
+    def _apply(self, user_id, kind, data):
+        repo = self.repository
+        if kind == "profile":
+            if data:
+                repo.upsert_patient(user_id, data.get("firstName", ""), data.get("lastName", ""),
+                                    data.get("birthdate", ""), source="sheet")
+        elif kind == "history":
+            since, items = data
+            if since:
+                repo.merge_sheet_history(user_id, items or [])
+            else:
+                repo.replace_sheet_history(user_id, items or [])
+                repo.mark_synced(user_id, "history_full")
+        elif kind == "latest":
+            if data:
+                repo.add_schedule(user_id, data, source="sheet")
+        repo.mark_synced(user_id, kind)
+
+    def _fetch_history(self, user_id):
+        # มีข้อมูลอยู่แล้วและเพิ่ง sync ทั้งหมดไม่นาน → ขอเฉพาะค่าใหม่ตั้งแต่ cursor
+        since = None
+        last_full = self.repository.synced_at(user_id, "history_full")
+        if last_full is not None and time.time() - last_full < self.full_sync_age:
+            cursor = self.repository.history_cursor(user_id)
+            since = cursor[:10] if cursor else None
+        return since, self.fetchers["history"](user_id, since=since)
+
+    def refresh(self, user_id, kind):
+        if kind == "history":
+            data = self._fetch_history(user_id)
+        else:
+            data = self.fetchers[kind](user_id)
+        self._apply(user_id, kind, data)
+
+    def is_fresh(self, user_id, kind):
+        synced_at = self.repository.synced_at(user_id, kind)
+        return synced_at is not None and time.time() - synced_at <= self.max_age
+
+    def _hydrate_all_history(self, user_ids):
+        # อ่านชีตประวัติทั้งแผ่นครั้งเดียว แล้วแทนที่ประวัติที่ sync แล้วของทุกคน (คนที่ไม่มีแถวในชีต = ไม่มีประวัติ)
+        history = self.fetch_all_history()
+        users = set(user_ids) | set(history)
+        for user_id in users:
+            self._apply(user_id, "history", (None, history.get(user_id, [])))
+        return users
+
+    # ดึงข้อมูลชนิด kinds ที่เก่ากว่า max_age (หรือยังไม่เคย sync) ของผู้ป่วยทันที ก่อนงานที่ใช้ข้อมูลทุกคน
+    # (TTR / รายงานประจำสัปดาห์ / export) ประวัติอ่านจากชีตทีเดียวทั้ง cohort ถ้ามี fetch_all_history
+    # นอกนั้นดึงทีละคนพร้อมกัน self.workers คำขอ; limit = ดึงได้ไม่เกินกี่ครั้ง ที่เหลือเข้าคิว sync เบื้องหลัง
+    # partial = มีข้อมูลที่ยังไม่สดหลังจบ (ดึงไม่สำเร็จ หรือเลื่อนไปทำเบื้องหลัง)
+    def hydrate(self, user_ids, kinds=("history",), limit=None):
+        cohort = set(user_ids)
+        stale = [(user_id, kind) for user_id in user_ids for kind in kinds if not self.is_fresh(user_id, kind)]
+        fetched = failed = deferred = 0
+        if limit is None and self.fetch_all_history is not None and any(kind == "history" for _, kind in stale):
+            try:
+                cohort |= self._hydrate_all_history(user_ids)
+                fetched += sum(1 for _, kind in stale if kind == "history")
+                stale = [(user_id, kind) for user_id, kind in stale if kind != "history"]
+            except Exception as e:
+                print("❌ อ่านประวัติ INR ทั้งชีตไม่สำเร็จ ดึงทีละคนแทน:", e)
+
+        if limit is not None and len(stale) > limit:
+            for user_id, kind in stale[limit:]:
+                self.schedule(user_id, kind)
+            deferred = len(stale) - limit
+            stale = stale[:limit]
+
+        def refresh(item):
+            try:
+                self.refresh(*item)
+                return True
+            except Exception as e:
+                print(f"❌ ดึง {item[1]} ของ {item[0]} จากชีตไม่สำเร็จ:", e)
+                return False
+
+        if stale:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(stale)))) as pool:
+                for ok in pool.map(refresh, stale):
+                    fetched += ok
+                    failed += not ok
+        return {"cohort": len(cohort), "kinds": list(kinds), "fetched": fetched, "failed": failed,
+                "deferred": deferred, "partial": failed > 0 or deferred > 0}
+
+    # ครั้งแรกดึงจากชีตทันที ครั้งต่อไปตอบจากเครื่องแล้ว refresh เบื้องหลังเมื่อข้อมูลเก่า
+    def ensure(self, user_id, kind):
+        synced_at = self.repository.synced_at(user_id, kind)
+        if synced_at is None:
+            self.refresh(user_id, kind)
+        elif time.time() - synced_at > self.max_age:
+            self.schedule(user_id, kind)
+
+    def schedule(self, user_id, kind):
+        with self._queued_lock:
+            if (user_id, kind) in self._queued:
+                return
+            self._queued.add((user_id, kind))
+        self._queue.put((user_id, kind))
+
+    def _loop(self):
+        while True:
+            user_id, kind = self._queue.get()
+            with self._queued_lock:
+                self._queued.discard((user_id, kind))
+            try:
+                self.refresh(user_id, kind)
+            except Exception as e:
+                print(f"❌ sync {kind} ของ {user_id} จากชีตไม่สำเร็จ:", e)
+                time.sleep(INR_SYNC_INTERVAL)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="inr-sheet-sync", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def pending(self):
+        return self._queue.qsize()
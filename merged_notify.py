@@ -1,5 +1,4 @@
 import os
-import requests
 from datetime import datetime
 from flask import Flask, request, jsonify, abort
 from dotenv import load_dotenv
@@ -11,6 +10,9 @@ from linebot.v3.messaging import (
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
 from linebot.v3.exceptions import InvalidSignatureError
 
+import http_transport
+from session_store import create_session_store
+
 load_dotenv()
 
 # ====== LINE API Setup ======
@@ -27,8 +29,8 @@ app = Flask(__name__)
 # ====== Google Apps Script Webhook URL ======
 GOOGLE_APPS_SCRIPT_URL = "https://script.google.com/macros/s/AKfycbwrNtxEAwnvgXbomU7Im7Ww53piAEql9Rf-580KD_FHD3vY1NeO1tG5PEFkzDWrVKSexw/exec"
 
-# ====== In-Memory Session ======
-user_sessions = {}
+# ====== Session (มี TTL, เลือก backend ได้ผ่าน SESSION_BACKEND) ======
+sessions = create_session_store()
 
 # ====== ฟังก์ชันส่งข้อมูลไป Google Sheet ======
 def send_to_google_sheet(user_id, name, inr, bleeding="", supplement=""):
@@ -41,7 +43,7 @@ def send_to_google_sheet(user_id, name, inr, bleeding="", supplement=""):
     }
 
     try:
-        response = requests.post(GOOGLE_APPS_SCRIPT_URL, json=payload, timeout=10)
+        response = http_transport.post(GOOGLE_APPS_SCRIPT_URL, endpoint="apps_script_write", json=payload)
         return response.text
     except Exception as e:
         return f"❌ Error: {str(e)}"
@@ -79,16 +81,26 @@ def callback():
         abort(400)
     return "OK"
 
+# ====== session หมดอายุ / ถูกเลื่อนขั้นไปแล้ว → ตอบผู้ใช้แทนการเงียบ ======
+def reply_session_lost(reply_token):
+    messaging_api.reply_message(
+        ReplyMessageRequest(reply_token=reply_token, messages=[
+            TextMessage(text="⌛ ขั้นตอนนี้หมดเวลาหรือถูกบันทึกไปแล้ว พิมพ์ 'เริ่มต้นใช้งาน' เพื่อเริ่มใหม่")
+        ])
+    )
+
 # ====== LINE Message Handler ======
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
     user_id = event.source.user_id
     reply_token = event.reply_token
     text = event.message.text.strip()
+    session = sessions.get(user_id)
+    step = session.step if session else None
 
     # เริ่มต้น flow
     if text == "เริ่มต้นใช้งาน":
-        user_sessions[user_id] = {"step": "ask_name"}
+        sessions.start(user_id, "ask_name")
         messaging_api.reply_message(
             ReplyMessageRequest(reply_token=reply_token, messages=[
                 TextMessage(text="👤 กรุณาพิมพ์ชื่อ-นามสกุลของคุณ")
@@ -97,9 +109,10 @@ def handle_message(event):
         return
 
     # ถามชื่อ
-    if user_id in user_sessions and user_sessions[user_id]["step"] == "ask_name":
-        user_sessions[user_id]["name"] = text
-        user_sessions[user_id]["step"] = "ask_inr"
+    if step == "ask_name":
+        if not sessions.transition(user_id, "ask_name", "ask_inr", name=text):
+            reply_session_lost(reply_token)
+            return
         messaging_api.reply_message(
             ReplyMessageRequest(reply_token=reply_token, messages=[
                 TextMessage(text="🧪 กรุณาพิมพ์ค่า INR เช่น 2.7")
@@ -108,11 +121,12 @@ def handle_message(event):
         return
 
     # ถามค่า INR
-    if user_sessions[user_id]["step"] == "ask_inr":
+    if step == "ask_inr":
         try:
             inr = float(text)
-            user_sessions[user_id]["inr"] = inr
-            user_sessions[user_id]["step"] = "ask_bleeding"
+            if not sessions.transition(user_id, "ask_inr", "ask_bleeding", inr=inr):
+                reply_session_lost(reply_token)
+                return
             messaging_api.reply_message(
                 ReplyMessageRequest(reply_token=reply_token, messages=[
                     TextMessage(text="🩸 มีภาวะเลือดออกหรือไม่? (yes/no)")
@@ -127,7 +141,7 @@ def handle_message(event):
         return
 
     # ถาม bleeding
-    if user_sessions[user_id]["step"] == "ask_bleeding":
+    if step == "ask_bleeding":
         if text.lower() not in ["yes", "no"]:
             messaging_api.reply_message(
                 ReplyMessageRequest(reply_token=reply_token, messages=[
@@ -135,8 +149,9 @@ def handle_message(event):
                 ])
             )
             return
-        user_sessions[user_id]["bleeding"] = text.lower()
-        user_sessions[user_id]["step"] = "ask_supplement"
+        if not sessions.transition(user_id, "ask_bleeding", "ask_supplement", bleeding=text.lower()):
+            reply_session_lost(reply_token)
+            return
         messaging_api.reply_message(
             ReplyMessageRequest(reply_token=reply_token, messages=[
                 TextMessage(text="🌿 มีการใช้สมุนไพร/อาหารเสริมหรือไม่? (ถ้าไม่มี พิมพ์ 'ไม่มี')")
@@ -145,23 +160,26 @@ def handle_message(event):
         return
 
     # ✅ สุดท้าย: บันทึก Supplement และส่งไป Google Sheet
-    if user_sessions[user_id]["step"] == "ask_supplement":
-        session = user_sessions.pop(user_id)
-        session["supplement"] = text
+    if step == "ask_supplement":
+        session = sessions.finish(user_id, "ask_supplement")
+        if not session:
+            reply_session_lost(reply_token)
+            return
+        session.supplement = text
 
         result = send_to_google_sheet(
             user_id=user_id,
-            name=session["name"],
-            inr=session["inr"],
-            bleeding=session["bleeding"],
-            supplement=session["supplement"]
+            name=session.name,
+            inr=session.inr,
+            bleeding=session.bleeding,
+            supplement=session.supplement
         )
 
         reply = f"""✅ ข้อมูลถูกบันทึกเรียบร้อยแล้ว
-👤 {session['name']}
-🧪 INR: {session['inr']}
-🩸 Bleeding: {session['bleeding']}
-🌿 Supplement: {session['supplement']}"""
+👤 {session.name}
+🧪 INR: {session.inr}
+🩸 Bleeding: {session.bleeding}
+🌿 Supplement: {session.supplement}"""
 
         messaging_api.reply_message(
             ReplyMessageRequest(reply_token=reply_token, messages=[TextMessage(text=reply)])
@@ -169,7 +187,7 @@ def handle_message(event):
         return
 
     # กรณีไม่มี session
-    if user_id not in user_sessions:
+    if session is None:
         messaging_api.reply_message(
             ReplyMessageRequest(reply_token=reply_token, messages=[
                 TextMessage(text="❓ พิมพ์ 'เริ่มต้นใช้งาน' เพื่อบันทึกข้อมูล INR")
@@ -0,0 +1,206 @@
+import time
+import bisect
+import threading
+
+# ====== metrics แบบ Prometheus text format (เขียนเองแบบเบาๆ ไม่ต้องลง prometheus_client) ======
+# หน่วยเวลาเป็นวินาที; bucket ครอบคลุมตั้งแต่ lookup ใน memory ถึง Apps Script ที่ช้าหลายวินาที
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels
+        if "outcome" in self.histogram.labelnames and "outcome" not in labels:
+            labels = dict(labels, outcome="error" if exc_type else "ok")
+        self.histogram.observe(time.perf_counter() - self.started, **labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [นับแยกราย bucket..., +Inf, sum]
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = self._header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def add_collector(collector):
+    # collector() ถูกเรียกตอน /metrics เพื่ออัปเดต gauge (เช่น ความยาวคิว) ก่อน render
+    _collectors.append(collector)
+
+
+def render_metrics():
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            print("❌ metrics collector error:", e)
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ====== metrics ที่ใช้ทั้ง app ======
+HTTP_REQUEST_SECONDS = Histogram(
+    "warfarin_http_request_duration_seconds", "Flask request latency by route",
+    ("route", "method", "status"))
+UPSTREAM_SECONDS = Histogram(
+    "warfarin_upstream_request_duration_seconds",
+    "Latency of calls to Apps Script, LINE and Google Sheets (one observation per attempt)",
+    ("upstream", "operation", "outcome"))
+CHART_SECONDS = Histogram(
+    "warfarin_chart_duration_seconds", "INR chart render and PNG encode time", ("stage",))
+CONVERSATION_EVENTS = Counter(
+    "warfarin_conversation_events", "LINE text messages by routed kind and command/step name", ("kind", "name"))
+ALERT_EVENTS = Counter(
+    "warfarin_inr_alerts", "Clinician alerts by kind and outcome (sent/logged/deduplicated/failed)",
+    ("kind", "outcome"))
+CONVERSATION_SECONDS = Histogram(
+    "warfarin_conversation_dispatch_duration_seconds", "Handler time per routed message", ("kind",))
+
+
+def observe_dispatch(kind, name, seconds):
+    # ใช้เป็น listener ของ ConversationRouter
+    CONVERSATION_EVENTS.inc(kind=kind, name=name)
+    CONVERSATION_SECONDS.observe(seconds, kind=kind)
+
+
+def time_upstream(upstream, operation):
+    return UPSTREAM_SECONDS.time(upstream=upstream, operation=operation)
+
+
+# ====== วัดทุก request ของ Flask ======
+def install_flask_metrics(app):
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = getattr(g, "_metrics_started", None)
+        if started is not None:
+            # ใช้ rule (เช่น /jobs/<job_id>) แทน path จริง ไม่ให้ label งอกตาม id
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                         method=request.method, status=response.status_code)
+        return response
+
+    return app
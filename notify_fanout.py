@@ -0,0 +1,131 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import http_transport
+
+# ====== LINE Messaging API (push / multicast) ======
+# เปลี่ยน LINE_API_BASE_URL ได้ (เช่น ชี้ไปที่ emulator ตอนทำ load test)
+LINE_API_BASE_URL = os.getenv("LINE_API_BASE_URL", "https://api.line.me").rstrip("/")
+LINE_PUSH_URL = f"{LINE_API_BASE_URL}/v2/bot/message/push"
+LINE_MULTICAST_URL = f"{LINE_API_BASE_URL}/v2/bot/message/multicast"
+
+# LINE รับ multicast ได้สูงสุด 500 คนต่อครั้ง
+MULTICAST_LIMIT = 500
+
+# จำนวน worker ที่ส่งพร้อมกันได้ (ปรับได้ผ่าน env)
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+
+
+def _headers():
+    return {
+        'Authorization': f'Bearer {os.getenv("LINE_CHANNEL_ACCESS_TOKEN")}',
+        'Content-Type': 'application/json',
+        # LINE ใช้ retry key กันการส่งซ้ำ จึง retry request เดิมได้อย่างปลอดภัย
+        'X-Line-Retry-Key': str(uuid.uuid4())
+    }
+
+
+def _check(response):
+    # 409 = request ที่ใช้ retry key นี้ถูกรับไปแล้ว
+    if response.status_code != 409:
+        response.raise_for_status()
+    return response
+
+
+def build_messages(text, image_url=None):
+    messages = [{'type': 'text', 'text': text}]
+    if image_url:
+        # image_url เป็น URL เดียว หรือ (รูปเต็ม, รูป preview)
+        original, preview = image_url if isinstance(image_url, tuple) else (image_url, image_url)
+        messages.append({
+            'type': 'image',
+            'originalContentUrl': original,
+            'previewImageUrl': preview
+        })
+    return messages
+
+
+def push_message(user_id, messages):
+    response = http_transport.post(LINE_PUSH_URL, endpoint="line_push", idempotent=True,
+                                   headers=_headers(), json={'to': user_id, 'messages': messages})
+    return _check(response)
+
+
+def multicast_message(user_ids, messages):
+    response = http_transport.post(LINE_MULTICAST_URL, endpoint="line_multicast", idempotent=True,
+                                   headers=_headers(), json={'to': list(user_ids), 'messages': messages})
+    return _check(response)
+
+
+# ========== จัดกลุ่มผู้รับตามข้อความ+รูปที่เหมือนกัน ==========
+def group_recipients(recipients):
+    groups = {}
+    seen = {}
+    duplicates = 0
+    for user_id, text, image_url in recipients:
+        key = (text, image_url)
+        members = groups.setdefault(key, [])
+        # set คู่กับ list (คงลำดับผู้รับไว้) → ตรวจซ้ำ O(1) แม้ทุกคนอยู่กลุ่มเดียว
+        member_set = seen.setdefault(key, set())
+        if user_id in member_set:
+            duplicates += 1
+            continue
+        member_set.add(user_id)
+        members.append(user_id)
+    return groups, duplicates
+
+
+def _send_task(user_ids, messages):
+    if len(user_ids) == 1:
+        push_message(user_ids[0], messages)
+    else:
+        multicast_message(user_ids, messages)
+    return len(user_ids)
+
+
+# ========== แบ่งเป็นชุดส่ง: (ผู้รับไม่เกิน 500 คน, payload ข้อความ) ==========
+def build_batches(recipients):
+    groups, duplicates = group_recipients(recipients)
+    batches = []
+    for (text, image_url), user_ids in groups.items():
+        messages = build_messages(text, image_url)
+        for i in range(0, len(user_ids), MULTICAST_LIMIT):
+            batches.append((user_ids[i:i + MULTICAST_LIMIT], messages))
+    return batches, duplicates
+
+
+# ========== ส่งแบบขนาน: multicast ต่อกลุ่ม + push ที่เหลือผ่าน worker pool ==========
+def fan_out(recipients, concurrency=None, skipped=0):
+    batches, duplicates = build_batches(recipients)
+    return send_batches(batches, concurrency, skipped=skipped + duplicates)
+
+
+def send_batches(batches, concurrency=None, skipped=0):
+    started = time.monotonic()
+    summary = {"sent": 0, "failed": 0, "skipped": skipped, "multicast_calls": 0, "push_calls": 0}
+
+    tasks = [(list(user_ids), messages) for user_ids, messages in batches]
+    for chunk, _ in tasks:
+        if len(chunk) == 1:
+            summary["push_calls"] += 1
+        else:
+            summary["multicast_calls"] += 1
+
+    workers = max(1, concurrency or NOTIFY_CONCURRENCY)
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            futures = {pool.submit(_send_task, chunk, messages): chunk for chunk, messages in tasks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    summary["sent"] += future.result()
+                except Exception as e:
+                    summary["failed"] += len(chunk)
+                    print(f"❌ ส่งไม่สำเร็จ ({len(chunk)} คน):", e)
+
+    summary["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    print(f"📤 สรุปการแจ้งเตือน: sent={summary['sent']} failed={summary['failed']} "
+          f"skipped={summary['skipped']} time={summary['elapsed_seconds']}s")
+    return summary
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import threading
+from datetime import datetime, timedelta
+
+# ====== Background jobs (เก็บสถานะ + checkpoint เป็นไฟล์ JSON) ======
+JOB_DIR = os.getenv("NOTIFY_JOB_DIR", "/tmp/warfarin_jobs")
+JOB_RETENTION_DAYS = int(os.getenv("NOTIFY_JOB_RETENTION_DAYS", "7"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_runners = {}
+_threads = {}
+_claims = {}
+_lock = threading.Lock()
+
+
+def register_job_kind(kind, runner):
+    # runner(job, checkpoint) -> summary dict
+    _runners[kind] = runner
+
+
+def _job_path(job_id, suffix="json"):
+    return os.path.join(JOB_DIR, f"{job_id}.{suffix}")
+
+
+def _write_json(path, data):
+    os.makedirs(JOB_DIR, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_job(job):
+    job["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    _write_json(_job_path(job["id"]), job)
+
+
+def load_job(job_id):
+    # กัน path traversal จาก job id ที่ส่งมาทาง URL
+    if not job_id or os.path.basename(job_id) != job_id:
+        return None
+    return _read_json(_job_path(job_id))
+
+
+def list_jobs():
+    if not os.path.isdir(JOB_DIR):
+        return []
+    jobs = []
+    for filename in os.listdir(JOB_DIR):
+        if filename.endswith(".json") and not filename.endswith(".rows.json"):
+            job = _read_json(os.path.join(JOB_DIR, filename))
+            if job:
+                jobs.append(job)
+    return sorted(jobs, key=lambda j: j.get("created_at", ""))
+
+
+# ====== snapshot ของแถวในชีต (ไม่ต้องอ่านชีตซ้ำตอน resume) ======
+def save_rows_snapshot(job_id, rows):
+    _write_json(_job_path(job_id, "rows.json"), rows)
+
+
+def load_rows_snapshot(job_id):
+    return _read_json(_job_path(job_id, "rows.json"))
+
+
+# ====== เริ่มงาน ======
+def start_job(kind, params=None, dedupe_key=None, force=False):
+    with _lock:
+        if dedupe_key and not force:
+            for job in reversed(list_jobs()):
+                if job.get("dedupe_key") != dedupe_key:
+                    continue
+                if job["id"] in _threads:
+                    return job
+                if job["status"] == "failed":
+                    # ลองใหม่จาก checkpoint เดิม แทนการเริ่มจากแถวแรก
+                    return _launch(job, retry_failed=True)
+                if job["status"] in ACTIVE_STATUSES:
+                    return _launch(job)
+                return job
+
+        job = {
+            "id": f"{kind}-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}",
+            "kind": kind,
+            "params": params or {},
+            "dedupe_key": dedupe_key,
+            "status": "queued",
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "checkpoint": None,
+            "progress": {},
+            "summary": None,
+            "error": None,
+        }
+        save_job(job)
+        _launch(job)
+        return job
+
+
+# ====== claim งานข้าม process (หลาย worker / restart ซ้อน) ด้วย flock บนไฟล์ .lock ======
+# lock อยู่กับ process ที่รันงานจนงานจบ; ถ้า process ตาย OS ปล่อย lock ให้ process อื่นรับงานต่อได้
+def _claim(job_id):
+    os.makedirs(JOB_DIR, exist_ok=True)
+    fd = os.open(_job_path(job_id, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _claims[job_id] = fd
+    return True
+
+
+def _release(job_id):
+    fd = _claims.pop(job_id, None)
+    if fd is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _launch(job, retry_failed=False):
+    # คืนสถานะล่าสุดของงาน; ถ้า process อื่นถืองานอยู่ (หรือทำเสร็จไปแล้ว) ไม่รันซ้ำ
+    if not _claim(job["id"]):
+        return job
+    job = _read_json(_job_path(job["id"])) or job
+    if retry_failed and job["status"] == "failed":
+        job["status"] = "queued"
+        job["error"] = None
+        save_job(job)
+    if job["status"] not in ACTIVE_STATUSES:
+        _release(job["id"])
+        return job
+    thread = threading.Thread(target=_run, args=(job,), name=f"job-{job['id']}", daemon=True)
+    _threads[job["id"]] = thread
+    thread.start()
+    return job
+
+
+def _run(job):
+    runner = _runners.get(job["kind"])
+    try:
+        if runner is None:
+            raise RuntimeError(f"ไม่รู้จักงานประเภท {job['kind']}")
+
+        job["status"] = "running"
+        job["started_at"] = job.get("started_at") or datetime.now().isoformat(timespec="seconds")
+        save_job(job)
+
+        def checkpoint(position, summary=None, **progress):
+            job["checkpoint"] = position
+            if summary is not None:
+                job["summary"] = summary
+            job["progress"].update(progress)
+            save_job(job)
+
+        started = time.monotonic()
+        job["summary"] = runner(job, checkpoint)
+        job["status"] = "done"
+        job["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        print(f"✅ งาน {job['id']} เสร็จใน {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        print(f"❌ งาน {job['id']} ล้มเหลว:", e)
+    finally:
+        save_job(job)
+        with _lock:
+            _threads.pop(job["id"], None)
+            _release(job["id"])
+
+
+# ====== ทำงานที่ค้างอยู่ต่อหลัง restart ======
+def resume_pending_jobs():
+    cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+    with _lock:
+        for job in list_jobs():
+            if os.path.getmtime(_job_path(job["id"])) < cutoff and job["status"] not in ACTIVE_STATUSES:
+                for suffix in ("json", "rows.json", "lock"):
+                    try:
+                        os.remove(_job_path(job["id"], suffix))
+                    except OSError:
+                        pass
+                continue
+            if job["status"] in ACTIVE_STATUSES and job["id"] not in _threads:
+                if _launch(job)["id"] in _threads:
+                    print(f"🔁 ทำงาน {job['id']} ต่อจาก checkpoint {job.get('checkpoint')}")
+                else:
+                    print(f"⏭️ ข้ามงาน {job['id']} (process อื่นกำลังทำอยู่หรือทำเสร็จแล้ว)")
+
+
+# ====== ตั้งเวลาเริ่มงานทุกวัน (เช่น analytics ตอนกลางคืน) กันซ้ำด้วย dedupe_key ต่อวัน ======
+# at = "HH:MM" เวลา local; params(day) คืน params ของงานวันนั้น; weekdays = {0..6} ถ้าไม่ได้ทำทุกวัน
+def start_daily_schedule(kind, at, params=None, weekdays=None, dedupe_key=None):
+    # dedupe_key(run_at) → ส่วนท้ายของ key กันรันซ้ำ (ค่าเริ่มต้น = วันที่) ให้ตรงกับ key ที่ route สั่งงานเดียวกันใช้
+    hour, minute = (int(part) for part in at.split(":"))
+
+    def _loop():
+        while True:
+            now = datetime.now()
+            run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if run_at <= now:
+                run_at += timedelta(days=1)
+            while weekdays is not None and run_at.weekday() not in weekdays:
+                run_at += timedelta(days=1)
+            time.sleep((run_at - now).total_seconds())
+            day = run_at.strftime("%Y-%m-%d")
+            try:
+                key = dedupe_key(run_at) if dedupe_key else day
+                start_job(kind, params=params(day) if params else {"date": day}, dedupe_key=f"{kind}:{key}")
+            except Exception as e:
+                print(f"❌ เริ่มงาน {kind} ตามเวลาไม่สำเร็จ:", e)
+
+    thread = threading.Thread(target=_loop, name=f"schedule-{kind}", daemon=True)
+    thread.start()
+    return thread
+
+
+def job_status(job):
+    return {k: v for k, v in job.items() if k != "params"}
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+
+from dose_catalog import get_dose
+from dose_images import dose_image_urls
+from notify_fanout import build_batches
+from sheet_client import read_changed_rows
+
+# ====== แผนส่งแจ้งเตือนรายวันที่เตรียมไว้ล่วงหน้า (กลุ่มผู้รับ + payload ที่สร้างเสร็จแล้ว) ======
+# ตอนถึงเวลาส่ง งานแจ้งเตือนแค่อ่านไฟล์แผนแล้วส่งตามลำดับ ไม่ต้องอ่านชีตหรือสร้างข้อความใหม่
+REMINDER_PLAN_DIR = os.getenv("REMINDER_PLAN_DIR", "/tmp/warfarin_reminder_plans")
+# refresh แผนของวันนี้/พรุ่งนี้เบื้องหลังทุกกี่วินาที (0 = ปิด ใช้ /plan_reminders แทน)
+REMINDER_PLAN_INTERVAL = float(os.getenv("REMINDER_PLAN_INTERVAL", "900"))
+REMINDER_PLAN_KEEP_DAYS = int(os.getenv("REMINDER_PLAN_KEEP_DAYS", "7"))
+# รูปแบบไฟล์แผน (แผนรูปแบบเก่าถูกสร้างใหม่ทั้งหมด)
+PLAN_FORMAT = 2
+
+THAI_WEEKDAYS = ['จันทร์', 'อังคาร', 'พุธ', 'พฤหัส', 'ศุกร์', 'เสาร์', 'อาทิตย์']
+
+_lock = threading.Lock()
+_refresher = None
+
+
+def weekday_column(day):
+    return THAI_WEEKDAYS[datetime.strptime(day, "%Y-%m-%d").weekday()]
+
+
+def _plan_path(day):
+    datetime.strptime(day, "%Y-%m-%d")  # กัน path แปลกๆ
+    return os.path.join(REMINDER_PLAN_DIR, f"plan_{day}.json")
+
+
+def load_plan(day):
+    try:
+        with open(_plan_path(day), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_plan(plan):
+    os.makedirs(REMINDER_PLAN_DIR, exist_ok=True)
+    path = _plan_path(plan["date"])
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _build(plan):
+    # rows: {เลขแถว: [user_id, ข้อความ, ขนาดยา] หรือ null ถ้าแถวนี้ไม่ต้องส่ง}
+    # URL รูปหาใหม่จาก dose_images ทุกครั้ง (รูปที่ bot เสิร์ฟเองอาจเพิ่งพร้อมหลังแผนถูกสร้างด้วยลิงก์ Drive)
+    entries = [plan["rows"][key] for key in sorted(plan["rows"], key=int)]
+    recipients = [(entry[0], entry[1], dose_image_urls(get_dose(entry[2])) if entry[2] else None)
+                  for entry in entries if entry]
+    batches, duplicates = build_batches(recipients)
+    # ผ่าน JSON เหมือนตอนบันทึกไฟล์ จะได้เทียบกับ batches ของแผนเดิมได้ตรงๆ
+    batches = json.loads(json.dumps([[user_ids, messages] for user_ids, messages in batches], ensure_ascii=False))
+    return batches, len(entries) - len(recipients) + duplicates
+
+
+def _compile(plan, built=None):
+    plan["batches"], plan["skipped"] = built or _build(plan)
+    plan["recipients"] = sum(len(user_ids) for user_ids, _ in plan["batches"])
+    plan["updated_at"] = time.time()
+    plan["version"] = plan.get("version", 0) + 1
+    return plan
+
+
+def _render_rows(rows, day, render):
+    # render(row, today_col) → (user_id, ข้อความ, key ของขนาดยาสำหรับรูป หรือ None) หรือ None
+    today_col = weekday_column(day)
+    rendered = {}
+    for row in rows:
+        entry = render(row, today_col)
+        rendered[str(row["_row"])] = list(entry) if entry else None
+    return rendered
+
+
+# ====== สร้าง/อัปเดตแผนของวันที่ day (อ่านชีตเฉพาะแถวที่เปลี่ยนตั้งแต่ครั้งก่อน) ======
+# snapshot ของการอ่านครั้งก่อนเก็บในไฟล์แผนของวันนั้นเอง → diff ของแต่ละวันไม่ปนกัน (แม้ใช้คอลัมน์ชุดเดียวกัน)
+def refresh_plan(day, columns, render):
+    columns = list(dict.fromkeys(columns))
+    with _lock:
+        previous = load_plan(day)
+        usable = (previous is not None and previous.get("format") == PLAN_FORMAT
+                  and previous.get("columns") == columns and "snapshot" in previous)
+        snapshot = {int(row): tuple(value) for row, value in previous["snapshot"].items()} if usable else None
+        changed, removed, snapshot = read_changed_rows(columns, snapshot)
+        if not usable:
+            # อ่านครบทุกแถว → สร้างแผนใหม่ทั้งหมด (แถวที่ถูกลบไปแล้วจะไม่ค้างในแผน)
+            plan = {"date": day, "today_col": weekday_column(day), "format": PLAN_FORMAT, "columns": columns,
+                    "rows": {}, "version": (previous or {}).get("version", 0)}
+        elif not changed and not removed:
+            # ชีตไม่เปลี่ยน แต่ URL รูปอาจเปลี่ยน (เช่น cache รูปขนาดยาเพิ่ง warm เสร็จ)
+            built = _build(previous)
+            if built[0] == previous["batches"]:
+                return previous
+            _compile(previous, built)
+            save_plan(previous)
+            print(f"🗓️ แผนแจ้งเตือน {day}: อัปเดตรูปขนาดยา (v{previous['version']})")
+            return previous
+        else:
+            plan = previous
+
+        plan["snapshot"] = {str(row): list(value) for row, value in snapshot.items()}
+        plan["rows"].update(_render_rows(changed, day, render))
+        for row in removed:
+            plan["rows"].pop(str(row), None)
+        _compile(plan)
+        save_plan(plan)
+        print(f"🗓️ แผนแจ้งเตือน {day}: {plan['recipients']} คน {len(plan['batches'])} ชุด "
+              f"(เปลี่ยน {len(changed)} แถว, ลบ {len(removed)} แถว, v{plan['version']})")
+        return plan
+
+
+def cleanup_plans(today=None):
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    oldest = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=REMINDER_PLAN_KEEP_DAYS)).strftime("%Y-%m-%d")
+    if not os.path.isdir(REMINDER_PLAN_DIR):
+        return
+    for filename in os.listdir(REMINDER_PLAN_DIR):
+        if filename.startswith("plan_") and filename.endswith(".json") and filename[5:-5] < oldest:
+            try:
+                os.remove(os.path.join(REMINDER_PLAN_DIR, filename))
+            except OSError:
+                pass
+
+
+# ====== refresh แผนของวันนี้และพรุ่งนี้เป็นระยะ ======
+def _refresh_loop(columns_for, render, interval, wait):
+    if wait is not None:
+        wait()
+    while True:
+        now = datetime.now()
+        for day in (now.strftime("%Y-%m-%d"), (now + timedelta(days=1)).strftime("%Y-%m-%d")):
+            try:
+                refresh_plan(day, columns_for(weekday_column(day)), render)
+            except Exception as e:
+                print(f"❌ เตรียมแผนแจ้งเตือน {day} ไม่สำเร็จ:", e)
+        cleanup_plans()
+        time.sleep(interval)
+
+
+# wait() ถูกเรียกก่อนรอบแรก (เช่น รอให้รูปขนาดยาพร้อม จะได้ใส่ URL ของ bot ในแผน)
+def start_plan_refresher(columns_for, render, interval=REMINDER_PLAN_INTERVAL, wait=None):
+    global _refresher
+    if interval <= 0:
+        return None
+    if _refresher is None or not _refresher.is_alive():
+        _refresher = threading.Thread(target=_refresh_loop, args=(columns_for, render, interval, wait),
+                                      name="reminder-plan", daemon=True)
+        _refresher.start()
+    return _refresher
@@ -1,4 +1,4 @@
-import requests
+import http_transport
 
 SCRIPT_URL = "https://script.google.com/macros/s/AKfycbzzopJeXyDmbOPQv0qFjMXg-vGuxcRNQVMYP3VXEuaVns1rYzY1K0gD9a0UQvaKHVHs/exec"  # ⬅️ เปลี่ยนเป็น URL ของคุณ
 
@@ -13,7 +13,7 @@ def send_to_google_sheet(user_id, name, birthdate, inr, bleeding="", supplement=
         "warfarin_dose": warfarin_dose
     }
     try:
-        response = requests.post(SCRIPT_URL, json=payload)
+        response = http_transport.post(SCRIPT_URL, endpoint="apps_script_write", json=payload)
         print("✅ ส่งข้อมูล:", response.text)
     except Exception as e:
         print("❌ เกิดข้อผิดพลาด:", e)
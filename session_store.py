@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# ====== ที่เก็บ session ของ flow บันทึก INR (มีอายุ TTL; backend sqlite/redis อยู่รอดหลัง restart) ======
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory | sqlite | redis
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_DB = os.getenv("SESSION_DB", "/tmp/warfarin_sessions.db")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+
+class Session:
+    __slots__ = ("step", "name", "birthdate", "inr", "bleeding", "supplement", "warfarin_dose", "updated_at")
+
+    def __init__(self, step=None, **fields):
+        self.step = step
+        self.name = fields.get("name")
+        self.birthdate = fields.get("birthdate", "")
+        self.inr = fields.get("inr")
+        self.bleeding = fields.get("bleeding")
+        self.supplement = fields.get("supplement")
+        self.warfarin_dose = fields.get("warfarin_dose")
+        self.updated_at = fields.get("updated_at") or time.time()
+
+    def update(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+        self.updated_at = time.time()
+        return self
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def dumps(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, raw):
+        return cls.from_dict(json.loads(raw))
+
+
+# ====== interface กลาง ======
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def save(self, user_id, session):
+        raise NotImplementedError
+
+    def pop(self, user_id):
+        raise NotImplementedError
+
+    # เปลี่ยน step แบบ atomic: สำเร็จเมื่อ step ปัจจุบันตรงกับ expected_step เท่านั้น
+    def transition(self, user_id, expected_step, new_step, **fields):
+        raise NotImplementedError
+
+    # จบ flow: คืน session และลบออก ถ้า step ปัจจุบันตรงกับ expected_step
+    def finish(self, user_id, expected_step):
+        raise NotImplementedError
+
+    def start(self, user_id, step, **fields):
+        session = Session(step, **fields)
+        self.save(user_id, session)
+        return session
+
+    def count(self):
+        raise NotImplementedError
+
+
+# ====== เก็บใน memory ของ process (หายเมื่อ restart) ======
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        super().__init__(ttl)
+        self._data = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _alive(self, session):
+        return session is not None and time.time() - session.updated_at < self.ttl
+
+    def _sweep(self):
+        # ล้าง session ที่หมดอายุเป็นระยะ (ผู้ใช้ที่ทิ้ง flow กลางทาง)
+        self._writes += 1
+        if self._writes % 256 == 0:
+            now = time.time()
+            for user_id in [u for u, s in self._data.items() if now - s.updated_at >= self.ttl]:
+                del self._data[user_id]
+
+    def get(self, user_id):
+        with self._lock:
+            session = self._data.get(user_id)
+            if self._alive(session):
+                return session
+            self._data.pop(user_id, None)
+            return None
+
+    def save(self, user_id, session):
+        with self._lock:
+            session.updated_at = time.time()
+            self._data[user_id] = session
+            self._sweep()
+
+    def pop(self, user_id):
+        with self._lock:
+            session = self._data.pop(user_id, None)
+            return session if self._alive(session) else None
+
+    def transition(self, user_id, expected_step, new_step, **fields):
+        with self._lock:
+            session = self._data.get(user_id)
+            if not self._alive(session) or session.step != expected_step:
+                return None
+            return session.update(step=new_step, **fields)
+
+    def finish(self, user_id, expected_step):
+        with self._lock:
+            session = self._data.get(user_id)
+            if not self._alive(session) or session.step != expected_step:
+                return None
+            return self._data.pop(user_id)
+
+    def count(self):
+        with self._lock:
+            return sum(1 for s in self._data.values() if self._alive(s))
+
+
+# ====== เก็บใน SQLite (อยู่รอดหลัง restart) ======
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path=SESSION_DB, ttl=SESSION_TTL_SECONDS):
+        super().__init__(ttl)
+        self.path = path
+        self._writes = 0
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id TEXT PRIMARY KEY, step TEXT, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _load(self, conn, user_id):
+        row = conn.execute("SELECT data FROM sessions WHERE user_id = ? AND expires_at > ?",
+                           (user_id, time.time())).fetchone()
+        return Session.loads(row[0]) if row else None
+
+    def _store(self, conn, user_id, session):
+        session.updated_at = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (user_id, step, data, expires_at) VALUES (?, ?, ?, ?)",
+            (user_id, session.step, session.dumps(), session.updated_at + self.ttl)
+        )
+        self._writes += 1
+        if self._writes % 256 == 0:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def _atomic(self, func):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def get(self, user_id):
+        conn = self._connect()
+        try:
+            return self._load(conn, user_id)
+        finally:
+            conn.close()
+
+    def save(self, user_id, session):
+        self._atomic(lambda conn: self._store(conn, user_id, session))
+
+    def pop(self, user_id):
+        def _pop(conn):
+            session = self._load(conn, user_id)
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            return session
+        return self._atomic(_pop)
+
+    def transition(self, user_id, expected_step, new_step, **fields):
+        def _transition(conn):
+            session = self._load(conn, user_id)
+            if session is None or session.step != expected_step:
+                return None
+            session.update(step=new_step, **fields)
+            self._store(conn, user_id, session)
+            return session
+        return self._atomic(_transition)
+
+    def finish(self, user_id, expected_step):
+        def _finish(conn):
+            session = self._load(conn, user_id)
+            if session is None or session.step != expected_step:
+                return None
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            return session
+        return self._atomic(_finish)
+
+    def count(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+        finally:
+            conn.close()
+
+
+# ====== เก็บใน Redis (หรือ server ที่ใช้ protocol เดียวกัน) ======
+class RedisSessionStore(SessionStore):
+    def __init__(self, url=SESSION_REDIS_URL, ttl=SESSION_TTL_SECONDS, prefix="warfarin:session:"):
+        super().__init__(ttl)
+        import redis
+
+        self._redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id):
+        raw = self.client.get(self._key(user_id))
+        return Session.loads(raw) if raw else None
+
+    def save(self, user_id, session):
+        session.updated_at = time.time()
+        self.client.set(self._key(user_id), session.dumps(), ex=self.ttl)
+
+    def pop(self, user_id):
+        with self.client.pipeline() as pipe:
+            pipe.get(self._key(user_id))
+            pipe.delete(self._key(user_id))
+            raw, _ = pipe.execute()
+        return Session.loads(raw) if raw else None
+
+    def _compare_and_set(self, user_id, expected_step, apply):
+        key = self._key(user_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    session = Session.loads(raw) if raw else None
+                    if session is None or session.step != expected_step:
+                        pipe.unwatch()
+                        return None
+                    pipe.multi()
+                    apply(pipe, key, session)
+                    pipe.execute()
+                    return session
+                except self._redis.WatchError:
+                    continue
+
+    def transition(self, user_id, expected_step, new_step, **fields):
+        def _apply(pipe, key, session):
+            session.update(step=new_step, **fields)
+            pipe.set(key, session.dumps(), ex=self.ttl)
+        return self._compare_and_set(user_id, expected_step, _apply)
+
+    def finish(self, user_id, expected_step):
+        return self._compare_and_set(user_id, expected_step, lambda pipe, key, session: pipe.delete(key))
+
+    def count(self):
+        return sum(1 for _ in self.client.scan_iter(f"{self.prefix}*"))
+
+
+def create_session_store(backend=None):
+    backend = (backend or SESSION_BACKEND).lower()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "redis":
+        return RedisSessionStore()
+    return MemorySessionStore()
@@ -0,0 +1,175 @@
+import os
+import re
+import hashlib
+import threading
+
+from metrics import time_upstream
+
+# ====== Google Sheet (ตารางยารายสัปดาห์สำหรับแจ้งเตือน) ======
+SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
+SHEET_NAME = os.getenv("SHEET_NAME", "Sheet1")
+CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
+# คอลัมน์ timestamp ที่อัปเดตทุกครั้งที่แก้แถว (ถ้ามี) ใช้ทำ incremental read แบบไม่ต้องโหลดทุกคอลัมน์
+SHEET_UPDATED_COLUMN = os.getenv("SHEET_UPDATED_COLUMN", "")
+# worksheet ประวัติ INR ที่ Apps Script เขียน (ในไฟล์เดียวกัน) อ่านทั้ง cohort ได้ใน batch_get เดียว
+# ว่าง = ไม่อ่านตรง ต้องดึงทีละคนผ่าน Apps Script
+INR_HISTORY_SHEET = os.getenv("INR_HISTORY_SHEET", "")
+# ชื่อคอลัมน์ในชีตนั้นตามลำดับ: user id, วันที่, INR, เลือดออก, อาหารเสริม
+INR_HISTORY_COLUMNS = os.getenv("INR_HISTORY_COLUMNS", "userId,date,inr,bleeding,supplement").split(",")
+
+SCOPE = ['https://spreadsheets.google.com/feeds',
+         'https://www.googleapis.com/auth/drive']
+
+_lock = threading.RLock()
+_client = None
+_worksheets = {}   # ชื่อ worksheet → worksheet
+_headers = {}      # ชื่อ worksheet → แถวหัวตาราง
+
+
+def _load_credentials():
+    # gspread >= 6 ใช้ google-auth ซึ่งต่ออายุ token เองเมื่อหมดอายุ
+    from google.oauth2.service_account import Credentials
+    return Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPE)
+
+
+# ====== client ที่ใช้ซ้ำตลอดอายุ process ======
+def get_worksheet(sheet=None):
+    global _client
+    sheet = sheet or SHEET_NAME
+    with _lock:
+        if _client is None:
+            import gspread
+            _client = gspread.authorize(_load_credentials())
+        if sheet not in _worksheets:
+            _worksheets[sheet] = _client.open_by_key(SPREADSHEET_ID).worksheet(sheet)
+        return _worksheets[sheet]
+
+
+def reset_client():
+    global _client
+    with _lock:
+        _client = None
+        _worksheets.clear()
+        _headers.clear()
+
+
+def get_header(refresh=False, sheet=None):
+    sheet = sheet or SHEET_NAME
+    with _lock:
+        if sheet not in _headers or refresh:
+            with time_upstream("gspread", "row_values"):
+                _headers[sheet] = get_worksheet(sheet).row_values(1)
+        return _headers[sheet]
+
+
+def _column_letter(index):
+    from gspread.utils import rowcol_to_a1
+    return re.sub(r"\d", "", rowcol_to_a1(1, index))
+
+
+def _column_ranges(columns, first_row=2, last_row=None, sheet=None):
+    header = get_header(sheet=sheet)
+    if any(col not in header for col in columns):
+        # มีคอลัมน์ใหม่ในชีต → โหลด header ใหม่
+        header = get_header(refresh=True, sheet=sheet)
+    ranges = []
+    for col in columns:
+        if col not in header:
+            raise KeyError(f"ไม่พบคอลัมน์ {col} ในชีต")
+        letter = _column_letter(header.index(col) + 1)
+        ranges.append(f"{letter}{first_row}:{letter}{last_row or ''}")
+    return ranges
+
+
+def _batch_get(ranges, sheet=None):
+    with time_upstream("gspread", "batch_get"):
+        return get_worksheet(sheet).batch_get(ranges)
+
+
+def _cell(values, i):
+    if i < len(values) and values[i]:
+        return values[i][0]
+    return ""
+
+
+# ====== อ่านเฉพาะคอลัมน์ที่ต้องใช้ (range read ครั้งเดียว) ======
+def read_rows(columns, sheet=None):
+    columns = list(dict.fromkeys(columns))
+    results = _batch_get(_column_ranges(columns, sheet=sheet), sheet=sheet)
+    row_count = max((len(values) for values in results), default=0)
+
+    rows = []
+    for i in range(row_count):
+        row = {col: _cell(values, i) for col, values in zip(columns, results)}
+        if any(row.values()):
+            row["_row"] = i + 2
+            rows.append(row)
+    return rows
+
+
+# ====== ประวัติ INR ของทุกคนจาก INR_HISTORY_SHEET (อ่านเฉพาะคอลัมน์ที่ใช้ใน batch_get เดียว) ======
+# คืน {user_id: [{date, inr, bleeding, supplement}]} ใหม่ → เก่า (รูปแบบเดียวกับประวัติจาก Apps Script)
+def read_history_by_user():
+    user_col, date_col, inr_col, bleeding_col, supplement_col = INR_HISTORY_COLUMNS
+    history = {}
+    for row in read_rows(INR_HISTORY_COLUMNS, sheet=INR_HISTORY_SHEET):
+        try:
+            inr = float(row[inr_col])
+        except ValueError:
+            continue
+        if row[user_col] and row[date_col]:
+            history.setdefault(row[user_col], []).append({
+                "date": row[date_col], "inr": inr,
+                "bleeding": row[bleeding_col], "supplement": row[supplement_col],
+            })
+    for items in history.values():
+        # ชีตเรียงตามลำดับที่บันทึก (เก่า → ใหม่)
+        items.reverse()
+    return history
+
+
+def _row_hash(row, columns):
+    return hashlib.sha1("\x1f".join(str(row.get(col, "")) for col in columns).encode()).hexdigest()
+
+
+# ====== อ่านเฉพาะแถวที่เพิ่มหรือเปลี่ยนตั้งแต่ครั้งก่อน ======
+# previous = snapshot ที่คืนจากการอ่านครั้งก่อน {row: (stamp, hash)} (None = คืนทุกแถว)
+# ผู้เรียกเก็บ snapshot เอง (เช่น ในไฟล์แผนของแต่ละวัน) คืน (แถวที่เปลี่ยน, เลขแถวที่หายไป, snapshot ใหม่)
+def read_changed_rows(columns, previous=None):
+    columns = list(dict.fromkeys(columns))
+    if previous is not None and SHEET_UPDATED_COLUMN:
+        # อ่านแค่คอลัมน์ timestamp แล้วดึงเฉพาะแถวที่ timestamp เปลี่ยน
+        stamps = _batch_get(_column_ranges([SHEET_UPDATED_COLUMN]))[0]
+        current = {i + 2: _cell(stamps, i) for i in range(len(stamps))}
+        changed_rows = [r for r, stamp in current.items()
+                        if r not in previous or previous[r][0] != stamp]
+        ranges = []
+        for r in changed_rows:
+            ranges.extend(_column_ranges(columns, first_row=r, last_row=r))
+        results = _batch_get(ranges) if ranges else []
+
+        changed = []
+        snapshot = dict(previous)
+        for n, r in enumerate(changed_rows):
+            values = results[n * len(columns):(n + 1) * len(columns)]
+            row = {col: _cell(v, 0) for col, v in zip(columns, values)}
+            row["_row"] = r
+            snapshot[r] = (current[r], _row_hash(row, columns))
+            if any(row[col] for col in columns):
+                changed.append(row)
+        removed = [r for r in previous if r not in current]
+        for r in removed:
+            snapshot.pop(r, None)
+    else:
+        # ไม่มีคอลัมน์ timestamp → อ่านเฉพาะคอลัมน์ที่ใช้ แล้วเทียบ hash ทีละแถว
+        extra = [SHEET_UPDATED_COLUMN] if SHEET_UPDATED_COLUMN else []
+        rows = read_rows(columns + extra)
+        snapshot = {}
+        changed = []
+        for row in rows:
+            row_hash = _row_hash(row, columns)
+            snapshot[row["_row"]] = (row.get(SHEET_UPDATED_COLUMN, ""), row_hash)
+            if previous is None or previous.get(row["_row"], (None, None))[1] != row_hash:
+                changed.append(row)
+        removed = [r for r in (previous or {}) if r not in snapshot]
+    return changed, removed, snapshot
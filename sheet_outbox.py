@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+
+import http_transport
+
+# ====== Outbox สำหรับเขียนข้อมูลลง Google Sheet แบบ write-behind ======
+# webhook แค่บันทึกลง SQLite แล้วตอบกลับทันที ส่วน thread เบื้องหลังค่อยทยอยส่งไป Apps Script
+OUTBOX_DB = os.getenv("OUTBOX_DB", "/tmp/warfarin_outbox.db")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_FLUSH_INTERVAL = float(os.getenv("OUTBOX_FLUSH_INTERVAL", "1.0"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "50"))
+# ระยะเวลาที่ flusher จองแถวไว้ (กันหลาย process ส่งแถวเดียวกันซ้ำ) ต่ออายุระหว่างส่งเมื่อผ่านไปครึ่งหนึ่ง
+# จึงต้องยาวกว่าสองเท่าของ timeout ของ POST หนึ่งครั้ง (apps_script_write ใน http_transport)
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+# ถ้า Apps Script รองรับ {"batch": [...]} ให้เปิดเพื่อส่งหลายแถวใน POST เดียว
+APPS_SCRIPT_BATCH = os.getenv("APPS_SCRIPT_BATCH", "false").lower() in ("1", "true", "yes")
+# ลำดับการส่ง: priority น้อยส่งก่อน ข้อมูลจาก LINE ส่งก่อนงาน backfill ที่เข้าคิวทีละหลายหมื่นแถว
+PRIORITY_LIVE = 0
+PRIORITY_BACKFILL = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id TEXT,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    ref TEXT,
+    priority INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+"""
+
+_wake = threading.Event()
+_listeners = []
+_stats_lock = threading.Lock()
+_stats = {
+    "flushed": 0,
+    "failed_attempts": 0,
+    "dead": 0,
+    "last_post_ms": 0.0,
+    "avg_post_ms": 0.0,
+    "last_flush_latency_ms": 0.0,
+    "max_flush_latency_ms": 0.0,
+}
+_flusher = None
+_initialized = False
+
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    if not _initialized:
+        conn.executescript(_SCHEMA)
+        # spool จากเวอร์ชันก่อนยังไม่มีคอลัมน์ ref / priority
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+        for name, ddl in (("ref", "ref TEXT"), ("priority", "priority INTEGER NOT NULL DEFAULT 0")):
+            if name not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {ddl}")
+                except sqlite3.OperationalError:
+                    pass  # อีก process เพิ่งเพิ่มไปแล้ว
+        _initialized = True
+    return conn
+
+
+def add_flush_listener(listener):
+    # listener(kind, user_id, payload, ref) ถูกเรียกหลังส่งสำเร็จ; ref = ค่าที่ส่งมากับ enqueue (หรือ None)
+    _listeners.append(listener)
+
+
+# ====== บันทึกลง spool (commit ลงดิสก์ก่อนคืนค่า) ======
+# ref = id ของแถวในฐานข้อมูลในเครื่องที่ record นี้เขียน (dict) ให้ listener ทำเครื่องหมายได้ตรงแถว
+def enqueue(kind, url, payload, user_id=None, ref=None):
+    return enqueue_many(kind, url, [(payload, user_id, ref)])[0]
+
+
+# items = [(payload, user_id, ref), ...] บันทึกใน transaction เดียว (commit ครั้งเดียวต่อทั้งชุด)
+def enqueue_many(kind, url, items, priority=PRIORITY_LIVE):
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            record_ids = [conn.execute(
+                "INSERT INTO outbox (kind, user_id, url, payload, next_attempt_at, created_at, ref, priority) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, user_id, url, json.dumps(payload, ensure_ascii=False), now, now,
+                 None if ref is None else json.dumps(ref), priority)
+            ).lastrowid for payload, user_id, ref in items]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    _wake.set()
+    return record_ids
+
+
+def _claim_batch(conn, limit):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT id, kind, user_id, url, payload, attempts, created_at, ref FROM outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY priority, id LIMIT ?",
+            (now, limit)
+        ).fetchall()
+        if rows:
+            conn.executemany("UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                             [(now + OUTBOX_LEASE_SECONDS, row[0]) for row in rows])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
+
+
+def _backoff(attempts):
+    # exponential backoff + jitter
+    delay = min(OUTBOX_MAX_BACKOFF, 2 ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _post(url, body):
+    started = time.monotonic()
+    response = http_transport.post(url, endpoint="apps_script_write", json=body)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    with _stats_lock:
+        _stats["last_post_ms"] = round(elapsed_ms, 1)
+        _stats["avg_post_ms"] = round(_stats["avg_post_ms"] * 0.9 + elapsed_ms * 0.1, 1)
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def _request_id(row):
+    # id ของ record ที่คงเดิมทุกครั้งที่ลองส่งซ้ำ ให้ Apps Script ใช้กันเขียนแถวซ้ำ (เช่น POST แรก timeout แต่เขียนไปแล้ว)
+    return f"{row[0]}-{int(row[6] * 1000)}"
+
+
+def _body(row):
+    return dict(json.loads(row[4]), requestId=_request_id(row))
+
+
+def _extend_lease(conn, ids):
+    conn.execute(f"UPDATE outbox SET next_attempt_at = ? WHERE id IN ({','.join('?' * len(ids))})",
+                 (time.time() + OUTBOX_LEASE_SECONDS, *ids))
+
+
+def _send_rows(rows, conn):
+    # คืน {id: error หรือ None}; ส่งทีละ POST ลบแถวทันทีที่ POST ของแถวนั้นสำเร็จ (ไม่รอจบทั้งชุด
+    # ซึ่ง lease อาจหมดแล้ว process อื่นจองไปส่งซ้ำ) และต่อ lease ของแถวที่ยังไม่ได้ส่งก่อนหมดอายุ
+    results = {}
+    if APPS_SCRIPT_BATCH and len(rows) > 1:
+        by_url = {}
+        for row in rows:
+            by_url.setdefault(row[3], []).append(row)
+        posts = [(url, group, {"batch": [_body(row) for row in group]}) for url, group in by_url.items()]
+    else:
+        posts = [(row[3], [row], _body(row)) for row in rows]
+
+    lease_until = time.time() + OUTBOX_LEASE_SECONDS
+    for index, (url, group, body) in enumerate(posts):
+        if time.time() > lease_until - OUTBOX_LEASE_SECONDS / 2:
+            _extend_lease(conn, [row[0] for _, remaining, _ in posts[index:] for row in remaining])
+            lease_until = time.time() + OUTBOX_LEASE_SECONDS
+        try:
+            _post(url, body)
+        except Exception as e:
+            results.update({row[0]: str(e) for row in group})
+            continue
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in group])
+        results.update({row[0]: None for row in group})
+    return results
+
+
+def flush_once(limit=None):
+    conn = _connect()
+    try:
+        rows = _claim_batch(conn, limit or OUTBOX_BATCH_SIZE)
+        if not rows:
+            return 0
+        results = _send_rows(rows, conn)
+        now = time.time()
+
+        sent = [row for row in rows if results.get(row[0]) is None]
+        conn.execute("BEGIN IMMEDIATE")
+        for row in rows:
+            error = results.get(row[0])
+            if error is None:
+                continue
+            attempts = row[5] + 1
+            status = "dead" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+            conn.execute(
+                "UPDATE outbox SET attempts = ?, status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, status, now + _backoff(attempts), error, row[0])
+            )
+            with _stats_lock:
+                _stats["failed_attempts"] += 1
+                if status == "dead":
+                    _stats["dead"] += 1
+            print(f"❌ ส่งข้อมูลไป Google Sheet ไม่สำเร็จ (ครั้งที่ {attempts}):", error)
+        conn.execute("COMMIT")
+
+        if sent:
+            latency_ms = max((now - row[6]) * 1000 for row in sent)
+            with _stats_lock:
+                _stats["flushed"] += len(sent)
+                _stats["last_flush_latency_ms"] = round(latency_ms, 1)
+                _stats["max_flush_latency_ms"] = round(max(_stats["max_flush_latency_ms"], latency_ms), 1)
+        for row in sent:
+            for listener in _listeners:
+                try:
+                    listener(row[1], row[2], json.loads(row[4]), json.loads(row[7]) if row[7] else None)
+                except Exception as e:
+                    print("❌ outbox listener error:", e)
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def _flush_loop():
+    while True:
+        _wake.wait(OUTBOX_FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            # ส่งจนกว่าจะไม่มีแถวที่ถึงเวลาส่ง
+            while flush_once() >= OUTBOX_BATCH_SIZE:
+                pass
+        except Exception as e:
+            print("❌ outbox flush error:", e)
+            time.sleep(OUTBOX_FLUSH_INTERVAL)
+
+
+def start_flusher():
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():
+        _flusher = threading.Thread(target=_flush_loop, name="sheet-outbox", daemon=True)
+        _flusher.start()
+    return _flusher
+
+
+# ====== ตัวเลขสถานะของ outbox ======
+def outbox_stats():
+    conn = _connect()
+    try:
+        pending, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        dead = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'dead'").fetchone()[0]
+    finally:
+        conn.close()
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queue_depth"] = pending
+    stats["dead_letters"] = dead
+    stats["oldest_pending_seconds"] = round(time.time() - oldest, 1) if oldest else 0
+    return stats
@@ -0,0 +1,41 @@
+import io
+import json
+
+import pytest
+
+import sheet_outbox
+from inr_ingest import ingest, iter_records
+from inr_repository import InrRepository
+
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    monkeypatch.setattr(sheet_outbox, "OUTBOX_DB", str(tmp_path / "outbox.db"))
+    monkeypatch.setattr(sheet_outbox, "_initialized", False)
+    return InrRepository(str(tmp_path / "inr.db"))
+
+
+def run(repository, records):
+    body = io.BytesIO(json.dumps(records).encode("utf-8"))
+    return ingest(iter_records(body, "application/json"), repository, "http://sheet.test",
+                  describe=lambda dose: f"{dose} mg").as_dict()
+
+
+def record(user_id, **extra):
+    return dict(user_id=user_id, name="สมชาย ใจดี", inr=2.5, date="2024-01-15", **extra)
+
+
+# ขนาดยาที่ Decimal แปลงได้แต่ล้น (normalize() → Overflow) ต้องตีตกเฉพาะรายการนั้น
+@pytest.mark.parametrize("dose", ["3,3,3,3,3,3,1e1000000", "3,3,3,3,3,3,1e-1000000", "3,3,3,3,3,3,NaN"])
+def test_absurd_dose_rejects_only_that_record(repository, dose):
+    result = run(repository, [
+        record("U1", warfarin_dose="3,3,3,3,3,1.5,0"),
+        record("U2", warfarin_dose=dose),
+        record("U3"),
+    ])
+
+    assert "error" not in result
+    assert [item["status"] for item in result["results"]] == ["accepted", "rejected", "accepted"]
+    assert "warfarin_dose" in result["results"][1]["error"]
+    assert repository.history("U2")[0] == []
+    assert len(repository.history("U3")[0]) == 1
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+
+from inr_repository import SERIES_DATE_WIDTH
+
+# ====== Time in Therapeutic Range (TTR) ของผู้ป่วยทั้งหมดในรอบเดียว (NumPy, ไม่วน loop รายคน) ======
+# import numpy ในฟังก์ชันที่คำนวณ (ตอนงาน TTR รัน) ไม่ใช่ตอนเปิด app ที่แค่อ่านรายงานล่าสุด
+# ช่วงเป้าหมายเดียวกับแถบสีเขียวในกราฟ INR
+TTR_LOW = float(os.getenv("TTR_LOW", "2.0"))
+TTR_HIGH = float(os.getenv("TTR_HIGH", "3.5"))
+# ใช้ค่า INR ย้อนหลังกี่วัน (0 = ทั้งหมด)
+TTR_WINDOW_DAYS = int(os.getenv("TTR_WINDOW_DAYS", "365"))
+# ช่วงห่างระหว่างผลตรวจที่เกินนี้ไม่ interpolate (ตามแนวทาง Rosendaal ที่นิยมใช้ 56 วัน)
+TTR_MAX_GAP_DAYS = float(os.getenv("TTR_MAX_GAP_DAYS", "56"))
+# ผู้ป่วยที่ TTR ต่ำกว่านี้ถือว่าควบคุมได้ไม่ดี
+TTR_GOOD_CONTROL = float(os.getenv("TTR_GOOD_CONTROL", "65"))
+TTR_REPORT_DIR = os.getenv("TTR_REPORT_DIR", "/tmp/warfarin_ttr")
+# julianday('1970-01-01')
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+_lock = threading.Lock()
+_latest = None
+
+
+# ====== โหลดข้อมูล: array แบนๆ เรียงตาม (ผู้ป่วย, วันที่) + index กลุ่มของแต่ละแถว ======
+def load_series(repository, window_days=TTR_WINDOW_DAYS, today=None):
+    import numpy as np
+
+    today = today or datetime.now()
+    start = (today - timedelta(days=window_days)).strftime("%Y-%m-%d") if window_days else None
+    user_ids, counts, taken_at, inr_text = repository.inr_series(start)
+    # วันที่ ISO ความกว้างคงที่ → datetime64 ทั้งก้อน แล้วแปลงเป็นเลขวันแบบ julianday() ของ SQLite
+    seconds = np.frombuffer(taken_at.encode("ascii"), dtype=f"S{SERIES_DATE_WIDTH}").astype("datetime64[s]")
+    days = seconds.astype(np.int64) / 86400 + UNIX_EPOCH_JULIAN_DAY
+    inrs = np.array(inr_text.split(","), dtype=float) if inr_text else np.empty(0)
+    # แถวเรียงตามผู้ป่วยอยู่แล้ว → index กลุ่มสร้างจากจำนวนค่าของแต่ละคน
+    group = np.repeat(np.arange(len(user_ids)), counts)
+    return np.array(user_ids, dtype=str), group, days, inrs
+
+
+# ====== คำนวณทั้ง cohort ======
+def compute_ttr(patients, group, days, inrs, low=TTR_LOW, high=TTR_HIGH, max_gap=TTR_MAX_GAP_DAYS, today_day=None):
+    import numpy as np
+
+    n = len(patients)
+    counts = np.bincount(group, minlength=n).astype(float)
+
+    # Rosendaal: INR เปลี่ยนแบบเส้นตรงระหว่างผลตรวจสองครั้ง → สัดส่วนของช่วงที่อยู่ในเป้าหมาย
+    a, b = inrs[:-1], inrs[1:]
+    gap = days[1:] - days[:-1]
+    valid = (group[1:] == group[:-1]) & (gap > 0) & (gap <= max_gap)
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    overlap = np.clip(np.minimum(hi, high) - np.maximum(lo, low), 0, None)
+    span = hi - lo
+    flat = span == 0
+    fraction = np.where(flat, (lo >= low) & (lo <= high), overlap / np.where(flat, 1, span))
+    segment_group = group[1:][valid]
+    total_days = np.bincount(segment_group, weights=gap[valid], minlength=n)
+    in_range_days = np.bincount(segment_group, weights=(gap * fraction)[valid], minlength=n)
+
+    in_range = (inrs >= low) & (inrs <= high)
+    sums = np.bincount(group, weights=inrs, minlength=n)
+    squares = np.bincount(group, weights=inrs * inrs, minlength=n)
+    last_index = np.r_[np.flatnonzero(np.diff(group)), len(group) - 1] if n else np.array([], dtype=np.int64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ttr = np.where(total_days > 0, in_range_days / total_days * 100, np.nan)
+        pct_in_range = np.bincount(group, weights=in_range, minlength=n) / counts * 100
+        mean = sums / counts
+        # SD แบบ sample (n-1); คนที่มีค่าเดียวได้ NaN
+        variance = np.where(counts > 1, (squares - counts * mean * mean) / (counts - 1), np.nan)
+        inr_sd = np.sqrt(np.clip(variance, 0, None))
+    if today_day is None:
+        today_day = _julian_day(datetime.now())
+    return {
+        "user_id": patients,
+        "readings": counts.astype(int),
+        "ttr": ttr,
+        "pct_in_range": pct_in_range,
+        "inr_mean": mean,
+        "inr_sd": inr_sd,
+        "last_inr": inrs[last_index],
+        "days_since_last_test": np.floor(today_day - days[last_index]).astype(int),
+    }
+
+
+def _julian_day(moment):
+    # เท่ากับ julianday() ของ SQLite และเลขวันใน load_series (เวลา local แบบไม่มี timezone)
+    return (moment - datetime(1970, 1, 1)).total_seconds() / 86400 + UNIX_EPOCH_JULIAN_DAY
+
+
+def _round(values, digits=1):
+    import numpy as np
+
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def summarize(result):
+    import numpy as np
+
+    ttr = result["ttr"][~np.isnan(result["ttr"])]
+    overdue = result["days_since_last_test"]
+    return {
+        "patients": len(result["user_id"]),
+        "patients_with_ttr": int(ttr.size),
+        "readings": int(result["readings"].sum()),
+        "ttr_mean": round(float(ttr.mean()), 1) if ttr.size else None,
+        "ttr_median": round(float(np.median(ttr)), 1) if ttr.size else None,
+        "good_control_pct": round(float((ttr >= TTR_GOOD_CONTROL).mean() * 100), 1) if ttr.size else None,
+        "ttr_histogram": dict(zip(["0-20", "20-40", "40-60", "60-80", "80-100"],
+                                  np.histogram(ttr, bins=[0, 20, 40, 60, 80, 100.0001])[0].tolist())),
+        # ไม่ได้ตรวจ INR นานเกินช่วงที่ใช้ interpolate
+        "overdue_patients": int((overdue > TTR_MAX_GAP_DAYS).sum()),
+    }
+
+
+def patient_rows(result):
+    columns = [result["user_id"].tolist(), result["readings"].tolist(), _round(result["ttr"]),
+               _round(result["pct_in_range"]), _round(result["inr_mean"], 2), _round(result["inr_sd"], 2),
+               _round(result["last_inr"], 2), result["days_since_last_test"].tolist()]
+    keys = ["user_id", "readings", "ttr", "pct_in_range", "inr_mean", "inr_sd", "last_inr", "days_since_last_test"]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+# ====== รายงาน (เก็บเป็นไฟล์ JSON ล่าสุดไว้ให้ endpoint อ่าน) ======
+def build_report(repository, today=None):
+    today = today or datetime.now()
+    started = time.perf_counter()
+    patients, group, days, inrs = load_series(repository, today=today)
+    loaded = time.perf_counter()
+    result = compute_ttr(patients, group, days, inrs, today_day=_julian_day(today))
+    computed = time.perf_counter()
+    return {
+        "generated_at": today.isoformat(timespec="seconds"),
+        "range": [TTR_LOW, TTR_HIGH],
+        "window_days": TTR_WINDOW_DAYS,
+        "cohort": summarize(result),
+        "timing": {"load_seconds": round(loaded - started, 3), "compute_seconds": round(computed - loaded, 3)},
+        "patients": patient_rows(result),
+    }
+
+
+def _report_path():
+    return os.path.join(TTR_REPORT_DIR, "ttr_latest.json")
+
+
+def save_report(report):
+    global _latest
+    os.makedirs(TTR_REPORT_DIR, exist_ok=True)
+    path = _report_path()
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    with _lock:
+        _latest = report
+
+
+def load_report():
+    global _latest
+    with _lock:
+        if _latest is not None:
+            return _latest
+    try:
+        with open(_report_path(), encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    with _lock:
+        _latest = report
+    return report
+
+
+# ====== runner สำหรับ notify_jobs (register_job_kind("ttr_analytics", ...)) ======
+# hydrate() ดึงผู้ป่วยทั้ง cohort จากชีตลงเครื่องก่อนคำนวณ คืน coverage ที่มี "partial"
+def make_job_runner(repository, hydrate=None):
+    def run_ttr_job(job, checkpoint):
+        coverage = hydrate() if hydrate else {"partial": True, "reason": "cohort not hydrated"}
+        report = build_report(repository)
+        report["coverage"] = coverage
+        report["partial"] = coverage["partial"]
+        save_report(report)
+        cohort = report["cohort"]
+        print(f"📊 TTR: {cohort['patients']} คน เฉลี่ย {cohort['ttr_mean']}% "
+              f"(load {report['timing']['load_seconds']}s, compute {report['timing']['compute_seconds']}s)")
+        return dict(cohort, partial=report["partial"], **report["timing"])
+    return run_ttr_job
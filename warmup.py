@@ -0,0 +1,61 @@
+import os
+import time
+import threading
+
+from metrics import time_upstream
+
+# ====== โหลดของหนักแบบ lazy + warm-up เบื้องหลังหลังเปิด server ======
+WARMUP_DELAY_SECONDS = float(os.getenv("WARMUP_DELAY_SECONDS", "1"))
+LINE_API_BASE_URL = os.getenv("LINE_API_BASE_URL", "https://api.line.me").rstrip("/")
+
+
+# สร้าง MessagingApi ตอนเรียกใช้ครั้งแรก (import linebot.v3.messaging ใช้เวลานาน)
+class LazyMessagingApi:
+    def __init__(self, access_token):
+        self._access_token = access_token
+        self._api = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._api is None:
+            with self._lock:
+                if self._api is None:
+                    from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
+                    configuration = Configuration(access_token=self._access_token, host=LINE_API_BASE_URL)
+                    self._api = MessagingApi(ApiClient(configuration))
+        return self._api
+
+    def __getattr__(self, name):
+        attr = getattr(self._load(), name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        # จับเวลาทุกการเรียก LINE API (เช่น reply_message) แยกตามชื่อ method
+        def timed(*args, **kwargs):
+            with time_upstream("line_api", name):
+                return attr(*args, **kwargs)
+        return timed
+
+
+def warm_up(messaging_api=None):
+    started = time.monotonic()
+    try:
+        if messaging_api is not None:
+            messaging_api._load()
+        # โหลด renderer กราฟ (matplotlib: import + font cache, pil: ฟอนต์ + พื้นหลังกราฟ) และเลือกฟอนต์ไทย
+        from inr_chart import CHART_RENDERER, get_chart_renderer, has_thai_font
+        renderer = get_chart_renderer()
+        if CHART_RENDERER == "pil":
+            font = os.path.basename(renderer.font_path or "default")
+        else:
+            font = "yes" if has_thai_font() else "no"
+        print(f"🔥 warm-up เสร็จใน {time.monotonic() - started:.2f}s ({CHART_RENDERER}, Thai font: {font})")
+    except Exception as e:
+        print("❌ warm-up error:", e)
+
+
+def start_warmup(messaging_api=None, delay=WARMUP_DELAY_SECONDS):
+    timer = threading.Timer(delay, warm_up, args=(messaging_api,))
+    timer.daemon = True
+    timer.start()
+    return timer
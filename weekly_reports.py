@@ -0,0 +1,162 @@
+import os
+import time
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import CHART_SECONDS
+from image_store import make_preview, store_image_urls
+from notify_fanout import fan_out
+from notify_jobs import save_rows_snapshot, load_rows_snapshot
+
+# ====== รายงานกราฟ INR ประจำสัปดาห์ส่งให้ผู้ป่วยทุกคน ======
+# วาดกราฟใน process pool (matplotlib ติด GIL และ pyplot วาดได้ทีละรูป) แต่ละ worker มี figure เดียวใช้ซ้ำทุกคน
+# process หลักอ่านประวัติจาก SQLite / เก็บรูป / ส่ง LINE; worker แค่วาดรูป
+# ค่าเริ่มต้นนับ CPU ที่ process นี้ใช้ได้จริง (os.cpu_count() คืนจำนวน core ของเครื่อง host ไม่ใช่ของ container)
+# และจำกัดไว้ไม่เกิน WEEKLY_REPORT_MAX_WORKERS เพราะแต่ละ worker โหลด matplotlib เอง (container มี RAM 512 MB)
+WEEKLY_REPORT_MAX_WORKERS = int(os.getenv("WEEKLY_REPORT_MAX_WORKERS", "2"))
+# จำนวนผู้ป่วยต่อชุด (วาดชุดถัดไปไว้ระหว่างส่งชุดนี้ และบันทึก checkpoint ทุกชุด)
+WEEKLY_REPORT_CHUNK = int(os.getenv("WEEKLY_REPORT_CHUNK", "200"))
+WEEKLY_REPORT_POINTS = int(os.getenv("WEEKLY_REPORT_POINTS", "12"))
+# ส่งเฉพาะผู้ป่วยที่มีค่า INR ภายในกี่วันที่ผ่านมา
+WEEKLY_REPORT_ACTIVE_DAYS = int(os.getenv("WEEKLY_REPORT_ACTIVE_DAYS", "180"))
+# เวลาส่งอัตโนมัติ "HH:MM" (ว่าง = ไม่ตั้งเวลา สั่งผ่าน /weekly_report เท่านั้น) และวันในสัปดาห์ (0 = จันทร์)
+WEEKLY_REPORT_AT = os.getenv("WEEKLY_REPORT_AT", "")
+WEEKLY_REPORT_WEEKDAY = int(os.getenv("WEEKLY_REPORT_WEEKDAY", "0"))
+TARGET_LOW, TARGET_HIGH = 2.0, 3.5
+
+_renderer = None
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+WEEKLY_REPORT_WORKERS = int(os.getenv("WEEKLY_REPORT_WORKERS", "0")) or max(1, min(available_cpus(),
+                                                                                   WEEKLY_REPORT_MAX_WORKERS))
+
+
+# ====== ฝั่ง worker process ======
+def _init_worker():
+    global _renderer
+    from inr_chart import create_renderer
+
+    _renderer = create_renderer()
+
+
+def _render(item):
+    user_id, dates, inrs = item
+    started = time.perf_counter()
+    png = _renderer.render(dates, inrs)
+    return user_id, png, make_preview(png), time.perf_counter() - started
+
+
+def _mp_context():
+    # spawn: worker เริ่มจาก process ใหม่ ไม่ fork จาก app.py ที่มีหลาย thread (lock ที่ thread อื่นถืออยู่ตอน fork
+    # จะค้างใน worker ตลอดไป) ถ้า server รันด้วย python app.py worker จะ import app.py เป็น __mp_main__
+# ซึ่ง app.py ไม่เริ่ม thread เบื้องหลังให้
+    return multiprocessing.get_context("spawn")
+
+
+def create_pool(workers=None):
+    return ProcessPoolExecutor(max_workers=workers or WEEKLY_REPORT_WORKERS,
+                               mp_context=_mp_context(), initializer=_init_worker)
+
+
+def render_charts(pool, items, workers=None):
+    # items = [(user_id, dates, inrs)] เก่า → ใหม่; ส่งงานเข้า pool ทันที คืน iterator ของผลตามลำดับเดิม
+    workers = workers or WEEKLY_REPORT_WORKERS
+    return pool.map(_render, items, chunksize=max(1, len(items) // (workers * 4)))
+
+
+# ====== ฝั่ง process หลัก ======
+def week_key(moment=None):
+    year, week, _ = (moment or datetime.now()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def report_text(dates, inrs):
+    # dates/inrs เก่า → ใหม่
+    in_range = sum(1 for v in inrs if TARGET_LOW <= v <= TARGET_HIGH)
+    lines = [
+        "📈 สรุปค่า INR ประจำสัปดาห์",
+        f"ค่าล่าสุด {inrs[-1]:.1f} (วันที่ {dates[-1]})",
+        f"อยู่ในช่วงเป้าหมาย {TARGET_LOW}–{TARGET_HIGH} จำนวน {in_range} จาก {len(inrs)} ครั้งล่าสุด",
+    ]
+    if inrs[-1] > TARGET_HIGH or inrs[-1] < TARGET_LOW:
+        lines.append("⚠️ ค่าล่าสุดอยู่นอกช่วงเป้าหมาย กรุณาปรึกษาแพทย์/เภสัชกร")
+    return "\n".join(lines)
+
+
+def load_items(repository, user_ids, points=WEEKLY_REPORT_POINTS):
+    items = []
+    for user_id in user_ids:
+        dates, inrs = repository.history(user_id, last=points)
+        if dates:
+            dates.reverse()
+            inrs.reverse()
+            items.append((user_id, dates, inrs))
+    return items
+
+
+# ====== runner สำหรับ notify_jobs (register_job_kind("weekly_report", ...)) ======
+# hydrate() ดึงผู้ป่วยทั้ง cohort จากชีตลงเครื่องก่อนทำ snapshot รายชื่อ คืน coverage ที่มี "partial"
+def make_job_runner(repository, workers=None, hydrate=None):
+    def run_weekly_report_job(job, checkpoint):
+        params = job["params"]
+        if params.get("week") != week_key():
+            # งานของสัปดาห์ก่อนที่ค้างไว้ ไม่ส่งต่อ
+            return {**(job.get("summary") or {}), "expired": True}
+
+        user_ids = load_rows_snapshot(job["id"])
+        partial = None
+        if user_ids is None:
+            partial = (hydrate() if hydrate else {"partial": True})["partial"]
+            since = (datetime.now() - timedelta(days=WEEKLY_REPORT_ACTIVE_DAYS)).strftime("%Y-%m-%d")
+            user_ids = repository.patient_ids(active_since=since)
+            save_rows_snapshot(job["id"], user_ids)
+
+        # checkpoint = จำนวนผู้ป่วยใน snapshot ที่ทำไปแล้ว
+        position = job.get("checkpoint") or 0
+        summary = job.get("summary") or {"sent": 0, "failed": 0, "skipped": 0, "rendered": 0,
+                                          "render_seconds": 0, "elapsed_seconds": 0}
+        if partial is not None:
+            # รายชื่อไม่ครบทุกคนในชีต (ดึงบางคนไม่สำเร็จ / ไม่ได้ตั้ง SPREADSHEET_ID)
+            summary["partial"] = partial
+        total = len(user_ids)
+        pool_size = workers or WEEKLY_REPORT_WORKERS
+        chunks = [user_ids[i:i + WEEKLY_REPORT_CHUNK] for i in range(position, total, WEEKLY_REPORT_CHUNK)]
+        if not chunks:
+            return summary
+
+        print(f"🖼️ รายงานประจำสัปดาห์: {total - position} คน, {pool_size} worker")
+        with create_pool(pool_size) as pool:
+            items = load_items(repository, chunks[0])
+            pending = render_charts(pool, items, pool_size)
+            for index, user_chunk in enumerate(chunks):
+                started = time.monotonic()
+                current, histories = pending, {user_id: (dates, inrs) for user_id, dates, inrs in items}
+                skipped = len(user_chunk) - len(items)
+                if index + 1 < len(chunks):
+                    # วาดชุดถัดไประหว่างเก็บรูปและส่งชุดนี้
+                    items = load_items(repository, chunks[index + 1])
+                    pending = render_charts(pool, items, pool_size)
+
+                recipients = []
+                for user_id, png, preview, seconds in current:
+                    CHART_SECONDS.observe(seconds, stage="weekly_render")
+                    summary["render_seconds"] += seconds
+                    summary["rendered"] += 1
+                    recipients.append((user_id, report_text(*histories[user_id]), store_image_urls(png, preview)))
+                result = fan_out(recipients, skipped=skipped)
+                for key in ("sent", "failed", "skipped", "elapsed_seconds"):
+                    summary[key] = round(summary[key] + result[key], 3)
+                summary["render_seconds"] = round(summary["render_seconds"], 3)
+                position += len(user_chunk)
+                checkpoint(position, summary, rows_done=position, rows_total=total,
+                           chunk_seconds=round(time.monotonic() - started, 3))
+        return summary
+    return run_weekly_report_job